@@ -1,41 +1,111 @@
+import argparse
+import os
 import tkinter as tk
+from tkinter import messagebox, simpledialog
 from ui_manager import UIManager
 from database_utils import DatabaseHandler
+from profiles import ProfileManager
+import bulk_io
+import retention
+from crypto_store import PASSPHRASE_ENV
 
 class ReminderApp:
-    def __init__(self):
+    def __init__(self, db_name="chat.db", profiles_dir=None, profile=None, encrypted=False):
         self.root = tk.Tk()
         self.root.title("Reminder Project")
         self.root.geometry("800x600")
         
-        # Initialize database
-        self.db_handler = DatabaseHandler()
-        self.db_handler.init_db()
-        
-        # Make sure all necessary columns exist
-        self.db_handler.add_column_if_not_exists("messages", "category", "TEXT")
-        self.db_handler.add_column_if_not_exists("messages", "message_type", "TEXT DEFAULT 'text'")
-        self.db_handler.add_column_if_not_exists("messages", "project", "TEXT DEFAULT 'main'")
-        self.db_handler.add_column_if_not_exists("messages", "file_path", "TEXT DEFAULT ''")
+        # With a profiles directory, every database in it is a profile that can be switched to
+        self.profiles = None
+        if profiles_dir:
+            self.profiles = ProfileManager.from_directory(profiles_dir, active=profile)
+            self.db_handler = self.profiles.switch()
+            self.root.title(f"Reminder Project - {self.profiles.active}")
+        else:
+            # Initialize database and make sure all necessary columns exist
+            self.db_handler = DatabaseHandler(db_name)
+            self.db_handler.ensure_schema()
+            if encrypted or os.environ.get(PASSPHRASE_ENV):
+                self.unlock_database()
         
         # Initialize UI
-        self.ui_manager = UIManager(self.root, self.db_handler)
+        self.ui_manager = UIManager(self.root, self.db_handler, profiles=self.profiles)
         
         # Set up closing handler
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
     
+    def unlock_database(self):
+        """Enable encryption of the database, asking for its passphrase unless the environment has it."""
+        passphrase = os.environ.get(PASSPHRASE_ENV)
+        while True:
+            if not passphrase:
+                passphrase = simpledialog.askstring("Encrypted database", f"Passphrase of {self.db_handler.db_name}:",
+                                                    show="*", parent=self.root)
+            if not passphrase:
+                self.root.destroy()
+                raise SystemExit("No passphrase given")
+            try:
+                self.db_handler.enable_encryption(passphrase)
+                return
+            except ValueError as e:
+                messagebox.showerror("Encrypted database", str(e), parent=self.root)
+                passphrase = None
+
     def run(self):
         """Start the application."""
         self.root.mainloop()
     
     def on_closing(self):
         """Handle application closing."""
-        self.ui_manager.auto_update_active = False
-        self.root.destroy()
+        self.ui_manager.on_closing()
+
+def build_parser():
+    """Build the command line parser for the GUI and its subcommands."""
+    parser = argparse.ArgumentParser(description="Reminder Project")
+    parser.add_argument("--db", default="chat.db", help="Path to the SQLite database")
+    parser.add_argument("--profiles-dir", default=None,
+                        help="Directory with one database per profile; the GUI can switch between them")
+    parser.add_argument("--profile", default=None, help="Profile opened first (with --profiles-dir)")
+    parser.add_argument("--encrypted", action="store_true",
+                        help=f"Encrypt messages and attachments at rest, asking for the passphrase "
+                             f"(or reading it from {PASSPHRASE_ENV})")
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    headless_parser = subparsers.add_parser(
+        "headless", help="Classify the backlog and fire reminders without the Tk UI"
+    )
+    # Imported lazily so the GUI does not need the Gemini client installed
+    from headless import add_arguments
+    add_arguments(headless_parser)
+
+    export_parser = subparsers.add_parser("export", help="Export a table to JSONL or CSV")
+    bulk_io.add_arguments(export_parser, importing=False)
+    import_parser = subparsers.add_parser("import", help="Import a table from JSONL or CSV")
+    bulk_io.add_arguments(import_parser, importing=True)
+
+    archive_parser = subparsers.add_parser(
+        "archive", help="Set retention policies and move old messages to the archive database"
+    )
+    retention.add_arguments(archive_parser)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "headless":
+        from headless import run_from_args
+        return run_from_args(args)
+
+    if args.command in ("export", "import"):
+        return bulk_io.run_from_args(args, importing=args.command == "import")
+
+    if args.command == "archive":
+        return retention.run_from_args(args)
 
-def main():
-    app = ReminderApp()
+    app = ReminderApp(args.db, profiles_dir=args.profiles_dir, profile=args.profile, encrypted=args.encrypted)
     app.run()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
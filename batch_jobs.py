@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from classification import ResponseParser
+
+logger = logging.getLogger(__name__)
+
+# Two days: batch jobs are allowed up to 24 hours to finish
+BATCH_LEASE_SECONDS = 2 * 24 * 3600
+
+_LINE_RE = re.compile(r"^(\d+)\. ", re.MULTILINE)
+
+
+class LocalBatchService:
+    """
+    Stand-in for GeminiBatchService that runs jobs locally, for offline runs and tests.
+
+    Jobs are kept as files in a directory, so they survive restarts like real
+    ones. A job succeeds `delay` seconds after it was submitted; its results
+    are computed on the first status check after that by calling responder on
+    each request. A responder that raises produces an error line for that
+    request, like a failed request in a real batch.
+    """
+
+    def __init__(self, directory, responder=None, delay=0.0):
+        """
+        Args:
+            directory (str): Where the jobs are stored
+            responder (callable, optional): request dict -> response text. Defaults to null_responder.
+            delay (float, optional): Seconds before a job finishes. Defaults to 0.
+        """
+        self.directory = directory
+        self.responder = responder or null_responder
+        self.delay = delay
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, request_path, display_name):
+        job_name = f"local-{uuid.uuid4().hex}"
+        with open(request_path, encoding="utf-8") as src, open(self._path(job_name, "requests.jsonl"), "w", encoding="utf-8") as dst:
+            dst.write(src.read())
+        with open(self._path(job_name, "json"), "w", encoding="utf-8") as f:
+            json.dump({"display_name": display_name, "submitted_at": time.time()}, f)
+        return job_name
+
+    def status(self, job_name):
+        if not os.path.exists(self._path(job_name, "json")):
+            return "failed"
+        if os.path.exists(self._path(job_name, "results.jsonl")):
+            return "succeeded"
+        with open(self._path(job_name, "json"), encoding="utf-8") as f:
+            submitted_at = json.load(f)["submitted_at"]
+        if time.time() - submitted_at < self.delay:
+            return "running"
+        self._run(job_name)
+        return "succeeded"
+
+    def results(self, job_name):
+        results = []
+        with open(self._path(job_name, "results.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                results.append((entry["key"], entry.get("text"), entry.get("error")))
+        return results
+
+    def _run(self, job_name):
+        tmp_path = self._path(job_name, "results.jsonl.tmp")
+        with open(self._path(job_name, "requests.jsonl"), encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                entry = json.loads(line)
+                try:
+                    result = {"key": entry["key"], "text": self.responder(entry["request"])}
+                except Exception as e:
+                    result = {"key": entry["key"], "error": str(e)}
+                dst.write(json.dumps(result) + "\n")
+        os.replace(tmp_path, self._path(job_name, "results.jsonl"))
+
+    def _path(self, job_name, suffix):
+        return os.path.join(self.directory, f"{job_name}.{suffix}")
+
+
+def null_responder(request):
+    """Answer a classification request with project NULL for every numbered message."""
+    prompt = "".join(part.get("text", "") for part in request["contents"][0]["parts"])
+    messages = prompt.split("messages:", 1)[-1]
+    return json.dumps({"messages": [
+        {"index of the message": int(index), "project": "NULL"} for index in _LINE_RE.findall(messages)
+    ]})
+
+
+class LocalRequestBuilder:
+    """
+    Builds the same requests as GeminiHandler.build_batch_request without google-genai.
+
+    Only the prompt is included; enough for LocalBatchService.
+    """
+
+    @staticmethod
+    def build_batch_request(chunk, projects):
+        prompt = f"\nprojects:\n{projects}\n\nmessages:\n{chunk}\n"
+        return {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+
+class BatchClassifier:
+    """
+    Classify a large backlog through offline batch jobs instead of one request per chunk.
+
+    Pending messages are claimed with a lease long enough to outlive the job,
+    grouped into chunks (numbered from 0 within each chunk), written as one
+    JSONL request file and submitted. Jobs and the message IDs of every chunk
+    are recorded in the batch_jobs table, so a restarted process picks up
+    polling where the previous one stopped. Results go through
+    ResponseParser and apply_classifications, like interactive
+    classification.
+    """
+
+    def __init__(self, db_handler, gemini_handler, service, directory, chunk_size=16384,
+                 lease_seconds=BATCH_LEASE_SECONDS):
+        """
+        Args:
+            db_handler (DatabaseHandler): The database to work on
+            gemini_handler (GeminiHandler): Builds the requests (build_batch_request)
+            service: GeminiBatchService, LocalBatchService or any object with submit, status and results
+            directory (str): Where request files are written
+            chunk_size (int, optional): Maximum characters of messages and project context per request. Defaults to 16384.
+            lease_seconds (int, optional): How long claimed messages stay reserved for a job. Defaults to two days.
+        """
+        self.db_handler = db_handler
+        self.gemini_handler = gemini_handler
+        self.service = service
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.parser = ResponseParser()
+        self.stop_event = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+        db_handler.create_table("batch_jobs", {
+            "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+            "job_name": "TEXT",
+            # prepared -> submitted -> applied, or failed
+            "state": "TEXT NOT NULL",
+            "request_path": "TEXT NOT NULL",
+            # {key: [message IDs in prompt order]}
+            "chunks": "TEXT NOT NULL",
+            "created_at": "DATETIME DEFAULT CURRENT_TIMESTAMP",
+            "finished_at": "DATETIME",
+            "error": "TEXT"
+        })
+
+    def submit(self, max_messages=10000):
+        """
+        Claim up to max_messages pending messages and submit them as one batch job.
+
+        Returns:
+            int: The batch_jobs ID, or None when the backlog is empty
+        """
+        messages = self.db_handler.claim_unprocessed_messages(max_messages, self.lease_seconds)
+        if not messages:
+            return None
+
+        projects = self.db_handler.get_projects_context()
+        for msg in messages:
+            msg.message = self.db_handler.reveal(msg.message)
+        chunks = self.group_into_chunks(messages, len(projects))
+
+        request_path = os.path.join(self.directory, f"batch-{int(time.time())}-{uuid.uuid4().hex[:8]}.jsonl")
+        with open(request_path, "w", encoding="utf-8") as f:
+            for key, chunk in chunks.items():
+                text = "\n".join(f"{i}. {msg['message']}" for i, msg in enumerate(chunk))
+                request = self.gemini_handler.build_batch_request(text, projects)
+                f.write(json.dumps({"key": key, "request": request}, ensure_ascii=False))
+                f.write("\n")
+
+        chunk_ids = {key: [msg["id"] for msg in chunk] for key, chunk in chunks.items()}
+        self.db_handler.cursor.execute(
+            "INSERT INTO batch_jobs (state, request_path, chunks) VALUES ('prepared', ?, ?)",
+            (request_path, json.dumps(chunk_ids))
+        )
+        job_id = self.db_handler.cursor.lastrowid
+        self.db_handler.commit()
+
+        self._submit(job_id, request_path)
+        return job_id
+
+    def group_into_chunks(self, messages, context_size=0):
+        """
+        Group messages into chunks whose numbered lines fit chunk_size next to the project context.
+
+        A message longer than a whole chunk gets a chunk of its own.
+
+        Returns:
+            dict: key -> list of messages
+        """
+        budget = max(self.chunk_size - context_size, 1)
+        chunks = {}
+        current = []
+        size = 0
+        for msg in messages:
+            line_size = len(msg["message"]) + 8
+            if current and size + line_size > budget:
+                chunks[f"chunk-{len(chunks)}"] = current
+                current = []
+                size = 0
+            current.append(msg)
+            size += line_size
+        if current:
+            chunks[f"chunk-{len(chunks)}"] = current
+        return chunks
+
+    def poll(self):
+        """
+        Check every unfinished job once, applying the results of those that are done.
+
+        Returns:
+            int: Number of jobs still running
+        """
+        self.db_handler.cursor.execute(
+            "SELECT id, job_name, state, request_path FROM batch_jobs WHERE state IN ('prepared', 'submitted') ORDER BY id"
+        )
+        active = 0
+        for job_id, job_name, state, request_path in self.db_handler.cursor.fetchall():
+            if state == "prepared":
+                # The process stopped between writing the request file and recording the job name
+                job_name = self._submit(job_id, request_path)
+                if job_name is None:
+                    continue
+            try:
+                status = self.service.status(job_name)
+            except Exception:
+                logger.exception("Could not get the status of batch job %s", job_name)
+                active += 1
+                continue
+
+            if status == "succeeded":
+                self.ingest(job_id, job_name)
+            elif status == "failed":
+                self._fail(job_id, f"batch job {job_name} failed")
+            else:
+                active += 1
+        return active
+
+    def ingest(self, job_id, job_name):
+        """
+        Apply the results of a finished job. Chunks that came back with an error are released for a retry.
+
+        The classifications, the released chunks and the job's 'applied' state
+        are committed together, so a crash leaves the job 'submitted' with none
+        of its results applied and the next poll ingests it again from scratch.
+        """
+        self.db_handler.cursor.execute("SELECT chunks FROM batch_jobs WHERE id = ?", (job_id,))
+        chunk_ids = json.loads(self.db_handler.cursor.fetchone()[0])
+
+        classifications = []
+        answered = set()
+        for key, text, error in self.service.results(job_name):
+            message_ids = chunk_ids.get(key)
+            if message_ids is None:
+                continue
+            if error is not None or text is None:
+                logger.warning("Batch job %s: %s failed: %s", job_name, key, error)
+                continue
+            answered.add(key)
+            # Messages the model did not mention are still marked as processed
+            classifications.extend(self.parser.parse_all([text], message_ids))
+
+        failed_ids = [message_id for key, ids in chunk_ids.items() if key not in answered for message_id in ids]
+        with self.db_handler.transaction():
+            self.db_handler.apply_classifications(classifications)
+            if failed_ids:
+                self.db_handler.release_claimed_messages(failed_ids)
+            self.db_handler.cursor.execute(
+                "UPDATE batch_jobs SET state = 'applied', finished_at = CURRENT_TIMESTAMP, error = ? WHERE id = ?",
+                (f"{len(failed_ids)} messages released" if failed_ids else None, job_id)
+            )
+        logger.info("Batch job %s applied: %d classified, %d released, parsing: %s", job_name,
+                    len(classifications), len(failed_ids), self.parser.metrics.as_dict())
+
+    def run(self, max_messages=10000, initial_delay=30.0, max_delay=600.0, backoff=1.5):
+        """
+        Submit the backlog (unless jobs are still running from a previous run) and wait for every job.
+
+        Polls with exponential back-off from initial_delay up to max_delay seconds.
+        """
+        if not self.poll():
+            self.submit(max_messages)
+
+        delay = initial_delay
+        while not self.stop_event.is_set() and self.poll():
+            logger.info("Batch jobs still running, next check in %.0f s", delay)
+            self.stop_event.wait(delay)
+            delay = min(delay * backoff, max_delay)
+
+    def stop(self):
+        """Ask run to return; unfinished jobs are resumed by the next run."""
+        self.stop_event.set()
+
+    def _submit(self, job_id, request_path):
+        try:
+            job_name = self.service.submit(request_path, f"reminder-classification-{job_id}")
+        except Exception as e:
+            logger.exception("Could not submit batch job %d", job_id)
+            self._fail(job_id, str(e))
+            return None
+        self.db_handler.cursor.execute(
+            "UPDATE batch_jobs SET state = 'submitted', job_name = ? WHERE id = ?", (job_name, job_id)
+        )
+        self.db_handler.commit()
+        logger.info("Submitted batch job %s", job_name)
+        return job_name
+
+    def _fail(self, job_id, error):
+        self.db_handler.cursor.execute("SELECT chunks FROM batch_jobs WHERE id = ?", (job_id,))
+        chunk_ids = json.loads(self.db_handler.cursor.fetchone()[0])
+        with self.db_handler.transaction():
+            self.db_handler.release_claimed_messages([message_id for ids in chunk_ids.values() for message_id in ids])
+            self.db_handler.cursor.execute(
+                "UPDATE batch_jobs SET state = 'failed', finished_at = CURRENT_TIMESTAMP, error = ? WHERE id = ?",
+                (error, job_id)
+            )
@@ -0,0 +1,293 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+# Written in place of NULL in CSV files so that NULL and '' survive a round trip
+CSV_NULL = "\\N"
+
+BULK_TABLES = ("messages", "projects")
+
+# Columns of projects that are computed from other rows, so never imported:
+# the aggregates are recomputed, and parent_id is remapped by name
+DERIVED_PROJECT_COLUMNS = ("message_count", "last_activity", "pending_reminders", "revision", "parent_id")
+
+
+def detect_format(path, fmt=None):
+    """Return 'jsonl' or 'csv', from fmt if given or else from the file extension."""
+    if fmt:
+        fmt = fmt.lower()
+    else:
+        fmt = os.path.splitext(path)[1].lower().lstrip(".")
+        if fmt in ("json", "ndjson"):
+            fmt = "jsonl"
+
+    if fmt not in ("jsonl", "csv"):
+        raise ValueError(f"Unsupported format: {fmt!r} (expected 'jsonl' or 'csv')")
+    return fmt
+
+
+def iter_table(db_handler, table_name, batch_size=1000):
+    """
+    Stream every row of a table as a dictionary, in id order.
+
+    Uses its own cursor and fetchmany, so memory stays constant however large the table is.
+
+    Args:
+        db_handler (DatabaseHandler): The database to read from
+        table_name (str): The table to read
+        batch_size (int, optional): Rows fetched per round trip. Defaults to 1000.
+    """
+    columns = db_handler.get_columns(table_name)
+    cursor = db_handler.conn.cursor()
+    try:
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table_name} ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(columns, row))
+    finally:
+        cursor.close()
+
+
+def read_jsonl(path):
+    """Stream the rows of a JSONL file, one dictionary per non-empty line."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_csv(path):
+    """Stream the rows of a CSV file with a header line, mapping CSV_NULL back to None."""
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            yield {key: (None if value == CSV_NULL else value) for key, value in row.items()}
+
+
+def read_rows(path, fmt=None):
+    """Stream the rows of a JSONL or CSV file."""
+    if detect_format(path, fmt) == "jsonl":
+        return read_jsonl(path)
+    return read_csv(path)
+
+
+def export_table(db_handler, table_name, path, fmt=None, progress=None, progress_every=10000):
+    """
+    Export a table to a JSONL or CSV file.
+
+    Args:
+        db_handler (DatabaseHandler): The database to read from
+        table_name (str): The table to export
+        path (str): The destination file
+        fmt (str, optional): 'jsonl' or 'csv'. Defaults to the file extension.
+        progress (callable, optional): Called with the number of rows written so far
+        progress_every (int, optional): Rows between progress calls. Defaults to 10000.
+
+    Returns:
+        int: Number of rows exported
+    """
+    fmt = detect_format(path, fmt)
+    count = 0
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(db_handler.get_columns(table_name))
+
+        for row in iter_table(db_handler, table_name):
+            if fmt == "jsonl":
+                f.write(json.dumps(row, ensure_ascii=False))
+                f.write("\n")
+            else:
+                writer.writerow([CSV_NULL if value is None else value for value in row.values()])
+
+            count += 1
+            if progress and count % progress_every == 0:
+                progress(count)
+
+    if progress:
+        progress(count)
+    return count
+
+
+def import_rows(db_handler, table_name, rows, batch_size=5000, keep_ids=False,
+                defer_indexes=True, progress=None):
+    """
+    Insert a stream of row dictionaries with batched executemany calls inside one transaction.
+
+    Columns come from the first row; keys that are not columns of the table are ignored.
+    Either every row is imported or, on error, none of them is.
+
+    Into an encrypted database (db_handler unlocked with enable_encryption),
+    messages are encrypted and their blind-index tokens stored, as by
+    insert_messages; they are then inserted one at a time, since the tokens
+    need the id of each row.
+
+    Projects keep their place in the hierarchy: the parent of each new project
+    is looked up by name once every project is in, whatever ids they got,
+    and the message counts and other aggregates are recomputed.
+
+    Args:
+        db_handler (DatabaseHandler): The database to write to
+        table_name (str): The table to import into
+        rows (iterable): Row dictionaries, e.g. from read_rows
+        batch_size (int, optional): Rows per executemany call. Defaults to 5000.
+        keep_ids (bool, optional): Keep the 'id' values from the file instead of assigning new ones. Defaults to False.
+        defer_indexes (bool, optional): Drop the table's indexes during the import and rebuild them once at the end. Defaults to True.
+        progress (callable, optional): Called with the number of rows imported so far after every batch
+
+    Returns:
+        int: Number of rows imported
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+
+    table_columns = db_handler.get_columns(table_name)
+    skipped = DERIVED_PROJECT_COLUMNS if table_name == "projects" else ()
+    columns = [column for column in first
+               if column in table_columns and (keep_ids or column != "id") and column not in skipped]
+    if not columns:
+        raise ValueError(f"No column of {table_name} found in the imported rows")
+
+    # Projects are unique by name, so re-importing a backup just skips existing ones
+    verb = "INSERT OR IGNORE" if table_name == "projects" else "INSERT"
+    query = f"{verb} INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+
+    def as_tuples(batch):
+        return [tuple(row.get(column) for column in columns) for row in batch]
+
+    encrypt = db_handler.cipher is not None and table_name == "messages"
+    # Project id in the file -> name, and name -> parent id in the file
+    project_names = {}
+    project_parents = {}
+
+    count = 0
+    db_handler.begin_immediate()
+    try:
+        indexes = _drop_indexes(db_handler, table_name) if defer_indexes else []
+        if table_name == "projects":
+            db_handler.cursor.execute("SELECT name FROM projects")
+            existing = {row[0] for row in db_handler.cursor.fetchall()}
+
+        batch = [first] + list(islice(rows, batch_size - 1))
+        while batch:
+            if table_name == "projects":
+                for row in batch:
+                    project_names[str(row.get("id"))] = row.get("name")
+                    if row.get("parent_id") is not None and row.get("name") not in existing:
+                        project_parents[row.get("name")] = str(row["parent_id"])
+            if encrypt:
+                for row in batch:
+                    sealed, tokens = db_handler.seal_imported_row(row)
+                    db_handler.cursor.execute(query, as_tuples([sealed])[0])
+                    db_handler.store_tokens(db_handler.cursor.lastrowid, tokens)
+            else:
+                db_handler.cursor.executemany(query, as_tuples(batch))
+            count += len(batch)
+            if progress:
+                progress(count)
+            batch = list(islice(rows, batch_size))
+
+        for sql in indexes:
+            db_handler.cursor.execute(sql)
+
+        # The triggers of ensure_project_tree keep the closure table in step with every move
+        for name, parent_id in project_parents.items():
+            if project_names.get(parent_id) is not None:
+                db_handler.cursor.execute(
+                    "UPDATE projects SET parent_id = (SELECT id FROM projects WHERE name = ?) WHERE name = ?",
+                    (project_names[parent_id], name)
+                )
+
+        if table_name == "messages" and "project" in columns:
+            # Make sure every imported message points to an existing project
+            db_handler.cursor.execute(
+                "INSERT OR IGNORE INTO projects (name) SELECT DISTINCT project FROM messages WHERE project IS NOT NULL"
+            )
+
+        db_handler.commit()
+    except Exception:
+        db_handler.conn.rollback()
+        raise
+
+    if table_name == "projects":
+        db_handler.refresh_project_stats()
+    return count
+
+
+def import_file(db_handler, table_name, path, fmt=None, **kwargs):
+    """Import a JSONL or CSV file into a table. See import_rows for the keyword arguments."""
+    return import_rows(db_handler, table_name, read_rows(path, fmt), **kwargs)
+
+
+def _drop_indexes(db_handler, table_name):
+    """Drop the explicit indexes of a table and return the SQL needed to recreate them."""
+    db_handler.cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table_name,)
+    )
+    indexes = db_handler.cursor.fetchall()
+    for name, _ in indexes:
+        db_handler.cursor.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in indexes]
+
+
+class ProgressPrinter:
+    """Progress callback printing the row count and rate on a single line."""
+
+    def __init__(self, label):
+        self.label = label
+        self.started_at = time.time()
+
+    def __call__(self, count):
+        elapsed = time.time() - self.started_at
+        rate = count / elapsed if elapsed else 0.0
+        print(f"\r{self.label}: {count} rows ({rate:,.0f} rows/s)", end="", flush=True)
+
+
+def add_arguments(parser, importing):
+    """Add the import/export options to an argparse parser."""
+    parser.add_argument("path", help="JSONL or CSV file")
+    parser.add_argument("--table", choices=BULK_TABLES, default="messages", help="Table to transfer")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default=None, help="Defaults to the file extension")
+    if importing:
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per executemany call")
+        parser.add_argument("--keep-ids", action="store_true", help="Keep the ids stored in the file")
+        parser.add_argument("--no-defer-indexes", action="store_true", help="Keep indexes updated during the import")
+
+
+def run_from_args(args, importing):
+    """Run an import or export from parsed command line arguments."""
+    from crypto_store import unlock_from_env
+    from database_utils import DatabaseHandler
+
+    db_handler = DatabaseHandler(args.db)
+    db_handler.ensure_schema()
+    progress = ProgressPrinter("Imported" if importing else "Exported")
+
+    try:
+        if importing:
+            try:
+                # Imported messages are encrypted like the ones sent from the app
+                unlock_from_env(db_handler)
+            except ValueError as e:
+                raise SystemExit(str(e))
+            import_file(
+                db_handler, args.table, args.path, args.format,
+                batch_size=args.batch_size,
+                keep_ids=args.keep_ids,
+                defer_indexes=not args.no_defer_indexes,
+                progress=progress,
+            )
+        else:
+            export_table(db_handler, args.table, args.path, args.format, progress=progress)
+        print()
+    finally:
+        db_handler.close()
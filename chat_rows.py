@@ -0,0 +1,147 @@
+class RowRegistry:
+    """
+    The message rows of one chat view, keyed by message ID, with a pool of spare row frames.
+
+    Every row shown in the view is registered here and nowhere else, so a
+    reload can release all of them. Released rows give back their images
+    right away; plain text rows are unpacked and kept (up to pool_size) to
+    be filled with another message instead of building their widgets again.
+    """
+
+    def __init__(self, pool_size=200):
+        """
+        Args:
+            pool_size (int, optional): Spare text rows kept for reuse. Defaults to 200.
+        """
+        self.pool_size = pool_size
+        self.rows = {}
+        # Rows shown without a message ID
+        self.anonymous = []
+        self.pool = []
+        # Rows built and destroyed since the start, and rows reused from the pool
+        self.created = 0
+        self.destroyed = 0
+        self.recycled = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, message_id):
+        return message_id in self.rows
+
+    def get(self, message_id):
+        return self.rows.get(message_id)
+
+    def items(self):
+        return self.rows.items()
+
+    def register(self, message_id, msg_frame, created=True):
+        """Track a row shown for message_id, releasing any row registered under it before."""
+        if created:
+            self.created += 1
+        if message_id is None:
+            self.anonymous.append(msg_frame)
+            return
+        old = self.rows.get(message_id)
+        if old is not None and old is not msg_frame:
+            self.release(old)
+        self.rows[message_id] = msg_frame
+
+    def rename(self, old_id, new_id):
+        """Track a row under a new ID, e.g. the real ID of a message that was provisional."""
+        msg_frame = self.rows.pop(old_id, None)
+        if msg_frame is not None:
+            self.rows[new_id] = msg_frame
+        return msg_frame
+
+    def remove(self, message_id):
+        """Stop showing the row of a message. Returns True if there was one."""
+        msg_frame = self.rows.pop(message_id, None)
+        if msg_frame is None:
+            return False
+        self.release(msg_frame)
+        return True
+
+    def clear(self, recycle=True):
+        """Release every row, e.g. before the view is reloaded; recycle=False also empties the pool."""
+        rows = list(self.rows.values()) + self.anonymous
+        self.rows = {}
+        self.anonymous = []
+        for msg_frame in rows:
+            self.release(msg_frame, recycle)
+        if not recycle:
+            for msg_frame in self.pool:
+                self._destroy(msg_frame)
+            self.pool.clear()
+
+    def acquire(self):
+        """Return a spare text row to fill in, or None if the pool is empty."""
+        while self.pool:
+            msg_frame = self.pool.pop()
+            if msg_frame.winfo_exists():
+                self.recycled += 1
+                return msg_frame
+        return None
+
+    def release(self, msg_frame, recycle=True):
+        """Free a row's images, then keep it for reuse or destroy it."""
+        if not msg_frame.winfo_exists():
+            return
+        release_images(msg_frame)
+        if recycle and getattr(msg_frame, "recyclable", False) and len(self.pool) < self.pool_size:
+            msg_frame.pack_forget()
+            self.pool.append(msg_frame)
+        else:
+            self._destroy(msg_frame)
+
+    def _destroy(self, msg_frame):
+        if msg_frame.winfo_exists():
+            msg_frame.destroy()
+            self.destroyed += 1
+
+    def counters(self):
+        return {
+            "rows": len(self.rows) + len(self.anonymous),
+            "pooled_rows": len(self.pool),
+            "rows_created": self.created,
+            "rows_destroyed": self.destroyed,
+            "rows_recycled": self.recycled,
+        }
+
+
+# Tk images currently held by a label in a chat row; a PhotoImage only frees its pixels
+# once both the Python object and the Tk image are gone
+live_images = set()
+
+
+def attach_image(label, photo):
+    """Show a PhotoImage in a label and keep it alive (and counted) until release_images."""
+    release_label_image(label)
+    label.config(image=photo)
+    label.image = photo
+    live_images.add(str(photo))
+
+
+def release_label_image(label):
+    photo = getattr(label, "image", None)
+    if photo is None:
+        return
+    label.image = None
+    if label.winfo_exists():
+        label.config(image="")
+    name = str(photo)
+    live_images.discard(name)
+    # Delete the Tk image now instead of whenever the PhotoImage is collected
+    try:
+        label.tk.call("image", "delete", name)
+    except Exception:
+        pass
+
+
+def release_images(widget):
+    """Release the images of every label under widget (the widget itself included)."""
+    stack = [widget]
+    while stack:
+        current = stack.pop()
+        release_label_image(current)
+        stack.extend(current.winfo_children())
@@ -0,0 +1,271 @@
+import json
+import logging
+import re
+from collections import namedtuple
+from datetime import datetime
+
+# orjson parses the responses faster and accepts bytes directly
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Response schema of GeminiHandler.classify_messages, in the dict form accepted by both the SDK and the REST API
+CLASSIFICATION_SCHEMA = {
+    "type": "OBJECT",
+    "required": ["messages"],
+    "properties": {
+        "messages": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "required": ["index of the message", "project"],
+                "properties": {
+                    "index of the message": {"type": "INTEGER"},
+                    "project": {"type": "STRING"},
+                    "reminder time": {"type": "STRING"},
+                },
+            },
+        },
+    },
+}
+
+# Ready for DatabaseHandler.apply_classifications, which unpacks plain 3-tuples
+Classification = namedtuple("Classification", ["message_id", "project", "reminder_time"])
+
+# Format of messages.reminder_time, compared as text against the current time
+REMINDER_FORMAT = "%Y-%m-%d %H:%M:%S"
+_REMINDER_RE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+
+_JSON_TYPES = {
+    "OBJECT": dict,
+    "ARRAY": list,
+    "STRING": str,
+    "INTEGER": int,
+    "NUMBER": (int, float),
+    "BOOLEAN": bool,
+}
+
+
+def loads(data):
+    """Parse JSON text or bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def validate(value, schema, path="$"):
+    """
+    Check a parsed value against a Gemini response schema (types, required properties, array items).
+
+    Returns:
+        str: Description of the first violation, or None if the value is valid
+    """
+    expected = _JSON_TYPES.get(schema.get("type"))
+    # bool is an int subclass, but true is not a valid index
+    if expected is not None and (not isinstance(value, expected)
+                                 or (isinstance(value, bool) and schema["type"] != "BOOLEAN")):
+        return f"{path}: expected {schema['type']}, got {type(value).__name__}"
+
+    if isinstance(value, dict):
+        for name in schema.get("required", ()):
+            if name not in value:
+                return f"{path}: missing {name!r}"
+        properties = schema.get("properties", {})
+        for name, item in value.items():
+            if name in properties and item is not None:
+                error = validate(item, properties[name], f"{path}.{name}")
+                if error:
+                    return error
+    elif isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            error = validate(item, schema["items"], f"{path}[{i}]")
+            if error:
+                return error
+    return None
+
+
+def normalize_project(project):
+    """Return the project name, or None for the empty and NULL answers of the model."""
+    if not project:
+        return None
+    project = project.strip()
+    if not project or project.upper() in ("NULL", "NONE"):
+        return None
+    return project
+
+
+def normalize_reminder_time(value):
+    """
+    Return a reminder time in REMINDER_FORMAT, or None if the model gave none.
+
+    Raises:
+        ValueError: If the value is not empty but not a date either
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if _REMINDER_RE.match(value):
+        return value
+    if not value or value.upper() == "NULL":
+        return None
+
+    # ISO variants: T separator, fractional seconds, no seconds, date only, and UTC offsets,
+    # which are converted to the local time reminders are stored in
+    try:
+        parsed = datetime.fromisoformat(value[:-1] + "+00:00" if value[-1:] in "Zz" else value)
+    except ValueError:
+        raise ValueError(f"unreadable reminder time {value!r}") from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.strftime(REMINDER_FORMAT)
+
+
+class ParseMetrics:
+    """Counters of what ResponseParser accepted and dropped."""
+
+    def __init__(self):
+        self.responses = 0
+        self.entries = 0
+        self.malformed_json = 0
+        self.schema_violations = 0
+        self.bad_indexes = 0
+        self.duplicate_indexes = 0
+        self.bad_reminder_times = 0
+
+    @property
+    def malformed_responses(self):
+        return self.malformed_json + self.schema_violations
+
+    def as_dict(self):
+        return {
+            "responses": self.responses,
+            "entries": self.entries,
+            "malformed_json": self.malformed_json,
+            "schema_violations": self.schema_violations,
+            "bad_indexes": self.bad_indexes,
+            "duplicate_indexes": self.duplicate_indexes,
+            "bad_reminder_times": self.bad_reminder_times,
+        }
+
+
+class ResponseParser:
+    """
+    Turn raw classification responses into Classification tuples.
+
+    A response is parsed once (orjson when available) and checked against
+    CLASSIFICATION_SCHEMA in the same pass that maps each entry's index to the
+    message ID it was numbered with in the prompt, so no intermediate objects
+    are built. Problems never raise: a malformed response or entry is logged,
+    counted in metrics and skipped, so the rest of the batch is still applied.
+    """
+
+    def __init__(self, metrics=None):
+        """
+        Args:
+            metrics (ParseMetrics, optional): Counters to update. Defaults to a new ParseMetrics.
+        """
+        self.metrics = metrics or ParseMetrics()
+        # The model answers with a handful of distinct project names
+        self.projects = {}
+
+    def parse(self, response, message_ids, seen=None):
+        """
+        Return the classifications of one response.
+
+        Args:
+            response (str, bytes or dict): Raw JSON returned by the model, or an already parsed object
+            message_ids (list): Message IDs in the order they were numbered in the prompt
+            seen (set, optional): Indexes already classified; later entries for them are skipped
+
+        Returns:
+            list: Classification tuples; empty if the response is malformed
+        """
+        metrics = self.metrics
+        metrics.responses += 1
+        if isinstance(response, (str, bytes, bytearray)):
+            try:
+                response = loads(response)
+            except ValueError:
+                metrics.malformed_json += 1
+                logger.warning("Skipping malformed classification response: %.200r", response)
+                return []
+
+        entries = response.get("messages") if type(response) is dict else None
+        if type(entries) is not list:
+            return self._reject(response)
+
+        seen = set() if seen is None else seen
+        count = len(message_ids)
+        projects = self.projects
+        classifications = []
+        indexes = set()
+        bad_indexes = duplicates = bad_times = 0
+        # Same rules as validate(CLASSIFICATION_SCHEMA), checked inline
+        for entry in entries:
+            if type(entry) is not dict:
+                return self._reject(response)
+            index = entry.get("index of the message")
+            project = entry.get("project")
+            reminder_time = entry.get("reminder time")
+            if (type(index) is not int or "project" not in entry
+                    or not (project is None or type(project) is str)
+                    or not (reminder_time is None or type(reminder_time) is str)):
+                return self._reject(response)
+
+            if not 0 <= index < count:
+                bad_indexes += 1
+                continue
+            if index in seen or index in indexes:
+                duplicates += 1
+                continue
+            indexes.add(index)
+
+            try:
+                project = projects[project]
+            except KeyError:
+                project = projects.setdefault(project, normalize_project(project))
+            if reminder_time:
+                try:
+                    reminder_time = normalize_reminder_time(reminder_time)
+                except ValueError:
+                    bad_times += 1
+                    reminder_time = None
+            classifications.append(Classification(message_ids[index], project, reminder_time or None))
+
+        seen.update(indexes)
+        metrics.entries += len(classifications)
+        metrics.bad_indexes += bad_indexes
+        metrics.duplicate_indexes += duplicates
+        metrics.bad_reminder_times += bad_times
+        return classifications
+
+    def parse_all(self, responses, message_ids, fill_missing=True):
+        """
+        Parse every response of a prompt whose messages were numbered with one sequence.
+
+        Args:
+            responses (list): Responses of the chunks of the prompt
+            message_ids (list): Message IDs in the order they were numbered in the prompt
+            fill_missing (bool, optional): Add (message_id, None, None) for every message no response
+                mentioned, so it is still marked as processed. Defaults to True.
+
+        Returns:
+            list: Classification tuples, one per message at most
+        """
+        seen = set()
+        classifications = []
+        for response in responses:
+            classifications.extend(self.parse(response, message_ids, seen))
+        if fill_missing and len(seen) < len(message_ids):
+            classifications.extend(Classification(message_id, None, None)
+                                   for index, message_id in enumerate(message_ids) if index not in seen)
+        return classifications
+
+    def _reject(self, response):
+        self.metrics.schema_violations += 1
+        logger.warning("Skipping classification response that does not match the schema: %s",
+                       validate(response, CLASSIFICATION_SCHEMA) or "unexpected value")
+        return []
@@ -0,0 +1,16 @@
+import pytest
+
+from database_utils import DatabaseHandler
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "chat.db")
+
+
+@pytest.fixture
+def db_handler(db_path):
+    handler = DatabaseHandler(db_path)
+    handler.ensure_schema()
+    yield handler
+    handler.close()
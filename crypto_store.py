@@ -0,0 +1,332 @@
+import base64
+import hashlib
+import hmac
+import os
+import re
+import struct
+
+# AES-GCM comes from the optional cryptography package
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+    InvalidTag = ValueError
+
+# Environment variable the entry points read the passphrase of an encrypted database from
+PASSPHRASE_ENV = "REMINDER_DB_PASSPHRASE"
+
+# Prefix of an encrypted column value; anything else is stored in plaintext.
+# It starts with a control character, so no text typed into the chat can pass for a ciphertext
+PREFIX = "\x1fenc1:"
+
+# scrypt cost: about 100 ms and 32 MiB per derivation
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 15, 8, 1
+
+# Attachments: header = magic, chunk size, nonce prefix; then one sealed chunk after another
+FILE_MAGIC = b"RPENC1"
+FILE_CHUNK_SIZE = 64 * 1024
+_NONCE_PREFIX_SIZE = 7
+_TAG_SIZE = 16
+_HEADER = struct.Struct(f">{len(FILE_MAGIC)}sI{_NONCE_PREFIX_SIZE}s")
+
+# Words indexed for search: lowercase runs of letters and digits
+_WORD_RE = re.compile(r"\w+")
+_VERIFIER = b"reminder-project key check"
+
+
+def require_cryptography():
+    if AESGCM is None:
+        raise ImportError("Encryption needs the cryptography package (pip install cryptography)")
+
+
+def derive_keys(passphrase, salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """
+    Derive the encryption key and the blind-index key from a passphrase with scrypt.
+
+    Returns:
+        tuple: (32-byte AES key, 32-byte HMAC key)
+    """
+    material = hashlib.scrypt(passphrase.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * r * (n + p + 2), dklen=64)
+    return material[:32], material[32:]
+
+
+class MessageCipher:
+    """
+    Per-record AES-256-GCM for column values, and blind-index tokens for search.
+
+    Every value gets its own random 96-bit nonce and is bound to its column
+    name as associated data, so a ciphertext copied into another column does
+    not decrypt. Values without the PREFIX marker are passed through by
+    decrypt, so plaintext rows from before encryption was enabled keep working.
+
+    Blind-index tokens are truncated HMAC-SHA256 digests of the lowercase
+    words of a text under a separate key: equal words give equal tokens, so
+    whole-word search works without decrypting anything, but the words cannot
+    be read back from the tokens.
+    """
+
+    def __init__(self, key, index_key):
+        """
+        Args:
+            key (bytes): 32-byte AES key
+            index_key (bytes): 32-byte HMAC key of the blind index
+        """
+        require_cryptography()
+        self.aead = AESGCM(key)
+        self.index_key = index_key
+        # Key of the duplicate-detection fingerprints (see dedup.py), kept apart from the search tokens
+        self.dedup_key = hmac.new(index_key, b"deduplication", hashlib.sha256).digest()
+
+    @classmethod
+    def from_passphrase(cls, passphrase, salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        return cls(*derive_keys(passphrase, salt, n, r, p))
+
+    def seal(self, data, context):
+        nonce = os.urandom(12)
+        return nonce + self.aead.encrypt(nonce, data, context.encode("ascii"))
+
+    def open(self, blob, context):
+        """
+        Raises:
+            ValueError: If the value was tampered with or encrypted under another key or column
+        """
+        try:
+            return self.aead.decrypt(blob[:12], blob[12:], context.encode("ascii"))
+        except InvalidTag:
+            raise ValueError(f"Cannot decrypt {context}: wrong key or corrupted value") from None
+
+    def encrypt(self, value, context="message"):
+        """Encrypt a text value for a column; None and empty values are kept as they are."""
+        if not value:
+            return value
+        return PREFIX + base64.urlsafe_b64encode(self.seal(value.encode("utf-8"), context)).decode("ascii")
+
+    def decrypt(self, value, context="message"):
+        """Return the plaintext of a column value; plaintext values are returned unchanged."""
+        if not is_encrypted(value):
+            return value
+        return self.open(base64.urlsafe_b64decode(value[len(PREFIX):]), context).decode("utf-8")
+
+    def token(self, word):
+        return hmac.new(self.index_key, word.lower().encode("utf-8"), hashlib.sha256).digest()[:12]
+
+    def blind_tokens(self, text):
+        """Return the blind-index tokens of the distinct words of a text."""
+        return {self.token(word) for word in set(_WORD_RE.findall((text or "").lower()))}
+
+    def verifier(self):
+        """A value only this key decrypts, stored to recognise a wrong passphrase."""
+        return base64.b64encode(self.seal(_VERIFIER, "verifier")).decode("ascii")
+
+    def check(self, verifier):
+        try:
+            return self.open(base64.b64decode(verifier), "verifier") == _VERIFIER
+        except ValueError:
+            return False
+
+    # Attachments
+
+    def encrypt_file(self, src_path, dst_path, chunk_size=FILE_CHUNK_SIZE):
+        """
+        Encrypt a file chunk by chunk, never holding more than one chunk in memory.
+
+        Each chunk is sealed with a nonce made of a per-file random prefix, the
+        chunk number and a last-chunk flag (the STREAM construction), so chunks
+        cannot be reordered, dropped or the file truncated without decryption
+        failing. The output is written next to dst_path and renamed into place.
+        """
+        prefix = os.urandom(_NONCE_PREFIX_SIZE)
+        tmp_path = dst_path + ".tmp"
+        with open(src_path, "rb") as src, open(tmp_path, "wb") as dst:
+            dst.write(_HEADER.pack(FILE_MAGIC, chunk_size, prefix))
+            counter = 0
+            chunk = src.read(chunk_size)
+            while True:
+                following = src.read(chunk_size)
+                last = not following
+                dst.write(self.aead.encrypt(_chunk_nonce(prefix, counter, last), chunk, FILE_MAGIC))
+                if last:
+                    break
+                chunk = following
+                counter += 1
+        os.replace(tmp_path, dst_path)
+
+    def iter_decrypted(self, path):
+        """
+        Yield the plaintext chunks of a file written by encrypt_file.
+
+        Raises:
+            ValueError: If the file is not encrypted, was modified, truncated or uses another key
+        """
+        with open(path, "rb") as src:
+            header = src.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise ValueError(f"{path} is not an encrypted attachment")
+            magic, chunk_size, prefix = _HEADER.unpack(header)
+            if magic != FILE_MAGIC:
+                raise ValueError(f"{path} is not an encrypted attachment")
+
+            sealed_size = chunk_size + _TAG_SIZE
+            counter = 0
+            sealed = src.read(sealed_size)
+            while True:
+                following = src.read(sealed_size)
+                last = not following
+                try:
+                    yield self.aead.decrypt(_chunk_nonce(prefix, counter, last), sealed, FILE_MAGIC)
+                except InvalidTag:
+                    raise ValueError(f"Cannot decrypt chunk {counter} of {path}") from None
+                if last:
+                    return
+                sealed = following
+                counter += 1
+
+    def decrypt_file(self, src_path, dst_path):
+        """Decrypt a file written by encrypt_file into dst_path, chunk by chunk."""
+        tmp_path = dst_path + ".tmp"
+        with open(tmp_path, "wb") as dst:
+            for chunk in self.iter_decrypted(src_path):
+                dst.write(chunk)
+        os.replace(tmp_path, dst_path)
+
+
+def _chunk_nonce(prefix, counter, last):
+    return prefix + struct.pack(">IB", counter, 1 if last else 0)
+
+
+def unlock_from_env(db_handler, passphrase_env=PASSPHRASE_ENV):
+    """
+    Unlock an encrypted database with the passphrase held in an environment variable.
+
+    Plain databases are left as they are, whatever the variable holds.
+
+    Returns:
+        bool: Whether the database is encrypted
+
+    Raises:
+        ValueError: If the database is encrypted and the variable is unset or holds a wrong passphrase
+    """
+    if not db_handler.encryption_enabled():
+        return False
+    passphrase = os.environ.get(passphrase_env)
+    if not passphrase:
+        raise ValueError(f"{db_handler.db_name} is encrypted: set {passphrase_env} to its passphrase")
+    db_handler.enable_encryption(passphrase)
+    return True
+
+
+def is_encrypted(value):
+    """Whether a column value was written by MessageCipher.encrypt."""
+    return bool(value) and value.startswith(PREFIX)
+
+
+def is_encrypted_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(FILE_MAGIC)) == FILE_MAGIC
+    except OSError:
+        return False
+
+
+def benchmark(count=20000, rendered=50, passphrase="benchmark passphrase", directory=None):
+    """
+    Measure what encryption costs on insert, on loading a chat and on search.
+
+    Builds the same messages in a plaintext and an encrypted database and
+    times each step in both.
+
+    Returns:
+        dict: {step: {"plain": seconds, "encrypted": seconds}}
+    """
+    import random
+    import tempfile
+    import time
+
+    from database_utils import DatabaseHandler
+
+    directory = directory or tempfile.mkdtemp(prefix="crypto-bench-")
+    words = ["budget", "meeting", "call", "dentist", "groceries", "invoice", "flight", "report",
+             "birthday", "renew", "passport", "draft", "review", "garden", "taxes", "plumber"]
+    rng = random.Random(1)
+    rows = [{"sender": "You", "message": " ".join(rng.choice(words) for _ in range(12)) + f" #{i}"}
+            for i in range(count)]
+
+    results = {}
+
+    def timed(step, mode, fn):
+        start = time.perf_counter()
+        value = fn()
+        results.setdefault(step, {})[mode] = round(time.perf_counter() - start, 4)
+        return value
+
+    for mode in ("plain", "encrypted"):
+        db_handler = DatabaseHandler(os.path.join(directory, f"{mode}.db"))
+        db_handler.ensure_schema()
+        if mode == "encrypted":
+            timed("derive key", mode, lambda: db_handler.enable_encryption(passphrase))
+        else:
+            results["derive key"] = {"plain": 0.0}
+
+        timed("insert", mode, lambda: [db_handler.insert_messages(rows[i:i + 500]) for i in range(0, count, 500)])
+        messages = timed("load chat", mode, lambda: db_handler.get_messages("main"))
+        # Only the rows put on screen are decrypted
+        timed(f"render {rendered} rows", mode,
+              lambda: [db_handler.reveal(msg["message"]) for msg in messages[-rendered:]])
+        timed("render every row", mode, lambda: [db_handler.reveal(msg["message"]) for msg in messages])
+        found = timed("search 'passport'", mode, lambda: db_handler.search_messages("passport"))
+        timed("search 'passport taxes'", mode, lambda: db_handler.search_messages("passport taxes"))
+        results.setdefault("matches", {})[mode] = len(found)
+        results.setdefault("database MiB", {})[mode] = round(
+            os.path.getsize(os.path.join(directory, f"{mode}.db")) / 2 ** 20, 1
+        )
+        db_handler.close()
+
+    attachment = os.path.join(directory, "attachment.bin")
+    with open(attachment, "wb") as f:
+        for _ in range(64):
+            f.write(os.urandom(1024 * 1024))
+    cipher = MessageCipher.from_passphrase(passphrase, b"benchmark salt")
+    timed("encrypt 64 MiB file", "encrypted", lambda: cipher.encrypt_file(attachment, attachment + ".enc"))
+    timed("decrypt 64 MiB file", "encrypted",
+          lambda: sum(len(chunk) for chunk in cipher.iter_decrypted(attachment + ".enc")))
+    return results
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="At-rest encryption of a chat database")
+    parser.add_argument("--db", default="chat.db", help="Path to the SQLite database")
+    parser.add_argument("--passphrase-env", default=PASSPHRASE_ENV,
+                        help="Environment variable holding the passphrase")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("encrypt", help="Enable encryption and encrypt the messages stored so far")
+    bench = subparsers.add_parser("bench", help="Measure the overhead of encryption on load and search")
+    bench.add_argument("--count", type=int, default=20000, help="Messages in the benchmark databases")
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        for step, timings in benchmark(args.count).items():
+            plain, encrypted = timings.get("plain"), timings.get("encrypted")
+            ratio = f"x{encrypted / plain:.1f}" if plain and encrypted else ""
+            print(f"{step:<26} plain {plain if plain is not None else '-':>10}  "
+                  f"encrypted {encrypted if encrypted is not None else '-':>10}  {ratio}")
+        return
+
+    from database_utils import DatabaseHandler
+
+    passphrase = os.environ.get(args.passphrase_env)
+    if not passphrase:
+        import getpass
+        passphrase = getpass.getpass("Passphrase: ")
+    db_handler = DatabaseHandler(args.db)
+    db_handler.ensure_schema()
+    db_handler.enable_encryption(passphrase, migrate=False)
+    print(f"Encrypted {db_handler.encrypt_existing_messages()} messages")
+    db_handler.close()
+
+
+if __name__ == "__main__":
+    main()
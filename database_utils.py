@@ -1,17 +1,158 @@
+import json
+import logging
+import os
 import sqlite3
+import uuid
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from models import MESSAGE_FIELDS, ProjectNode, ProjectSummary, rows_to_messages, rows_to_columns
 
+logger = logging.getLogger(__name__)
+
+# Change events emitted by DatabaseHandler after a successful commit
+MessageInserted = namedtuple("MessageInserted", ["message"])
+MessageDeleted = namedtuple("MessageDeleted", ["message_id", "project"])
+MessageMoved = namedtuple("MessageMoved", ["message_id", "old_project", "new_project"])
+ProjectCreated = namedtuple("ProjectCreated", ["name"])
+ProjectMoved = namedtuple("ProjectMoved", ["name", "old_parent", "new_parent"])
+
+# Result of DatabaseHandler.query_messages: one page of messages, the total match count,
+# and facet name -> [(value, count)] sorted by count
+QueryResult = namedtuple("QueryResult", ["messages", "total", "facets"])
+
+# Columns query_messages can filter and count on, in the order of the covering index idx_messages_project_facets
+FACET_COLUMNS = ("project", "sender", "message_type", "category")
+FACET_INDEX = "idx_messages_project_facets"
+
+
+def _timestamp_bound(value):
+    """Turn a datetime, date or string bound into the text form timestamps are stored in."""
+    if value is None or isinstance(value, str):
+        return value
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class MessageQuery:
+    """
+    Filters over the messages table, built up step by step.
+
+    Every method returns a new query, so a base query can be shared and
+    refined, e.g. MessageQuery().project("work").since(monday).sender("me").
+    Run it with DatabaseHandler.query_messages.
+    """
+
+    def __init__(self, filters=None, start=None, end=None, text=None):
+        # column -> tuple of accepted values
+        self.filters = dict(filters or {})
+        self.start = start
+        self.end = end
+        self.search_term = text
+
+    def _with(self, **changes):
+        values = {"filters": self.filters, "start": self.start, "end": self.end, "text": self.search_term}
+        values.update(changes)
+        return MessageQuery(**values)
+
+    def where(self, column, *values):
+        """Keep messages whose column has one of the values; no values removes the filter."""
+        if column not in FACET_COLUMNS:
+            raise ValueError(f"Cannot filter on {column!r}; expected one of {FACET_COLUMNS}")
+        filters = dict(self.filters)
+        if values:
+            filters[column] = tuple(values)
+        else:
+            filters.pop(column, None)
+        return self._with(filters=filters)
+
+    def project(self, *projects):
+        return self.where("project", *projects)
+
+    def sender(self, *senders):
+        return self.where("sender", *senders)
+
+    def message_type(self, *message_types):
+        return self.where("message_type", *message_types)
+
+    def category(self, *categories):
+        return self.where("category", *categories)
+
+    def between(self, start=None, end=None):
+        """Keep messages with start <= timestamp < end (UTC); either bound may be None."""
+        return self._with(start=_timestamp_bound(start), end=_timestamp_bound(end))
+
+    def since(self, start):
+        return self._with(start=_timestamp_bound(start))
+
+    def until(self, end):
+        return self._with(end=_timestamp_bound(end))
+
+    def text(self, search_term):
+        """Keep messages whose body contains search_term (LIKE, case-insensitive for ASCII)."""
+        return self._with(text=search_term or None)
+
+    def where_clause(self):
+        """Return the WHERE clause (possibly empty) and its parameters."""
+        conditions = []
+        params = []
+        for column in FACET_COLUMNS:
+            values = self.filters.get(column)
+            if not values:
+                continue
+            if len(values) == 1:
+                conditions.append(f"{column} = ?")
+            else:
+                conditions.append(f"{column} IN ({', '.join(['?'] * len(values))})")
+            params.extend(values)
+        if self.start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(self.start)
+        if self.end is not None:
+            conditions.append("timestamp < ?")
+            params.append(self.end)
+        if self.search_term:
+            conditions.append("message LIKE ?")
+            params.append(f"%{self.search_term}%")
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def decompress_message(message, compressed):
+    """Return the text of an archived message body, inflating it if it was stored compressed."""
+    if compressed and message is not None:
+        return zlib.decompress(message).decode("utf-8")
+    return message
 
 
 class DatabaseHandler:
-    def __init__(self, db_name="chat.db"):
+    def __init__(self, db_name="chat.db", timeout=30.0):
         """Initialize the database connection."""
         # Define the database file.
         self.db_name = db_name
+        # How long to wait on a lock held by another process (GUI or headless runner).
+        self.timeout = timeout
+        # (callback, event types) pairs notified by emit
+        self.subscribers = []
+        self.last_data_version = None
+        # Nesting of transaction() blocks, and the events they deliver once committed
+        self.transaction_depth = 0
+        self.pending_events = []
+        # table name -> column names, filled by get_columns
+        self.columns_cache = {}
+        # Deduplicator consulted by insert_message(s), set by enable_deduplication
+        self.deduplicator = None
+        # MessageCipher sealing message bodies and attachments, set by enable_encryption
+        self.cipher = None
+        self.vault_dir = None
+        # File attached as the 'archive' schema by attach_archive
+        self.archive_name = None
         self.connect()
 
     def connect(self):
         """Establish a connection to the database."""
-        self.conn = sqlite3.connect(self.db_name)
+        self.conn = sqlite3.connect(self.db_name, timeout=self.timeout)
         self.cursor = self.conn.cursor()
         return self.conn, self.cursor
 
@@ -25,6 +166,70 @@ class DatabaseHandler:
         if hasattr(self, 'conn') and self.conn:
             self.conn.commit()
 
+    def subscribe(self, callback, *event_types):
+        """
+        Register a callback for change events.
+
+        Args:
+            callback (callable): Called with the event after the change is committed
+            *event_types: Only deliver these event classes. Defaults to all events.
+
+        Returns:
+            callable: The callback, to pass to unsubscribe later
+        """
+        self.subscribers.append((callback, event_types))
+        return callback
+
+    def unsubscribe(self, callback):
+        """Stop delivering change events to a callback."""
+        self.subscribers = [(cb, types) for cb, types in self.subscribers if cb != callback]
+
+    def emit(self, event):
+        """
+        Deliver a change event to every interested subscriber.
+
+        Also used to forward events for writes made on another connection of the
+        same process, such as the write-behind queue.
+        """
+        for callback, event_types in list(self.subscribers):
+            if event_types and not isinstance(event, event_types):
+                continue
+            try:
+                callback(event)
+            except Exception:
+                # A broken view must not stop the others from being notified
+                logger.exception("Error in change subscriber %r", callback)
+
+    def has_external_changes(self):
+        """
+        Check whether another connection committed changes since the last call.
+
+        PRAGMA data_version only changes on commits made by other connections
+        (another process, or another handler on the same file), so this is a
+        cheap way to decide whether a full reload is needed at all.
+
+        Returns:
+            bool: True if the database changed (always True on the first call)
+        """
+        self.cursor.execute("PRAGMA data_version")
+        data_version = self.cursor.fetchone()[0]
+        changed = data_version != self.last_data_version
+        self.last_data_version = data_version
+        return changed
+
+    def absorb_external_changes(self):
+        """
+        Mark the commits of other connections seen so far as already applied.
+
+        Used after in-process writers on other connections, such as the
+        write-behind queue, whose changes were forwarded as events: without it
+        has_external_changes would report each of their commits as a change
+        made by another process. A commit of another process that lands in
+        between is absorbed too; the view catches up with the next one.
+        """
+        self.cursor.execute("PRAGMA data_version")
+        self.last_data_version = self.cursor.fetchone()[0]
+
     def create_table(self, table_name, columns):
         """
         Create a table if it doesn't exist.
@@ -41,6 +246,29 @@ class DatabaseHandler:
         '''
         self.cursor.execute(query)
         self.commit()
+        self.columns_cache.pop(table_name, None)
+
+    def get_columns(self, table_name):
+        """
+        Return the column names of a table.
+
+        The result is cached, since the schema only changes through create_table
+        and add_column_if_not_exists.
+
+        Args:
+            table_name (str): Name of the table
+        """
+        columns = self.columns_cache.get(table_name)
+        if columns is None:
+            self.cursor.execute(f"PRAGMA table_info({table_name})")
+            columns = [info[1] for info in self.cursor.fetchall()]
+            self.columns_cache[table_name] = columns
+        return columns
+
+    def get_message_columns(self, table_name="messages"):
+        """Return the message columns present in a table, in MESSAGE_FIELDS order."""
+        columns = self.get_columns(table_name)
+        return [field for field in MESSAGE_FIELDS if field in columns]
 
     def add_column_if_not_exists(self, table_name, column_name, column_type):
         """
@@ -52,17 +280,16 @@ class DatabaseHandler:
             column_type (str): SQL type definition for the column
         """
         # Check if column exists
-        self.cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = [info[1] for info in self.cursor.fetchall()]
-
-        if column_name not in columns:
+        if column_name not in self.get_columns(table_name):
             self.cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
             self.commit()
+            self.columns_cache.pop(table_name, None)
             return True
         return False
 
     def init_db(self, table_name="messages", columns=None):
         """Initialize the database and create the specified table if it doesn't exist."""
+        self.ensure_incremental_vacuum()
         if columns is None:
             columns = {
                 "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
@@ -89,6 +316,769 @@ class DatabaseHandler:
             self.cursor.execute("INSERT INTO projects (name) VALUES ('main')")
             self.commit()
 
+    def ensure_incremental_vacuum(self):
+        """
+        Create new database files with auto_vacuum = INCREMENTAL, so idle maintenance can give free pages back.
+
+        The mode can only be chosen before the first table is created; older files
+        keep theirs until `retention.py --enable-incremental-vacuum` rewrites them.
+
+        Returns:
+            bool: True if the database uses incremental vacuum
+        """
+        self.cursor.execute("PRAGMA main.auto_vacuum")
+        if self.cursor.fetchone()[0] == 2:
+            return True
+        self.cursor.execute("SELECT COUNT(*) FROM main.sqlite_master")
+        if self.cursor.fetchone()[0] == 0:
+            self.cursor.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+            return True
+        logger.warning("%s was created without incremental vacuum; idle maintenance will not shrink it "
+                       "(run retention.py --enable-incremental-vacuum once to switch it)", self.db_name)
+        return False
+
+    def ensure_schema(self):
+        """Create the tables and make sure all necessary columns exist."""
+        self.init_db()
+
+        self.add_column_if_not_exists("messages", "category", "TEXT")
+        self.add_column_if_not_exists("messages", "message_type", "TEXT DEFAULT 'text'")
+        self.add_column_if_not_exists("messages", "project", "TEXT DEFAULT 'main'")
+        self.add_column_if_not_exists("messages", "file_path", "TEXT DEFAULT ''")
+
+        # Classification state: 0 = pending, -1 = claimed by a worker, 1 = done
+        self.add_column_if_not_exists("messages", "processed", "INTEGER DEFAULT 0")
+        self.add_column_if_not_exists("messages", "claimed_at", "DATETIME")
+        # When a claim expires, set by the claimer: a batch job holds its messages far longer than a worker
+        self.add_column_if_not_exists("messages", "claimed_until", "DATETIME")
+        self.add_column_if_not_exists("messages", "reminder_time", "TEXT")
+        self.add_column_if_not_exists("messages", "reminder_fired", "INTEGER DEFAULT 0")
+
+        # Duplicate tracking: the message a near duplicate was linked to, and how often an exact one was collapsed
+        self.add_column_if_not_exists("messages", "duplicate_of", "INTEGER")
+        self.add_column_if_not_exists("messages", "duplicate_count", "INTEGER DEFAULT 0")
+
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_project ON messages (project, id)")
+        # Pages of query_messages, newest first, within a project or a time range
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_project_timestamp ON messages (project, timestamp)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+        # Facet counts of query_messages: the facet columns in GROUP BY order, then timestamp for range filters.
+        # Older databases have it with timestamp second, which needs a temporary B-tree to group.
+        facet_columns = list(FACET_COLUMNS) + ["timestamp"]
+        self.cursor.execute(f"PRAGMA index_info({FACET_INDEX})")
+        existing = [row[2] for row in self.cursor.fetchall()]
+        if existing and existing != facet_columns:
+            self.cursor.execute(f"DROP INDEX {FACET_INDEX}")
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {FACET_INDEX} ON messages ({', '.join(facet_columns)})")
+        # Superseded by idx_messages_timestamp and idx_messages_project_facets
+        self.cursor.execute("DROP INDEX IF EXISTS idx_messages_timestamp_facets")
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_duplicate_of ON messages (duplicate_of) WHERE duplicate_of IS NOT NULL"
+        )
+        # Due and claimed reminders (see claim_due_reminders); most messages have no reminder
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_reminders "
+            "ON messages (reminder_fired, reminder_time) WHERE reminder_time IS NOT NULL"
+        )
+        # Delivery state of each reminder, kept so a restart never fires one twice
+        self.create_table("reminder_deliveries", {
+            "message_id": "INTEGER PRIMARY KEY",
+            "claimed_at": "TEXT",
+            "delivered_at": "TEXT",
+            "notifier": "TEXT",
+            "error": "TEXT"
+        })
+        self.ensure_project_stats()
+        self.ensure_project_tree()
+
+        # Text extracted from attached files (see previews.py), matched by search_messages
+        self.create_table("attachment_text", {
+            "message_id": "INTEGER PRIMARY KEY",
+            "page_count": "INTEGER",
+            "text": "TEXT NOT NULL"
+        })
+
+        # Journal of bulk operations, replayed backwards by undo_last_batch
+        self.create_table("undo_journal", {
+            "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+            "batch_id": "INTEGER NOT NULL",
+            "operation": "TEXT NOT NULL",
+            "message_id": "INTEGER NOT NULL",
+            "payload": "TEXT",
+            "created_at": "DATETIME DEFAULT CURRENT_TIMESTAMP"
+        })
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_undo_journal_batch ON undo_journal (batch_id)")
+        self.commit()
+
+    def ensure_project_stats(self):
+        """
+        Add the per-project aggregate columns and the triggers that keep them up to date.
+
+        Every change to a project's aggregates also gives it a new revision (one higher
+        than any other project), so get_project_summaries can return only the projects
+        that changed since the last call.
+        """
+        added = False
+        added |= self.add_column_if_not_exists("projects", "message_count", "INTEGER DEFAULT 0")
+        added |= self.add_column_if_not_exists("projects", "last_activity", "DATETIME")
+        added |= self.add_column_if_not_exists("projects", "pending_reminders", "INTEGER DEFAULT 0")
+        added |= self.add_column_if_not_exists("projects", "revision", "INTEGER DEFAULT 0")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_projects_revision ON projects (revision)")
+
+        next_revision = "(SELECT COALESCE(MAX(revision), 0) + 1 FROM projects)"
+        pending = "({row}.reminder_time IS NOT NULL AND {row}.reminder_fired = 0)"
+
+        self.cursor.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS project_stats_insert AFTER INSERT ON messages
+            BEGIN
+                UPDATE projects SET
+                    message_count = message_count + 1,
+                    last_activity = MAX(COALESCE(last_activity, ''), NEW.timestamp),
+                    pending_reminders = pending_reminders + {pending.format(row="NEW")},
+                    revision = {next_revision}
+                WHERE name = NEW.project;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS project_stats_delete AFTER DELETE ON messages
+            BEGIN
+                UPDATE projects SET
+                    message_count = message_count - 1,
+                    pending_reminders = pending_reminders - {pending.format(row="OLD")},
+                    revision = {next_revision}
+                WHERE name = OLD.project;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS project_stats_update
+            AFTER UPDATE OF project, reminder_time, reminder_fired ON messages
+            BEGIN
+                UPDATE projects SET
+                    message_count = message_count - 1,
+                    pending_reminders = pending_reminders - {pending.format(row="OLD")},
+                    revision = {next_revision}
+                WHERE name = OLD.project;
+                UPDATE projects SET
+                    message_count = message_count + 1,
+                    last_activity = MAX(COALESCE(last_activity, ''), NEW.timestamp),
+                    pending_reminders = pending_reminders + {pending.format(row="NEW")},
+                    revision = {next_revision}
+                WHERE name = NEW.project;
+            END;
+
+            -- Messages can reference a project before it exists, count them on creation
+            CREATE TRIGGER IF NOT EXISTS project_stats_create AFTER INSERT ON projects
+            BEGIN
+                UPDATE projects SET
+                    message_count = (SELECT COUNT(*) FROM messages WHERE project = NEW.name),
+                    last_activity = (SELECT MAX(timestamp) FROM messages WHERE project = NEW.name),
+                    pending_reminders = (SELECT COUNT(*) FROM messages WHERE project = NEW.name
+                                         AND reminder_time IS NOT NULL AND reminder_fired = 0),
+                    revision = {next_revision}
+                WHERE id = NEW.id;
+            END;
+        """)
+
+        if added:
+            self.refresh_project_stats()
+
+    def ensure_project_tree(self):
+        """
+        Add the project hierarchy: a parent_id column and the project_tree closure table.
+
+        project_tree holds one row per (ancestor, descendant) pair, a project
+        being its own ancestor at depth 0, so a folder listing, a subtree and
+        the path of a project are each one indexed lookup. Triggers keep it in
+        sync when a project is created, deleted or gets another parent, and
+        refuse to move a project into its own subtree.
+        """
+        added = self.add_column_if_not_exists("projects", "parent_id", "INTEGER")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_projects_parent ON projects (parent_id, name)")
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS project_tree (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, descendant_id)
+            ) WITHOUT ROWID
+        """)
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_project_tree_descendant ON project_tree (descendant_id, depth)"
+        )
+
+        subtree = "SELECT descendant_id FROM project_tree WHERE ancestor_id = {id}"
+        self.cursor.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS project_tree_insert AFTER INSERT ON projects
+            BEGIN
+                INSERT INTO project_tree (ancestor_id, descendant_id, depth)
+                    SELECT ancestor_id, NEW.id, depth + 1 FROM project_tree WHERE descendant_id = NEW.parent_id
+                    UNION ALL SELECT NEW.id, NEW.id, 0;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS project_tree_delete AFTER DELETE ON projects
+            BEGIN
+                DELETE FROM project_tree WHERE descendant_id = OLD.id;
+                DELETE FROM project_tree WHERE ancestor_id = OLD.id;
+                UPDATE projects SET parent_id = OLD.parent_id WHERE parent_id = OLD.id;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS project_tree_check_move
+            BEFORE UPDATE OF parent_id ON projects
+            WHEN NEW.parent_id IN ({subtree.format(id="NEW.id")})
+            BEGIN
+                SELECT RAISE(ABORT, 'a project cannot be moved into its own subtree');
+            END;
+
+            -- Detach the subtree from its old ancestors, then hang it under the new ones
+            CREATE TRIGGER IF NOT EXISTS project_tree_move
+            AFTER UPDATE OF parent_id ON projects
+            WHEN OLD.parent_id IS NOT NEW.parent_id
+            BEGIN
+                DELETE FROM project_tree
+                WHERE descendant_id IN ({subtree.format(id="NEW.id")})
+                  AND ancestor_id NOT IN ({subtree.format(id="NEW.id")});
+                INSERT INTO project_tree (ancestor_id, descendant_id, depth)
+                    SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1
+                    FROM project_tree above, project_tree below
+                    WHERE above.descendant_id = NEW.parent_id AND below.ancestor_id = NEW.id;
+            END;
+        """)
+
+        if added:
+            # Existing projects all start at the top level
+            self.cursor.execute(
+                "INSERT OR IGNORE INTO project_tree (ancestor_id, descendant_id, depth) SELECT id, id, 0 FROM projects"
+            )
+            self.commit()
+
+    def refresh_project_stats(self):
+        """Recompute every project's aggregate columns from the messages table."""
+        self.cursor.execute("SELECT COALESCE(MAX(revision), 0) FROM projects")
+        revision = self.cursor.fetchone()[0]
+        self.cursor.execute("""
+            UPDATE projects SET
+                message_count = (SELECT COUNT(*) FROM messages WHERE project = projects.name),
+                last_activity = (SELECT MAX(timestamp) FROM messages WHERE project = projects.name),
+                pending_reminders = (SELECT COUNT(*) FROM messages WHERE project = projects.name
+                                     AND reminder_time IS NOT NULL AND reminder_fired = 0),
+                revision = ? + id
+        """, (revision,))
+        self.commit()
+
+    def get_project_summaries(self, since_revision=0):
+        """
+        Retrieve projects with their message count, last activity and pending reminders.
+
+        Args:
+            since_revision (int, optional): Only return projects changed after this revision. Defaults to 0 (all projects).
+
+        Returns:
+            list: ProjectSummary tuples, ordered by name
+        """
+        self.cursor.execute(
+            f"""SELECT {', '.join(ProjectSummary._fields)} FROM projects
+                WHERE revision > ? ORDER BY name""",
+            (since_revision,)
+        )
+        return list(map(ProjectSummary._make, self.cursor.fetchall()))
+
+    def get_projects_revision(self):
+        """Return the newest project revision, to pass to get_project_summaries later."""
+        self.cursor.execute("SELECT COALESCE(MAX(revision), 0) FROM projects")
+        return self.cursor.fetchone()[0]
+
+    def get_child_projects(self, parent=None):
+        """
+        List the projects directly inside a project.
+
+        Args:
+            parent (str, optional): Name of the parent project. Defaults to None (the top level).
+
+        Returns:
+            list: ProjectNode tuples, ordered by name; empty if the parent does not exist
+        """
+        if parent is not None and not self.project_exists(parent):
+            return []
+        fields = ", ".join(f"p.{field}" for field in ProjectSummary._fields)
+        self.cursor.execute(
+            f"""SELECT {fields},
+                    (SELECT COUNT(*) FROM projects c WHERE c.parent_id = p.id),
+                    (SELECT SUM(d.message_count) FROM project_tree t JOIN projects d ON d.id = t.descendant_id
+                     WHERE t.ancestor_id = p.id)
+                FROM projects p
+                WHERE p.parent_id IS (SELECT id FROM projects WHERE name = ?)
+                ORDER BY p.name""",
+            (parent,)
+        )
+        return list(map(ProjectNode._make, self.cursor.fetchall()))
+
+    def project_exists(self, name):
+        """Return True if a project with this name exists."""
+        self.cursor.execute("SELECT 1 FROM projects WHERE name = ?", (name,))
+        return self.cursor.fetchone() is not None
+
+    def get_subtree_projects(self, project):
+        """
+        Return the names of a project and every project below it, nearest first.
+
+        Returns:
+            list: Project names, starting with project itself; empty if it does not exist
+        """
+        self.cursor.execute(
+            """SELECT p.name FROM project_tree t JOIN projects p ON p.id = t.descendant_id
+               WHERE t.ancestor_id = (SELECT id FROM projects WHERE name = ?)
+               ORDER BY t.depth, p.name""",
+            (project,)
+        )
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def get_project_path(self, project):
+        """
+        Return the names of the projects leading to a project, from the top level down.
+
+        Returns:
+            list: Project names, ending with project itself; empty if it does not exist
+        """
+        self.cursor.execute(
+            """SELECT p.name FROM project_tree t JOIN projects p ON p.id = t.ancestor_id
+               WHERE t.descendant_id = (SELECT id FROM projects WHERE name = ?)
+               ORDER BY t.depth DESC""",
+            (project,)
+        )
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def count_subtree_messages(self, project):
+        """Return the number of messages in a project and every project below it."""
+        self.cursor.execute(
+            """SELECT COALESCE(SUM(p.message_count), 0) FROM project_tree t JOIN projects p ON p.id = t.descendant_id
+               WHERE t.ancestor_id = (SELECT id FROM projects WHERE name = ?)""",
+            (project,)
+        )
+        return self.cursor.fetchone()[0]
+
+    def move_project(self, project, new_parent=None):
+        """
+        Move a project, with everything below it, into another project.
+
+        Args:
+            project (str): Name of the project to move
+            new_parent (str, optional): Name of the new parent. Defaults to None (the top level).
+
+        Returns:
+            bool: True if the project was moved, False if either project does not exist
+
+        Raises:
+            ValueError: If the project is 'main' or new_parent is inside the project's own subtree
+        """
+        if project == "main":
+            raise ValueError("The main project cannot be moved")
+
+        self.cursor.execute(
+            """SELECT p.id, parent.name FROM projects p LEFT JOIN projects parent ON parent.id = p.parent_id
+               WHERE p.name = ?""",
+            (project,)
+        )
+        row = self.cursor.fetchone()
+        if row is None or (new_parent is not None and not self.project_exists(new_parent)):
+            return False
+        project_id, old_parent = row
+        if old_parent == new_parent:
+            return True
+
+        next_revision = "(SELECT COALESCE(MAX(revision), 0) + 1 FROM projects)"
+        try:
+            self.cursor.execute(
+                f"""UPDATE projects SET parent_id = (SELECT id FROM projects WHERE name = ?), revision = {next_revision}
+                    WHERE id = ?""",
+                (new_parent, project_id)
+            )
+            self.commit()
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            raise ValueError(f"{project!r} cannot be moved into its own subtree") from None
+
+        self.emit(ProjectMoved(project, old_parent, new_parent))
+        return True
+
+    def enable_deduplication(self, threshold=0.8):
+        """
+        Detect duplicates and near duplicates when messages are inserted.
+
+        Args:
+            threshold (float, optional): Estimated similarity from which a message is a near duplicate. Defaults to 0.8.
+
+        Returns:
+            Deduplicator: The deduplicator now consulted by insert_message(s)
+        """
+        from dedup import Deduplicator
+
+        self.deduplicator = Deduplicator(self, threshold)
+        return self.deduplicator
+
+    def enable_encryption(self, passphrase, vault_dir=None, migrate=True):
+        """
+        Encrypt message bodies, attachment paths, attachment text and attached files at rest.
+
+        The key is derived from the passphrase with scrypt and a salt stored in
+        the database, next to a verifier that recognises a wrong passphrase.
+        From now on insert_message(s) store sealed values plus blind-index
+        tokens of their words (the message_tokens table), and attached files
+        are copied encrypted into vault_dir. Values are read back still
+        encrypted; reveal() decrypts one when it is actually needed, e.g. when
+        a row is rendered. search_messages matches whole words of the body and
+        of the attachment text through the blind index.
+
+        Args:
+            passphrase (str): The passphrase of this database
+            vault_dir (str, optional): Where encrypted attachments are written. Defaults to "<db_name>.vault".
+            migrate (bool, optional): When encryption is first enabled, encrypt the messages stored so far. Defaults to True.
+
+        Returns:
+            MessageCipher: The cipher, to share with other handlers of the same database (see use_cipher)
+
+        Raises:
+            ImportError: If the cryptography package is not installed
+            ValueError: If the passphrase does not match the one the database was encrypted with
+        """
+        from crypto_store import MessageCipher, SCRYPT_N, SCRYPT_R, SCRYPT_P
+
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS encryption (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                salt BLOB NOT NULL,
+                n INTEGER NOT NULL,
+                r INTEGER NOT NULL,
+                p INTEGER NOT NULL,
+                verifier TEXT NOT NULL
+            )
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS message_tokens (
+                token BLOB NOT NULL,
+                message_id INTEGER NOT NULL,
+                PRIMARY KEY (token, message_id)
+            ) WITHOUT ROWID
+        """)
+        # Tokens go away with their message, however it is deleted; archive and undo put them back
+        self.cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS message_tokens_delete AFTER DELETE ON messages
+            BEGIN
+                DELETE FROM message_tokens WHERE message_id = OLD.id;
+            END
+        """)
+        self.commit()
+        self.columns_cache.pop("message_tokens", None)
+
+        self.cursor.execute("SELECT salt, n, r, p, verifier FROM encryption WHERE id = 1")
+        row = self.cursor.fetchone()
+        if row is not None:
+            salt, n, r, p, verifier = row
+            cipher = MessageCipher.from_passphrase(passphrase, salt, n, r, p)
+            if not cipher.check(verifier):
+                raise ValueError("Wrong passphrase for this database")
+            self.use_cipher(cipher, vault_dir)
+            return cipher
+
+        salt = os.urandom(16)
+        cipher = MessageCipher.from_passphrase(passphrase, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        self.cursor.execute(
+            "INSERT INTO encryption (id, salt, n, r, p, verifier) VALUES (1, ?, ?, ?, ?, ?)",
+            (salt, SCRYPT_N, SCRYPT_R, SCRYPT_P, cipher.verifier())
+        )
+        self.commit()
+        self.use_cipher(cipher, vault_dir)
+        if migrate:
+            self.encrypt_existing_messages()
+        return cipher
+
+    def encryption_enabled(self):
+        """Whether encryption was enabled on this database, whether or not this handler has the key."""
+        self.cursor.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'encryption'")
+        if self.cursor.fetchone() is None:
+            return False
+        self.cursor.execute("SELECT 1 FROM encryption WHERE id = 1")
+        return self.cursor.fetchone() is not None
+
+    def use_cipher(self, cipher, vault_dir=None):
+        """Share the cipher of an encrypted database with this handler, e.g. on a writer thread."""
+        self.cipher = cipher
+        self.vault_dir = vault_dir or f"{self.db_name}.vault"
+
+    def reveal(self, value, context="message"):
+        """Return the plaintext of a value read from an encrypted column (plaintext values are returned as they are)."""
+        if self.cipher is None or not value:
+            return value
+        return self.cipher.decrypt(value, context)
+
+    def encrypt_attachment(self, file_path):
+        """
+        Copy an attached file, encrypted chunk by chunk, into the vault.
+
+        Returns:
+            str: Path of the encrypted copy; file_path itself if it is missing or already in the vault
+        """
+        from crypto_store import is_encrypted_file
+
+        if not file_path or not os.path.isfile(file_path) or is_encrypted_file(file_path):
+            return file_path
+        os.makedirs(self.vault_dir, exist_ok=True)
+        _, ext = os.path.splitext(file_path)
+        vault_path = os.path.join(self.vault_dir, f"{uuid.uuid4().hex}{ext.lower()}.enc")
+        self.cipher.encrypt_file(file_path, vault_path)
+        return vault_path
+
+    def _seal_row(self, row):
+        """Return a copy of a row with its body and attachment path encrypted, and the tokens of its words."""
+        row = dict(row)
+        tokens = self.cipher.blind_tokens(row.get("message"))
+        row["message"] = self.cipher.encrypt(row.get("message"), "message")
+        if row.get("file_path"):
+            row["file_path"] = self.cipher.encrypt(row["file_path"], "file_path")
+        return row, tokens
+
+    def seal_imported_row(self, row):
+        """
+        Return a copy of an imported message row as this encrypted database stores it, and its tokens.
+
+        Values encrypted under this database's key, e.g. from one of its exports, are
+        decrypted first, and an attached file is copied encrypted into the vault.
+
+        Raises:
+            ValueError: If a value was encrypted under another key
+        """
+        row = dict(row, message=self.reveal(row.get("message")))
+        if row.get("file_path"):
+            row["file_path"] = self.encrypt_attachment(self.reveal(row["file_path"], "file_path"))
+        return self._seal_row(row)
+
+    def store_tokens(self, message_id, tokens):
+        """Add the blind-index tokens of a message. Runs inside the caller's transaction."""
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO message_tokens (token, message_id) VALUES (?, ?)",
+            [(token, message_id) for token in tokens]
+        )
+
+    def _saved_tokens(self, message_ids):
+        """Return message ID -> blind-index tokens of messages about to be deleted, to be stored again later."""
+        if not message_ids or "token" not in self.get_columns("message_tokens"):
+            return {}
+        saved = {}
+        for start in range(0, len(message_ids), 500):
+            chunk = list(message_ids[start:start + 500])
+            self.cursor.execute(
+                f"SELECT message_id, token FROM message_tokens WHERE message_id IN ({', '.join(['?'] * len(chunk))})",
+                chunk
+            )
+            for message_id, token in self.cursor.fetchall():
+                saved.setdefault(message_id, []).append(token)
+        return saved
+
+    def encrypt_existing_messages(self, batch_size=500, table_name="messages"):
+        """
+        Encrypt the messages stored before encryption was enabled, one transaction per batch.
+
+        Their duplicate-detection fingerprints were computed from the plaintext
+        without a key, so they are dropped; with deduplication enabled, keyed
+        ones are computed again at the end (otherwise `python -m dedup` does it).
+
+        Returns:
+            int: Number of messages encrypted
+        """
+        from crypto_store import PREFIX, is_encrypted
+
+        fingerprinted = "content_hash" in self.get_columns("message_fingerprints")
+        total = 0
+        last_id = 0
+        while True:
+            self.cursor.execute(
+                f"""SELECT id, message, file_path FROM {table_name}
+                    WHERE id > ? AND substr(message, 1, ?) != ? ORDER BY id LIMIT ?""",
+                (last_id, len(PREFIX), PREFIX, batch_size)
+            )
+            rows = self.cursor.fetchall()
+            if not rows:
+                if total and self.deduplicator is not None:
+                    self.deduplicator.backfill()
+                return total
+            last_id = rows[-1][0]
+
+            # Files are copied into the vault before the write lock is taken
+            vault_paths = {message_id: self.encrypt_attachment(file_path) for message_id, _, file_path in rows}
+            self.begin_immediate()
+            try:
+                for message_id, message, file_path in rows:
+                    if is_encrypted(file_path):  # An empty message whose attachment an earlier run encrypted
+                        continue
+                    sealed, tokens = self._seal_row({"message": message, "file_path": vault_paths[message_id]})
+                    self.cursor.execute(
+                        f"UPDATE {table_name} SET message = ?, file_path = ? WHERE id = ?",
+                        (sealed["message"], sealed["file_path"], message_id)
+                    )
+                    self.store_tokens(message_id, tokens)
+                    if fingerprinted:
+                        self.cursor.execute("DELETE FROM message_fingerprints WHERE message_id = ?", (message_id,))
+                        self.cursor.execute("DELETE FROM message_lsh WHERE message_id = ?", (message_id,))
+                    self.cursor.execute("SELECT text FROM attachment_text WHERE message_id = ?", (message_id,))
+                    attachment = self.cursor.fetchone()
+                    if attachment and attachment[0] and not is_encrypted(attachment[0]):
+                        self.store_tokens(message_id, self.cipher.blind_tokens(self.reveal(attachment[0], "attachment_text")))
+                        self.cursor.execute(
+                            "UPDATE attachment_text SET text = ? WHERE message_id = ?",
+                            (self.cipher.encrypt(attachment[0], "attachment_text"), message_id)
+                        )
+                self.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            total += len(rows)
+
+    def attach_archive(self, archive_name=None):
+        """
+        Attach the archive database holding messages moved out of the live table.
+
+        Archived messages keep their ID and columns. Bodies may be stored zlib
+        compressed (compressed = 1); the decompress_message SQL function returns
+        the text either way.
+
+        Args:
+            archive_name (str, optional): The archive file. Defaults to "<db_name>.archive.db".
+        """
+        if self.archive_name is not None:
+            return
+        archive_name = archive_name or f"{self.db_name}.archive.db"
+        self.cursor.execute("ATTACH DATABASE ? AS archive", (archive_name,))
+        self.conn.create_function("decompress_message", 2, decompress_message, deterministic=True)
+
+        self.cursor.execute("SELECT COUNT(*) FROM archive.sqlite_master")
+        if self.cursor.fetchone()[0] == 0:
+            # Only possible before the first table is created
+            self.cursor.execute("PRAGMA archive.auto_vacuum = INCREMENTAL")
+        self.cursor.execute(
+            """CREATE TABLE IF NOT EXISTS archive.messages (
+                   id INTEGER PRIMARY KEY,
+                   message BLOB,
+                   compressed INTEGER DEFAULT 0,
+                   archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+               )"""
+        )
+        self.archive_name = archive_name
+        self._sync_archive_columns()
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_project ON messages (project, id)")
+        self.commit()
+
+    def _sync_archive_columns(self):
+        """Give the archive table every column the live messages table has."""
+        self.cursor.execute("PRAGMA archive.table_info(messages)")
+        archived = {info[1] for info in self.cursor.fetchall()}
+        self.cursor.execute("PRAGMA main.table_info(messages)")
+        for info in self.cursor.fetchall():
+            if info[1] not in archived:
+                self.cursor.execute(f"ALTER TABLE archive.messages ADD COLUMN {info[1]} {info[2]}")
+        self.commit()
+
+    def archive_messages(self, message_ids, compress_min_bytes=None):
+        """
+        Move messages from the live table to the archive, in one transaction.
+
+        Args:
+            message_ids (list): The IDs of the messages to archive
+            compress_min_bytes (int, optional): Compress bodies of at least this many bytes. Defaults to no compression.
+
+        Returns:
+            int: Number of messages archived
+        """
+        if self.archive_name is None:
+            raise RuntimeError("attach_archive must be called before archiving messages")
+        self._sync_archive_columns()
+
+        self.begin_immediate()
+        try:
+            messages = self.get_messages_by_ids(message_ids)
+            columns = self.get_message_columns()
+            rows = []
+            for msg in messages:
+                values = [getattr(msg, column) for column in columns]
+                body = (msg.message or "").encode("utf-8")
+                compressed = compress_min_bytes is not None and len(body) >= compress_min_bytes
+                if compressed:
+                    values[columns.index("message")] = zlib.compress(body)
+                rows.append(values + [int(compressed)])
+            # Deleting from the live table drops the tokens, but archived messages stay searchable
+            tokens = self._saved_tokens([msg.id for msg in messages])
+
+            self.cursor.executemany(
+                f"""INSERT OR REPLACE INTO archive.messages ({', '.join(columns)}, compressed)
+                    VALUES ({', '.join(['?'] * (len(columns) + 1))})""",
+                rows
+            )
+            self.cursor.executemany("DELETE FROM main.messages WHERE id = ?", [(msg.id,) for msg in messages])
+            for message_id, message_tokens in tokens.items():
+                self.store_tokens(message_id, message_tokens)
+            self.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        for msg in messages:
+            self.emit(MessageDeleted(msg.id, msg.project))
+        return len(messages)
+
+    def begin_immediate(self):
+        """
+        Start a write transaction right away.
+
+        Taking the RESERVED lock up front means two processes working on the same
+        database (for example the GUI and a headless runner) serialize here instead
+        of both reading the same rows and doing the work twice.
+
+        Raises:
+            RuntimeError: If a transaction is already open; committing it here would
+                make half of the caller's changes permanent behind its back
+        """
+        if self.conn.in_transaction:
+            raise RuntimeError("begin_immediate called inside an open transaction; commit or roll it back first")
+        self.cursor.execute("BEGIN IMMEDIATE")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block as one write transaction (BEGIN IMMEDIATE ... COMMIT), rolled back if it raises.
+
+        Blocks nest: an inner block joins the outer transaction, so several
+        methods using transaction() can be combined atomically. Events queued
+        with emit_after_commit are delivered once the outermost block committed,
+        and dropped if it was rolled back.
+        """
+        if self.transaction_depth:
+            self.transaction_depth += 1
+            try:
+                yield
+            finally:
+                self.transaction_depth -= 1
+            return
+
+        self.begin_immediate()
+        self.transaction_depth = 1
+        try:
+            yield
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            self.pending_events = []
+            raise
+        finally:
+            self.transaction_depth = 0
+
+        events, self.pending_events = self.pending_events, []
+        for event in events:
+            self.emit(event)
+
+    def emit_after_commit(self, *events):
+        """Deliver events once the current transaction() block commits (right away outside of one)."""
+        if not self.transaction_depth:
+            for event in events:
+                self.emit(event)
+            return
+        self.pending_events.extend(events)
+
     def insert_message(self, sender, message, table_name="messages", **additional_columns):
         """
         Insert a message into the database.
@@ -98,7 +1088,14 @@ class DatabaseHandler:
             message (str): The message content
             table_name (str, optional): The table to insert into. Defaults to "messages".
             **additional_columns: Additional column values to insert (e.g., category="question")
+
+        Returns:
+            int: The ID of the new message
         """
+        if (self.deduplicator is not None or self.cipher is not None) and table_name == "messages":
+            # Duplicate checks and encryption are done by insert_messages, under the same write lock as the insert
+            return self.insert_messages([dict(sender=sender, message=message, **additional_columns)], table_name)[0]
+
         # Build the SQL query dynamically based on the columns provided
         columns = ["sender", "message"]
         values = [sender, message]
@@ -113,8 +1110,126 @@ class DatabaseHandler:
         placeholders = ", ".join(["?"] * len(columns))
 
         self.cursor.execute(f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})", values)
+        message_id = self.cursor.lastrowid
         self.commit()
 
+        if table_name == "messages":
+            self.emit(MessageInserted(self.get_message(message_id)))
+        return message_id
+
+    def insert_messages(self, rows, table_name="messages"):
+        """
+        Insert several messages in a single transaction (one commit for the whole group).
+
+        With deduplication enabled, an exact duplicate of a message in the same
+        project is collapsed into it (its duplicate_count is bumped and its ID is
+        returned instead of a new one) and a near duplicate is stored linked to
+        the original through duplicate_of, already marked as processed.
+
+        Args:
+            rows (list): Dictionaries of column values, each with at least 'sender' and 'message'
+            table_name (str, optional): The table to insert into. Defaults to "messages".
+
+        Returns:
+            list: The IDs of the new messages, in the order of rows
+        """
+        message_ids = []
+        inserted_ids = []
+        deduplicate = self.deduplicator is not None and table_name == "messages"
+        encrypt = self.cipher is not None and table_name == "messages"
+        if encrypt:
+            # Large files are encrypted before the write lock is taken
+            rows = [dict(row, file_path=self.encrypt_attachment(row["file_path"])) if row.get("file_path") else row
+                    for row in rows]
+        self.begin_immediate()
+        try:
+            for row in rows:
+                fingerprint = None
+                if deduplicate and row.get("message_type", "text") == "text" and not row.get("file_path"):
+                    fingerprint = self.deduplicator.fingerprint(row["message"])
+                    original_id, row = self._link_duplicate(row, fingerprint, table_name)
+                    if original_id is not None:
+                        message_ids.append(original_id)
+                        continue
+
+                tokens = None
+                if encrypt:
+                    row, tokens = self._seal_row(row)
+                columns = list(row)
+                self.cursor.execute(
+                    f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                    [row[column] for column in columns]
+                )
+                message_ids.append(self.cursor.lastrowid)
+                inserted_ids.append(self.cursor.lastrowid)
+                if tokens:
+                    self.store_tokens(self.cursor.lastrowid, tokens)
+                if fingerprint is not None:
+                    self.deduplicator.record(self.cursor.lastrowid, fingerprint)
+            self.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        if table_name == "messages":
+            for message_id in inserted_ids:
+                self.emit(MessageInserted(self.get_message(message_id)))
+        return message_ids
+
+    def _link_duplicate(self, row, fingerprint, table_name="messages"):
+        """
+        Check a row about to be inserted against the stored messages.
+
+        Returns:
+            tuple: (ID of the message the row was collapsed into or None, row to insert)
+        """
+        project = row.get("project") or "main"
+        match = self.deduplicator.find_duplicate(fingerprint, project)
+        if match is None:
+            return None, row
+        original_id, _, exact = match
+
+        self.cursor.execute(
+            f"SELECT project, processed, duplicate_of FROM {table_name} WHERE id = ?", (original_id,)
+        )
+        original_project, original_processed, original_duplicate_of = self.cursor.fetchone()
+        # A repeat sent to the global chat goes where the original was classified to
+        if project == "main" and original_processed == 1 and original_project != "main":
+            project = original_project
+
+        if exact and project == original_project:
+            self.cursor.execute(
+                f"UPDATE {table_name} SET duplicate_count = COALESCE(duplicate_count, 0) + 1 WHERE id = ?",
+                (original_id,)
+            )
+            return original_id, row
+
+        row = dict(row)
+        # Always link to the first message of a chain of duplicates
+        row["duplicate_of"] = original_duplicate_of or original_id
+        # Duplicates are not classified again: they follow the original (see apply_classifications)
+        row["processed"] = 1
+        row["project"] = project
+        return None, row
+
+    def get_message(self, message_id, table_name="messages"):
+        """
+        Retrieve a single message.
+
+        Args:
+            message_id (int): The ID of the message
+            table_name (str, optional): The table to query. Defaults to "messages".
+
+        Returns:
+            Message: The message, or None if it does not exist
+        """
+        select_columns = self.get_message_columns(table_name)
+        self.cursor.execute(f"SELECT {', '.join(select_columns)} FROM {table_name} WHERE id = ?", (message_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return rows_to_messages([row], select_columns)[0]
+
     def get_chat_history(self, table_name="messages", project=None, limit=None):
         """
         Retrieve all messages from the database, ordered by their ID.
@@ -124,22 +1239,8 @@ class DatabaseHandler:
             project (str, optional): Filter messages by project. Defaults to None (all projects).
             limit (int, optional): Limit the number of messages returned. Defaults to None (all messages).
         """
-        # Check which columns exist
-        self.cursor.execute(f"PRAGMA table_info({table_name})")
-        columns_info = self.cursor.fetchall()
-        columns = [info[1] for info in columns_info]
-
-        # Build SELECT clause
-        select_columns = ["id", "sender", "message", "timestamp"]
-        if "category" in columns:
-            select_columns.append("category")
-        if "message_type" in columns:
-            select_columns.append("message_type")
-        if "project" in columns:
-            select_columns.append("project")
-        if "file_path" in columns:
-            select_columns.append("file_path")
-
+        columns = self.get_columns(table_name)
+        select_columns = self.get_message_columns(table_name)
         select_clause = ", ".join(select_columns)
 
         # Build WHERE clause if project is specified
@@ -160,7 +1261,126 @@ class DatabaseHandler:
         self.cursor.execute(query, params)
 
         rows = self.cursor.fetchall()
-        return [self._row_to_dict(row, select_columns) for row in rows]
+        return rows_to_messages(rows, select_columns)
+
+    def query_messages(self, query=None, limit=100, offset=0, facets=FACET_COLUMNS, table_name="messages"):
+        """
+        Run a MessageQuery: one page of matching messages, newest first, plus facet counts.
+
+        All facets come from a single grouped scan of the covering index
+        idx_messages_project_facets, which is already in GROUP BY order, so
+        no temporary B-tree is built and the table is not read unless the
+        query has a text filter. Counts are taken under every filter of the
+        query, including the one on the facet's own column.
+
+        Args:
+            query (MessageQuery, optional): The filters. Defaults to every message.
+            limit (int, optional): Page size. Defaults to 100.
+            offset (int, optional): Messages to skip. Defaults to 0.
+            facets (tuple, optional): Columns to count values of. Defaults to FACET_COLUMNS.
+            table_name (str, optional): The table to query. Defaults to "messages".
+
+        Returns:
+            QueryResult: messages, total and facets
+        """
+        page_sql, page_params, facet_sql, facet_params = self._message_query_sql(
+            query or MessageQuery(), limit, offset, facets, table_name
+        )
+        select_columns = self.get_message_columns(table_name)
+
+        counts = {column: {} for column in facets}
+        # The query groups by a prefix of FACET_COLUMNS, which may include columns that were not asked for
+        positions = [FACET_COLUMNS.index(column) for column in facets]
+        total = 0
+        self.cursor.execute(facet_sql, facet_params)
+        for row in self.cursor.fetchall():
+            count = row[-1]
+            total += count
+            for column, position in zip(facets, positions):
+                value = row[position]
+                counts[column][value] = counts[column].get(value, 0) + count
+
+        self.cursor.execute(page_sql, page_params)
+        messages = rows_to_messages(self.cursor.fetchall(), select_columns)
+
+        return QueryResult(
+            messages,
+            total,
+            {column: sorted(values.items(), key=lambda item: (-item[1], str(item[0])))
+             for column, values in counts.items()}
+        )
+
+    def _message_query_sql(self, query, limit, offset, facets, table_name):
+        unknown = [column for column in facets if column not in FACET_COLUMNS]
+        if unknown:
+            raise ValueError(f"Cannot count facets of {unknown}")
+        where_clause, params = query.where_clause()
+        select_clause = ", ".join(self.get_message_columns(table_name))
+
+        page_sql = (f"SELECT {select_clause} FROM {table_name}{where_clause}"
+                    f" ORDER BY timestamp DESC LIMIT ? OFFSET ?")
+        # Grouping by the leading columns of the facet index reads it in order; pinned because without
+        # statistics SQLite prefers the range scan of idx_messages_timestamp and sorts the groups
+        indexed_by = f" INDEXED BY {FACET_INDEX}" if table_name == "messages" else ""
+        if facets:
+            group_columns = ", ".join(FACET_COLUMNS[:max(FACET_COLUMNS.index(column) for column in facets) + 1])
+            facet_sql = (f"SELECT {group_columns}, COUNT(*) FROM {table_name}{indexed_by}{where_clause}"
+                         f" GROUP BY {group_columns}")
+        else:
+            facet_sql = f"SELECT COUNT(*) FROM {table_name}{indexed_by}{where_clause}"
+        return page_sql, params + [limit, offset], facet_sql, params
+
+    def explain_query_plan(self, sql, params=()):
+        """Return the EXPLAIN QUERY PLAN details of a statement, one string per plan step."""
+        self.cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in self.cursor.fetchall()]
+
+    def explain_query_messages(self, query=None, facets=FACET_COLUMNS, table_name="messages"):
+        """
+        Return the query plans query_messages would use, to check that the covering indexes are picked.
+
+        Returns:
+            dict: {"page": [plan steps], "facets": [plan steps]}
+        """
+        page_sql, page_params, facet_sql, facet_params = self._message_query_sql(
+            query or MessageQuery(), 100, 0, facets, table_name
+        )
+        return {
+            "page": self.explain_query_plan(page_sql, page_params),
+            "facets": self.explain_query_plan(facet_sql, facet_params),
+        }
+
+    def get_chat_history_columns(self, columns=("id", "message"), table_name="messages", project=None, limit=None):
+        """
+        Retrieve messages as a columnar result instead of one object per row.
+
+        Meant for bulk consumers (classifier, exporters) that only need a few fields.
+
+        Args:
+            columns (tuple, optional): The columns to return. Defaults to ("id", "message").
+            table_name (str, optional): The table to query. Defaults to "messages".
+            project (str, optional): Filter messages by project. Defaults to None (all projects).
+            limit (int, optional): Limit the number of messages returned. Defaults to None (all messages).
+
+        Returns:
+            dict: Column name -> tuple of values, in id order
+        """
+        unknown = [column for column in columns if column not in self.get_columns(table_name)]
+        if unknown:
+            raise ValueError(f"Unknown columns for {table_name}: {unknown}")
+
+        query = f"SELECT {', '.join(columns)} FROM {table_name}"
+        params = []
+        if project:
+            query += " WHERE project = ?"
+            params.append(project)
+        query += " ORDER BY id"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        self.cursor.execute(query, params)
+        return rows_to_columns(self.cursor.fetchall(), columns)
 
     def delete_message(self, message_id, table_name="messages"):
         """
@@ -170,9 +1390,16 @@ class DatabaseHandler:
             message_id (int): The ID of the message to delete
             table_name (str, optional): The table to delete from. Defaults to "messages".
         """
+        self.cursor.execute(f"SELECT project FROM {table_name} WHERE id = ?", (message_id,))
+        row = self.cursor.fetchone()
+
         self.cursor.execute(f"DELETE FROM {table_name} WHERE id = ?", (message_id,))
+        deleted = self.cursor.rowcount > 0
         self.commit()
-        return self.cursor.rowcount > 0
+
+        if deleted and table_name == "messages":
+            self.emit(MessageDeleted(message_id, row[0] if row else None))
+        return deleted
 
     def update_message_project(self, message_id, new_project, table_name="messages"):
         """
@@ -184,17 +1411,28 @@ class DatabaseHandler:
             table_name (str, optional): The table to update. Defaults to "messages".
         """
         # Ensure the project exists
+        project_created = False
         self.cursor.execute("SELECT COUNT(*) FROM projects WHERE name = ?", (new_project,))
         if self.cursor.fetchone()[0] == 0:
             # Create the project if it doesn't exist
             self.cursor.execute("INSERT INTO projects (name) VALUES (?)", (new_project,))
+            project_created = True
+
+        self.cursor.execute(f"SELECT project FROM {table_name} WHERE id = ?", (message_id,))
+        row = self.cursor.fetchone()
 
         # Update the message
         self.cursor.execute(f"UPDATE {table_name} SET project = ? WHERE id = ?", (new_project, message_id))
+        updated = self.cursor.rowcount > 0
         self.commit()
-        return self.cursor.rowcount > 0
 
-    def search_messages(self, search_term, table_name="messages", project=None):
+        if project_created:
+            self.emit(ProjectCreated(new_project))
+        if updated and table_name == "messages":
+            self.emit(MessageMoved(message_id, row[0] if row else None, new_project))
+        return updated
+
+    def search_messages(self, search_term, table_name="messages", project=None, include_archive=True):
         """
         Search for messages containing the search term.
 
@@ -202,51 +1440,80 @@ class DatabaseHandler:
             search_term (str): The term to search for
             table_name (str, optional): The table to search in. Defaults to "messages".
             project (str, optional): Filter by project. Defaults to None (all projects).
-        """
-        # Check which columns exist
-        self.cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = [info[1] for info in self.cursor.fetchall()]
-
-        # Build SELECT clause
-        select_columns = ["id", "sender", "message", "timestamp"]
-        if "category" in columns:
-            select_columns.append("category")
-        if "message_type" in columns:
-            select_columns.append("message_type")
-        if "project" in columns:
-            select_columns.append("project")
-        if "file_path" in columns:
-            select_columns.append("file_path")
+            include_archive (bool, optional): Also search the attached archive. Defaults to True.
 
+        The term is matched as a substring of the body or of the attachment text.
+        With encryption enabled only the blind index can be searched: every word
+        of the term must appear as a whole word (case-insensitive) in the body or
+        the attachment text, so "rem" does not find "reminder".
+        """
+        columns = self.get_columns(table_name)
+        select_columns = self.get_message_columns(table_name)
         select_clause = ", ".join(select_columns)
 
         # Build WHERE clause
         where_clause = " WHERE message LIKE ?"
         params = [f"%{search_term}%"]
+        if self.cipher is not None and table_name == "messages":
+            # Encrypted bodies cannot be matched with LIKE: look every word up in the blind index,
+            # which also holds the words of the attachment text (see store_attachment_text)
+            tokens = list(self.cipher.blind_tokens(search_term))
+            if not tokens:
+                return []
+            where_clause = (f" WHERE id IN (SELECT message_id FROM message_tokens WHERE token IN"
+                            f" ({', '.join(['?'] * len(tokens))}) GROUP BY message_id HAVING COUNT(*) = ?)")
+            params = tokens + [len(tokens)]
+        elif table_name == "messages":
+            # Also match the text extracted from attachments
+            where_clause = " WHERE (message LIKE ? OR id IN (SELECT message_id FROM attachment_text WHERE text LIKE ?))"
+            params.append(f"%{search_term}%")
 
         if project and "project" in columns:
             where_clause += " AND project = ?"
             params.append(project)
 
         # Execute query
-        query = f"SELECT {select_clause} FROM {table_name}{where_clause} ORDER BY id"
-        self.cursor.execute(query, params)
+        query = f"SELECT {select_clause} FROM {table_name}{where_clause}"
+        if include_archive and self.archive_name is not None and table_name == "messages":
+            # Archived bodies may be compressed, so match on the inflated text
+            archive_clause = ", ".join(
+                "decompress_message(message, compressed)" if column == "message" else column
+                for column in select_columns
+            )
+            query += (f" UNION ALL SELECT {archive_clause} FROM archive.messages"
+                      f"{where_clause.replace('message LIKE', 'decompress_message(message, compressed) LIKE')}")
+            params = params * 2
+        self.cursor.execute(query + " ORDER BY id", params)
 
         rows = self.cursor.fetchall()
-        return [self._row_to_dict(row, select_columns) for row in rows]
+        return rows_to_messages(rows, select_columns)
 
-    def _row_to_dict(self, row, columns):
-        """
-        Convert a database row (tuple) to a dictionary.
+    def store_attachment_text(self, message_id, text, page_count=None):
+        """Store the text extracted from the file attached to a message, for search."""
+        if self.cipher is not None:
+            self.store_tokens(message_id, self.cipher.blind_tokens(text))
+            text = self.cipher.encrypt(text, "attachment_text")
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO attachment_text (message_id, page_count, text) VALUES (?, ?, ?)",
+            (message_id, page_count, text or "")
+        )
+        self.commit()
 
-        Args:
-            row (tuple): The database row
-            columns (list): The column names
+    def get_unindexed_attachments(self, limit=100, table_name="messages"):
+        """
+        Return messages with an attached file whose text has not been extracted yet.
 
         Returns:
-            dict: The row as a dictionary
+            list: (message_id, file_path) tuples, oldest first
         """
-        return {columns[i]: row[i] for i in range(len(columns))}
+        self.cursor.execute(
+            f"""SELECT id, file_path FROM {table_name}
+                WHERE COALESCE(file_path, '') != '' AND message_type != 'text'
+                AND id NOT IN (SELECT message_id FROM attachment_text)
+                ORDER BY id LIMIT ?""",
+            (limit,)
+        )
+        return self.cursor.fetchall()
 
     def get_messages(self, project=None, limit=None, table_name="messages"):
         """
@@ -259,36 +1526,487 @@ class DatabaseHandler:
             table_name (str, optional): The table to query. Defaults to "messages".
 
         Returns:
-            list: A list of message dictionaries
+            list: A list of Message objects
         """
         return self.get_chat_history(table_name, project, limit)
 
+    def _start_journal_batch(self, keep_batches=20):
+        """
+        Return the ID for a new undo batch and forget batches older than the last keep_batches.
+
+        Must be called inside the transaction of the bulk operation.
+        """
+        self.cursor.execute("SELECT COALESCE(MAX(batch_id), 0) + 1 FROM undo_journal")
+        batch_id = self.cursor.fetchone()[0]
+        self.cursor.execute("DELETE FROM undo_journal WHERE batch_id <= ?", (batch_id - keep_batches,))
+        return batch_id
+
+    def _journal(self, batch_id, operation, rows):
+        """Record (message_id, payload dict) pairs of a bulk operation."""
+        self.cursor.executemany(
+            "INSERT INTO undo_journal (batch_id, operation, message_id, payload) VALUES (?, ?, ?, ?)",
+            [(batch_id, operation, message_id, json.dumps(payload)) for message_id, payload in rows]
+        )
+
+    def get_messages_by_ids(self, message_ids, table_name="messages"):
+        """Retrieve several messages by ID, in chunks that stay under SQLite's variable limit."""
+        messages = []
+        columns = self.get_message_columns(table_name)
+        for start in range(0, len(message_ids), 500):
+            chunk = list(message_ids[start:start + 500])
+            self.cursor.execute(
+                f"SELECT {', '.join(columns)} FROM {table_name} WHERE id IN ({', '.join(['?'] * len(chunk))})",
+                chunk
+            )
+            messages.extend(rows_to_messages(self.cursor.fetchall(), columns))
+        return messages
+
+    def bulk_move_messages(self, message_ids, new_project, table_name="messages"):
+        """
+        Move several messages to a project in one transaction, recorded for undo.
+
+        Args:
+            message_ids (list): The IDs of the messages to move
+            new_project (str): The new project name, created if it doesn't exist
+            table_name (str, optional): The table to update. Defaults to "messages".
+
+        Returns:
+            int: Number of messages moved
+        """
+        events = []
+        self.begin_immediate()
+        try:
+            self.cursor.execute("INSERT OR IGNORE INTO projects (name) VALUES (?)", (new_project,))
+            if self.cursor.rowcount > 0:
+                events.append(ProjectCreated(new_project))
+
+            moved = [msg for msg in self.get_messages_by_ids(message_ids, table_name) if msg.project != new_project]
+            batch_id = self._start_journal_batch()
+            self._journal(batch_id, "move", [(msg.id, {"project": msg.project}) for msg in moved])
+            self.cursor.executemany(
+                f"UPDATE {table_name} SET project = ? WHERE id = ?",
+                [(new_project, msg.id) for msg in moved]
+            )
+            self.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        events.extend(MessageMoved(msg.id, msg.project, new_project) for msg in moved)
+        for event in events:
+            self.emit(event)
+        return len(moved)
+
+    def bulk_delete_messages(self, message_ids, table_name="messages"):
+        """
+        Delete several messages in one transaction, keeping the rows in the undo journal.
+
+        Args:
+            message_ids (list): The IDs of the messages to delete
+            table_name (str, optional): The table to delete from. Defaults to "messages".
+
+        Returns:
+            int: Number of messages deleted
+        """
+        self.begin_immediate()
+        try:
+            deleted = self.get_messages_by_ids(message_ids, table_name)
+            # Blind-index tokens are kept with the row, since a locked handler could not compute them again
+            tokens = self._saved_tokens([msg.id for msg in deleted]) if table_name == "messages" else {}
+            batch_id = self._start_journal_batch()
+            self._journal(batch_id, "delete", [
+                (msg.id, dict(msg.as_dict(), tokens=[token.hex() for token in tokens[msg.id]])
+                 if msg.id in tokens else msg.as_dict())
+                for msg in deleted
+            ])
+            self.cursor.executemany(f"DELETE FROM {table_name} WHERE id = ?", [(msg.id,) for msg in deleted])
+            self.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        for msg in deleted:
+            self.emit(MessageDeleted(msg.id, msg.project))
+        return len(deleted)
+
+    def bulk_reclassify_messages(self, message_ids, table_name="messages"):
+        """
+        Send several messages back to the classification backlog, recorded for undo.
+
+        Args:
+            message_ids (list): The IDs of the messages to reclassify
+            table_name (str, optional): The table to update. Defaults to "messages".
+
+        Returns:
+            int: Number of messages queued for classification
+        """
+        self.begin_immediate()
+        try:
+            messages = self.get_messages_by_ids(message_ids, table_name)
+            batch_id = self._start_journal_batch()
+            self._journal(batch_id, "reclassify", [(msg.id, {"processed": msg.processed}) for msg in messages])
+            self.cursor.executemany(
+                f"UPDATE {table_name} SET processed = 0, claimed_at = NULL, claimed_until = NULL WHERE id = ?",
+                [(msg.id,) for msg in messages]
+            )
+            self.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        return len(messages)
+
+    def undo_last_batch(self, table_name="messages"):
+        """
+        Revert the most recent bulk operation.
+
+        Returns:
+            int: Number of messages restored (0 if there is nothing to undo)
+        """
+        events = []
+        restored_ids = []
+        self.begin_immediate()
+        try:
+            self.cursor.execute("SELECT MAX(batch_id) FROM undo_journal")
+            batch_id = self.cursor.fetchone()[0]
+            if batch_id is None:
+                self.commit()
+                return 0
+
+            self.cursor.execute(
+                "SELECT operation, message_id, payload FROM undo_journal WHERE batch_id = ? ORDER BY id DESC",
+                (batch_id,)
+            )
+            entries = self.cursor.fetchall()
+
+            for operation, message_id, payload in entries:
+                payload = json.loads(payload)
+                if operation == "delete":
+                    columns = [column for column in payload if column in self.get_columns(table_name)]
+                    self.cursor.execute(
+                        f"INSERT OR IGNORE INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                        [payload[column] for column in columns]
+                    )
+                    if self.cursor.rowcount > 0:
+                        restored_ids.append(message_id)
+                        if payload.get("tokens"):
+                            self.store_tokens(message_id, [bytes.fromhex(token) for token in payload["tokens"]])
+                elif operation == "move":
+                    self.cursor.execute(f"SELECT project FROM {table_name} WHERE id = ?", (message_id,))
+                    row = self.cursor.fetchone()
+                    if row is not None and row[0] != payload["project"]:
+                        self.cursor.execute(
+                            f"UPDATE {table_name} SET project = ? WHERE id = ?", (payload["project"], message_id)
+                        )
+                        events.append(MessageMoved(message_id, row[0], payload["project"]))
+                elif operation == "reclassify":
+                    self.cursor.execute(
+                        f"UPDATE {table_name} SET processed = ? WHERE id = ? AND processed = 0",
+                        (payload["processed"], message_id)
+                    )
+
+            self.cursor.execute("DELETE FROM undo_journal WHERE batch_id = ?", (batch_id,))
+            self.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        for message_id in restored_ids:
+            self.emit(MessageInserted(self.get_message(message_id, table_name)))
+        for event in events:
+            self.emit(event)
+        return len(entries)
+
     def get_projects(self):
         """Get all projects from the database."""
         self.cursor.execute("SELECT name FROM projects ORDER BY name")
         return [row[0] for row in self.cursor.fetchall()]
 
-    def create_project(self, project_name):
+    def create_project(self, project_name, parent=None):
         """
         Create a new project.
 
         Args:
             project_name (str): The name of the project to create
+            parent (str, optional): The project to create it in. Defaults to None (the top level).
+
+        Returns:
+            bool: True if the project was created, False if it already exists or the parent does not
         """
+        if parent is not None and not self.project_exists(parent):
+            return False
         try:
-            self.cursor.execute("INSERT INTO projects (name) VALUES (?)", (project_name,))
+            self.cursor.execute(
+                "INSERT INTO projects (name, parent_id) VALUES (?, (SELECT id FROM projects WHERE name = ?))",
+                (project_name, parent)
+            )
             self.commit()
-            return True
         except sqlite3.IntegrityError:
             # Project already exists
             return False
 
-    def get_unprocessed_messages(self):
+        self.emit(ProjectCreated(project_name))
+        return True
+
+    def get_projects_context(self, limit=10):
+        """
+        Build the projects context given to the classifier: every project and its first messages.
+
+        Args:
+            limit (int, optional): Number of messages to include per project. Defaults to 10.
+
+        Returns:
+            str: One block per project
+        """
+        result = []
+
+        for project in self.get_projects():
+            result.append(f"Project: {project}")
+            messages = self.get_chat_history_columns(("sender", "message"), project=project, limit=limit)
+            for sender, message in zip(messages["sender"], messages["message"]):
+                result.append(f"- {sender}: {self.reveal(message)}")
+            result.append("\n")
+
+        return "\n".join(result)
+
+    def get_unprocessed_messages(self, limit=None, table_name="messages"):
+        """
+        Retrieve messages that have not been classified yet.
+
+        Args:
+            limit (int, optional): Limit the number of messages returned. Defaults to None (all messages).
+            table_name (str, optional): The table to query. Defaults to "messages".
+
+        Returns:
+            list: A list of Message objects
+        """
+        query = f"SELECT id, sender, message, project FROM {table_name} WHERE processed = 0 ORDER BY id"
+        params = []
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        self.cursor.execute(query, params)
+        return rows_to_messages(self.cursor.fetchall(), ["id", "sender", "message", "project"])
+
+    def claim_unprocessed_messages(self, limit, lease_seconds=600, table_name="messages"):
+        """
+        Atomically claim a batch of unclassified messages for this process.
+
+        Claimed rows are marked with processed = -1 so that other processes skip them.
+        Each claim records its own expiry (claimed_until = now + lease_seconds); once
+        it has passed the claim is considered abandoned (the worker died) and can be
+        claimed again, whatever lease the next claimer uses.
+
+        Args:
+            limit (int): Maximum number of messages to claim
+            lease_seconds (int, optional): How long a claim stays valid. Defaults to 600.
+            table_name (str, optional): The table to query. Defaults to "messages".
+
+        Returns:
+            list: The claimed Message objects
+        """
+        now = datetime.utcnow()
+        now_text = now.strftime("%Y-%m-%d %H:%M:%S")
+        until = (now + timedelta(seconds=lease_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+        stale_before = (now - timedelta(seconds=lease_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+        self.begin_immediate()
+        try:
+            # Claims made before claimed_until existed are judged by this claimer's lease
+            self.cursor.execute(
+                f"""SELECT id, sender, message, project FROM {table_name}
+                    WHERE processed = 0 OR (processed = -1 AND (claimed_until < ?
+                          OR (claimed_until IS NULL AND claimed_at < ?)))
+                    ORDER BY id LIMIT ?""",
+                (now_text, stale_before, limit)
+            )
+            rows = self.cursor.fetchall()
+            self.cursor.executemany(
+                f"UPDATE {table_name} SET processed = -1, claimed_at = ?, claimed_until = ? WHERE id = ?",
+                [(now_text, until, row[0]) for row in rows]
+            )
+            self.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        return rows_to_messages(rows, ["id", "sender", "message", "project"])
+
+    def release_claimed_messages(self, message_ids, table_name="messages"):
+        """
+        Give claimed messages back to the backlog, e.g. after a failed classification.
+
+        Args:
+            message_ids (list): The IDs of the claimed messages
+            table_name (str, optional): The table to update. Defaults to "messages".
+        """
+        with self.transaction():
+            self.cursor.executemany(
+                f"""UPDATE {table_name} SET processed = 0, claimed_at = NULL, claimed_until = NULL
+                    WHERE id = ? AND processed = -1""",
+                [(message_id,) for message_id in message_ids]
+            )
+
+    def apply_classifications(self, classifications, table_name="messages"):
+        """
+        Store classification results and mark the messages as processed, in one transaction.
+
+        Called inside a transaction() block, it joins that transaction.
+
+        Only messages still sitting in the global chat ('main') are moved, so a project
+        the user picked by hand is never overridden.
+
+        Args:
+            classifications (list): (message_id, project or None, reminder_time or None) tuples
+            table_name (str, optional): The table to update. Defaults to "messages".
+        """
+        events = []
+        with self.transaction():
+            for message_id, project, reminder_time in classifications:
+                if project:
+                    self.cursor.execute("INSERT OR IGNORE INTO projects (name) VALUES (?)", (project,))
+                    if self.cursor.rowcount > 0:
+                        events.append(ProjectCreated(project))
+                    self.cursor.execute(
+                        f"UPDATE {table_name} SET project = ? WHERE id = ? AND project = 'main'",
+                        (project, message_id)
+                    )
+                    if self.cursor.rowcount > 0:
+                        events.append(MessageMoved(message_id, "main", project))
+
+                    # Duplicates linked to this message skipped classification, so they follow it
+                    self.cursor.execute(
+                        f"SELECT id FROM {table_name} WHERE duplicate_of = ? AND project = 'main'", (message_id,)
+                    )
+                    duplicate_ids = [row[0] for row in self.cursor.fetchall()]
+                    self.cursor.executemany(
+                        f"UPDATE {table_name} SET project = ? WHERE id = ?",
+                        [(project, duplicate_id) for duplicate_id in duplicate_ids]
+                    )
+                    events.extend(MessageMoved(duplicate_id, "main", project) for duplicate_id in duplicate_ids)
+                if reminder_time:
+                    self.cursor.execute(
+                        f"UPDATE {table_name} SET reminder_time = ?, reminder_fired = 0 WHERE id = ?",
+                        (reminder_time, message_id)
+                    )
+            # Most messages get no project or reminder; one statement marks them all
+            self.cursor.executemany(
+                f"UPDATE {table_name} SET processed = 1, claimed_at = NULL, claimed_until = NULL WHERE id = ?",
+                [(classification[0],) for classification in classifications]
+            )
+            self.emit_after_commit(*events)
+
+    def claim_due_reminders(self, now=None, limit=100, lease_seconds=300, table_name="messages"):
+        """
+        Claim a batch of reminders whose time has come, in one transaction.
+
+        Claimed reminders are marked with reminder_fired = -1 and stay claimed until
+        mark_reminders_delivered or release_reminders is called. Selecting and marking
+        under the same write lock hands a reminder to exactly one process even when
+        the GUI and a headless runner share the database. A claim older than
+        lease_seconds is considered abandoned (the process died before delivering)
+        and can be claimed again.
+
+        Args:
+            now (str, optional): 'YYYY-MM-DD HH:MM:SS' reference time. Defaults to the current local time.
+            limit (int, optional): Maximum number of reminders to claim. Defaults to 100.
+            lease_seconds (int, optional): How long a claim stays valid. Defaults to 300.
+            table_name (str, optional): The table to query. Defaults to "messages".
+
+        Returns:
+            list: The claimed Message objects, oldest due time first
+        """
+        if now is None:
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        stale_before = (datetime.strptime(now, "%Y-%m-%d %H:%M:%S")
+                        - timedelta(seconds=lease_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+        columns = ["id", "sender", "message", "project", "reminder_time"]
+        self.begin_immediate()
+        try:
+            # Both queries are range scans of idx_messages_reminders
+            self.cursor.execute(
+                f"""SELECT {', '.join(columns)} FROM {table_name}
+                    WHERE reminder_time IS NOT NULL AND reminder_fired = 0 AND reminder_time <= ?
+                    ORDER BY reminder_time LIMIT ?""",
+                (now, limit)
+            )
+            rows = self.cursor.fetchall()
+            if len(rows) < limit:
+                self.cursor.execute(
+                    f"""SELECT {', '.join('m.' + column for column in columns)} FROM {table_name} m
+                        JOIN reminder_deliveries d ON d.message_id = m.id
+                        WHERE m.reminder_time IS NOT NULL AND m.reminder_fired = -1 AND d.claimed_at < ?
+                        ORDER BY m.reminder_time LIMIT ?""",
+                    (stale_before, limit - len(rows))
+                )
+                rows.extend(self.cursor.fetchall())
+
+            self.cursor.executemany(
+                f"UPDATE {table_name} SET reminder_fired = -1 WHERE id = ?",
+                [(row[0],) for row in rows]
+            )
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO reminder_deliveries (message_id, claimed_at) VALUES (?, ?)",
+                [(row[0], now) for row in rows]
+            )
+            self.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        return rows_to_messages(rows, columns)
+
+    def mark_reminders_delivered(self, message_ids, delivered_at=None, notifier=None, table_name="messages"):
+        """
+        Record that claimed reminders were delivered, so they never fire again.
+
+        Args:
+            message_ids (list): The IDs of the claimed reminders
+            delivered_at (str, optional): 'YYYY-MM-DD HH:MM:SS' delivery time. Defaults to the current local time.
+            notifier (str, optional): Name of the notifier that delivered them
+            table_name (str, optional): The table to update. Defaults to "messages".
+        """
+        if delivered_at is None:
+            delivered_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.executemany(
+            f"UPDATE {table_name} SET reminder_fired = 1 WHERE id = ? AND reminder_fired = -1",
+            [(message_id,) for message_id in message_ids]
+        )
+        self.cursor.executemany(
+            "UPDATE reminder_deliveries SET delivered_at = ?, notifier = ?, error = NULL WHERE message_id = ?",
+            [(delivered_at, notifier, message_id) for message_id in message_ids]
+        )
+        self.commit()
+
+    def release_reminders(self, message_ids, error=None, table_name="messages"):
+        """
+        Give claimed reminders back, e.g. after the notifier failed, so they are delivered later.
+
+        Args:
+            message_ids (list): The IDs of the claimed reminders
+            error (str, optional): Why the delivery failed
+            table_name (str, optional): The table to update. Defaults to "messages".
+        """
+        self.cursor.executemany(
+            f"UPDATE {table_name} SET reminder_fired = 0 WHERE id = ? AND reminder_fired = -1",
+            [(message_id,) for message_id in message_ids]
+        )
+        self.cursor.executemany(
+            "UPDATE reminder_deliveries SET claimed_at = NULL, error = ? WHERE message_id = ?",
+            [(error, message_id) for message_id in message_ids]
+        )
+        self.commit()
+
+    def next_reminder_time(self, table_name="messages"):
         """
-        Stub method for retrieving unprocessed messages.
-        This is a placeholder that returns an empty list.
+        Return the due time of the earliest reminder not delivered yet.
 
         Returns:
-            list: An empty list for now
+            str: 'YYYY-MM-DD HH:MM:SS', or None if no reminder is pending
         """
-        return []
+        self.cursor.execute(
+            f"SELECT MIN(reminder_time) FROM {table_name} WHERE reminder_time IS NOT NULL AND reminder_fired = 0"
+        )
+        return self.cursor.fetchone()[0]
@@ -0,0 +1,393 @@
+import hashlib
+import hmac
+import random
+import re
+import struct
+import unicodedata
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # Signatures are computed in pure Python, about 20x slower
+    np = None
+
+_MASK64 = (1 << 64) - 1
+_PUNCTUATION_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Case-fold, strip accents and punctuation, and collapse whitespace."""
+    text = text or ""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.casefold()
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def content_hash(normalized, key=None):
+    """
+    Hash of normalized text, identical for exact duplicates.
+
+    With a key (on an encrypted database) it is an HMAC, so a known text cannot be looked up.
+    """
+    if key is not None:
+        return hmac.new(key, normalized.encode("utf-8"), hashlib.sha256).hexdigest()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class MinHasher:
+    """
+    MinHash signatures over character shingles, with LSH banding.
+
+    Two texts with Jaccard similarity s share a band bucket with probability
+    1 - (1 - s**rows)**bands; with the defaults (16 bands of 4 rows) that is
+    ~99% for s = 0.8 and ~5% for s = 0.3.
+    """
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=5, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        # Multiply-shift hash functions h(x) = ((a * x + b) mod 2**64) >> 32, with odd a.
+        # Fixed seed: signatures stored in the database must stay comparable across runs
+        rng = random.Random(seed)
+        self.permutations = [(rng.getrandbits(64) | 1, rng.getrandbits(64)) for _ in range(num_perm)]
+        if np is not None:
+            self._a = np.array([a for a, _ in self.permutations], dtype=np.uint64)[:, None]
+            self._b = np.array([b for _, b in self.permutations], dtype=np.uint64)[:, None]
+
+    def shingles(self, normalized, key=None):
+        """
+        Return the 32-bit hashes of the shingles (k-byte slices) of a normalized text, without repeats.
+
+        Shingles are hashed with CRC32, or with keyed BLAKE2b when a key is given, so that the
+        signatures of an encrypted database cannot be matched against guessed texts.
+        """
+        data = normalized.encode("utf-8")
+        k = self.shingle_size
+        if key is None:
+            hash_shingle = zlib.crc32
+        else:
+            def hash_shingle(shingle):
+                return int.from_bytes(hashlib.blake2b(shingle, digest_size=4, key=key).digest(), "little")
+        if len(data) <= k:
+            return [hash_shingle(data)]
+        return list({hash_shingle(data[i:i + k]) for i in range(len(data) - k + 1)})
+
+    def signature(self, normalized, key=None):
+        """Return the MinHash signature (a tuple of num_perm ints) of a normalized text."""
+        values = self.shingles(normalized, key)
+        if np is not None:
+            # uint64 arithmetic wraps around, which is exactly the mod 2**64 of the hash functions
+            x = np.array(values, dtype=np.uint64)[None, :]
+            return tuple(((self._a * x + self._b) >> np.uint64(32)).min(axis=1).tolist())
+        return tuple(min(((a * x + b) & _MASK64) >> 32 for x in values) for a, b in self.permutations)
+
+    def band_buckets(self, signature):
+        """
+        Return one bucket key per band, as signed 64-bit ints that fit an SQLite INTEGER.
+
+        The band number is hashed in, so a single indexed column holds the keys of every band.
+        """
+        packed = self.pack(signature)
+        size = 4 * self.rows
+        return [int.from_bytes(hashlib.blake2b(packed[band * size:(band + 1) * size], digest_size=8,
+                                               salt=band.to_bytes(16, "little")).digest(), "little", signed=True)
+                for band in range(self.bands)]
+
+    def pack(self, signature):
+        return struct.pack(f"<{self.num_perm}I", *signature)
+
+    def unpack(self, blob):
+        return struct.unpack(f"<{self.num_perm}I", blob)
+
+    @staticmethod
+    def similarity(a, b):
+        """Estimated Jaccard similarity of two signatures."""
+        return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class Deduplicator:
+    """
+    Ingest-time duplicate detection for DatabaseHandler.
+
+    Exact duplicates are found through a hash of the normalized text; near
+    duplicates through MinHash signatures whose LSH band buckets are indexed in
+    SQLite, so a lookup touches only the few messages sharing a bucket.
+
+    On an encrypted database both are keyed with the cipher's deduplication
+    key, so the fingerprints give away no more than which messages are alike.
+    """
+
+    def __init__(self, db_handler, threshold=0.8, hasher=None):
+        """
+        Args:
+            db_handler (DatabaseHandler): The database holding the fingerprints
+            threshold (float, optional): Estimated similarity from which a message is a near duplicate. Defaults to 0.8.
+            hasher (MinHasher, optional): Defaults to MinHasher().
+        """
+        self.db_handler = db_handler
+        self.threshold = threshold
+        self.hasher = hasher or MinHasher()
+
+        db_handler.create_table("message_fingerprints", {
+            "message_id": "INTEGER PRIMARY KEY",
+            "content_hash": "TEXT NOT NULL",
+            "signature": "BLOB NOT NULL"
+        })
+        db_handler.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_fingerprints_hash ON message_fingerprints (content_hash)"
+        )
+        # One row per band; WITHOUT ROWID keeps the (bucket, message_id) key as the table itself
+        db_handler.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS message_lsh (
+                bucket INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                PRIMARY KEY (bucket, message_id)
+            ) WITHOUT ROWID""")
+        db_handler.cursor.execute("CREATE INDEX IF NOT EXISTS idx_lsh_message ON message_lsh (message_id)")
+        # Fingerprints go away with their message, however it is deleted
+        db_handler.cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS message_fingerprints_delete AFTER DELETE ON messages
+            BEGIN
+                DELETE FROM message_fingerprints WHERE message_id = OLD.id;
+                DELETE FROM message_lsh WHERE message_id = OLD.id;
+            END""")
+        db_handler.commit()
+
+    def fingerprint(self, text):
+        """Return (content_hash, signature, band buckets) for a text."""
+        # Looked up on every call: the cipher may be set after deduplication was enabled
+        cipher = self.db_handler.cipher
+        key = cipher.dedup_key if cipher is not None else None
+        normalized = normalize_text(text)
+        signature = self.hasher.signature(normalized, key)
+        return content_hash(normalized, key), signature, self.hasher.band_buckets(signature)
+
+    def find_duplicate(self, fingerprint, project=None):
+        """
+        Look for a stored message that duplicates a fingerprint.
+
+        Args:
+            fingerprint (tuple): From fingerprint()
+            project (str, optional): Project the new message goes to; an exact match there is preferred
+
+        Returns:
+            tuple: (message_id, similarity, exact) of the best match, or None
+        """
+        digest, signature, buckets = fingerprint
+        cursor = self.db_handler.cursor
+
+        cursor.execute(
+            """SELECT f.message_id FROM message_fingerprints f JOIN messages m ON m.id = f.message_id
+               WHERE f.content_hash = ? ORDER BY m.project IS NOT ?, f.message_id LIMIT 1""",
+            (digest, project)
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0], 1.0, True
+
+        cursor.execute(
+            f"""SELECT message_id, signature FROM message_fingerprints WHERE message_id IN
+                (SELECT message_id FROM message_lsh WHERE bucket IN ({', '.join(['?'] * len(buckets))}))""",
+            buckets
+        )
+
+        best = None
+        for message_id, blob in cursor.fetchall():
+            similarity = self.hasher.similarity(signature, self.hasher.unpack(blob))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (message_id, similarity, False)
+        return best
+
+    def record(self, message_id, fingerprint):
+        """Store the fingerprint of a new message. Runs inside the caller's transaction."""
+        digest, signature, buckets = fingerprint
+        self.db_handler.cursor.execute(
+            "INSERT OR REPLACE INTO message_fingerprints (message_id, content_hash, signature) VALUES (?, ?, ?)",
+            (message_id, digest, self.hasher.pack(signature))
+        )
+        self.db_handler.cursor.executemany(
+            "INSERT OR IGNORE INTO message_lsh (bucket, message_id) VALUES (?, ?)",
+            [(bucket, message_id) for bucket in buckets]
+        )
+
+    def backfill(self, batch_size=1000, progress=None):
+        """
+        Fingerprint the text messages stored before deduplication was enabled.
+
+        Existing messages are not linked to each other; they only become
+        candidates for the messages inserted from now on.
+
+        Args:
+            batch_size (int, optional): Messages fingerprinted per transaction. Defaults to 1000.
+            progress (callable, optional): Called with the number of messages fingerprinted so far
+
+        Returns:
+            int: Number of messages fingerprinted
+        """
+        count = 0
+        while True:
+            self.db_handler.begin_immediate()
+            try:
+                self.db_handler.cursor.execute(
+                    """SELECT id, message FROM messages
+                       WHERE id NOT IN (SELECT message_id FROM message_fingerprints)
+                       AND COALESCE(message_type, 'text') = 'text' AND COALESCE(file_path, '') = ''
+                       ORDER BY id LIMIT ?""",
+                    (batch_size,)
+                )
+                rows = self.db_handler.cursor.fetchall()
+                for message_id, text in rows:
+                    self.record(message_id, self.fingerprint(self.db_handler.reveal(text)))
+                self.db_handler.commit()
+            except Exception:
+                self.db_handler.conn.rollback()
+                raise
+
+            count += len(rows)
+            if progress and rows:
+                progress(count)
+            if len(rows) < batch_size:
+                return count
+
+
+def synthetic_messages(count, repeat_rate=0.1, edit_rate=0.1, seed=1):
+    """
+    Yield message rows in which a share are exact repeats or one-word edits of earlier ones.
+
+    Repeats differ in case and spacing only, so they normalize to the same text.
+    """
+    words = ["budget", "meeting", "call", "dentist", "groceries", "invoice", "flight", "report",
+             "birthday", "renew", "passport", "draft", "review", "garden", "taxes", "plumber"]
+    rng = random.Random(seed)
+    originals = []
+    for i in range(count):
+        draw = rng.random()
+        if originals and draw < repeat_rate:
+            text = "  " + rng.choice(originals).upper()
+        elif originals and draw < repeat_rate + edit_rate:
+            tokens = rng.choice(originals).split()
+            tokens[rng.randrange(len(tokens))] = rng.choice(words)
+            text = " ".join(tokens)
+        else:
+            text = " ".join(rng.choice(words) for _ in range(12)) + f" #{i}"
+            originals.append(text)
+        yield {"sender": "You", "message": text}
+
+
+def benchmark(count=1000000, batch_size=1000, directory=None, progress=None):
+    """
+    Measure what deduplication costs on ingest and on disk.
+
+    Inserts the same synthetic messages (10% exact repeats, 10% one-word edits)
+    into a database without and one with deduplication.
+
+    Args:
+        count (int, optional): Messages inserted. Defaults to 1000000.
+        batch_size (int, optional): Messages per insert_messages call. Defaults to 1000.
+        directory (str, optional): Where the databases go. Defaults to a new temporary directory.
+        progress (callable, optional): Called with the mode and the number of messages inserted so far
+
+    Returns:
+        dict: {mode: {"seconds", "msg/s", "MiB", "collapsed", "linked"}} for modes "plain" and "dedup"
+    """
+    import itertools
+    import os
+    import tempfile
+    import time
+
+    from database_utils import DatabaseHandler
+
+    directory = directory or tempfile.mkdtemp(prefix="dedup-bench-")
+    results = {}
+    for mode in ("plain", "dedup"):
+        path = os.path.join(directory, f"{mode}.db")
+        db_handler = DatabaseHandler(path)
+        db_handler.ensure_schema()
+        if mode == "dedup":
+            db_handler.enable_deduplication()
+
+        rows = synthetic_messages(count)
+        inserted = 0
+        start = time.perf_counter()
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            db_handler.insert_messages(batch)
+            inserted += len(batch)
+            if progress:
+                progress(mode, inserted)
+        seconds = time.perf_counter() - start
+
+        db_handler.cursor.execute("SELECT COUNT(*), COUNT(duplicate_of) FROM messages")
+        stored, linked = db_handler.cursor.fetchone()
+        db_handler.close()
+        results[mode] = {
+            "seconds": round(seconds, 1),
+            "msg/s": round(count / seconds) if seconds else None,
+            "MiB": round(os.path.getsize(path) / 2 ** 20, 1),
+            "collapsed": count - stored,
+            "linked": linked,
+        }
+    return results
+
+
+def main(argv=None):
+    import argparse
+
+    from bulk_io import ProgressPrinter
+    from crypto_store import unlock_from_env
+    from database_utils import DatabaseHandler
+
+    parser = argparse.ArgumentParser(description="Fingerprint existing messages for duplicate detection")
+    parser.add_argument("--db", default="chat.db", help="Path to the SQLite database")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Messages fingerprinted per transaction")
+    subparsers = parser.add_subparsers(dest="command")
+    bench = subparsers.add_parser("bench", help="Measure the cost of deduplication on ingest and on disk")
+    bench.add_argument("--count", type=int, default=1000000, help="Synthetic messages inserted")
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        printers = {}
+
+        def progress(mode, count):
+            if mode not in printers:
+                if printers:
+                    print()
+                printers[mode] = ProgressPrinter(f"Inserted ({mode})")
+            printers[mode](count)
+
+        results = benchmark(args.count, args.batch_size, progress=progress)
+        print()
+        for mode, figures in results.items():
+            print(f"{mode:<6} " + "  ".join(f"{key} {value}" for key, value in figures.items()))
+        plain, dedup = results["plain"], results["dedup"]
+        print(f"ingest x{dedup['seconds'] / plain['seconds']:.1f} slower, "
+              f"database x{dedup['MiB'] / plain['MiB']:.1f} larger")
+        return
+
+    db_handler = DatabaseHandler(args.db)
+    try:
+        db_handler.ensure_schema()
+        try:
+            # Fingerprints of an encrypted database are keyed, and computed from the decrypted text
+            unlock_from_env(db_handler)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        db_handler.enable_deduplication().backfill(args.batch_size, progress=ProgressPrinter("Fingerprinted"))
+        print()
+    finally:
+        db_handler.close()
+
+
+if __name__ == "__main__":
+    main()
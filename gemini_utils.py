@@ -1,23 +1,225 @@
-import base64
+import json
+import logging
 import os
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
-import base64
-import os
-from google import genai
-from google.genai import types
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+
+# google-genai is only needed for the Gemini backend; the local backend runs without it
+try:
+    from google import genai
+    from google.genai import types
+except ImportError:
+    genai = None
+    types = None
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+from classification import CLASSIFICATION_SCHEMA, loads, validate
+from model_router import ModelRouter, is_local
+from usage import BudgetExceeded, RequestRecord, usage_from_response
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
-load_dotenv()
+if load_dotenv is not None:
+    load_dotenv()
+
+CLASSIFICATION_INSTRUCTION = """Your job is to analize each message (more thane might be provided) and check if they belong to any of the following categories:
+            minder, in this case specify the timestamp of when to remind YYYY-MM-DD HH:MM:SS, if it something that the user should remeber but it has no remind time than set the time as the day after at 20:00 
+             idea, in that case add the message to the project IDEAS
+    
+            are going to be provided all the projects that have already been created and the top messages from that project, use them as context to understand if a message should be part of that project, if the message is not part of any project just write NULL in the project field."""
+
+class GeminiBackend:
+    """Sends requests to the Gemini API through google-genai."""
 
-class GeminiHandler:
     def __init__(self, api_key):
-        self.client = genai.Client(
-            api_key=os.environ.get("GEMINI_API_KEY"),
-        )
+        if genai is None:
+            raise ImportError("The Gemini backend needs the google-genai package (pip install google-genai)")
+        self.client = genai.Client(api_key=api_key)
+
+    def generate(self, model, contents, config):
+        return self.client.models.generate_content(model=model, contents=contents, config=config)
+
+    def generate_stream(self, model, contents, config):
+        return self.client.models.generate_content_stream(model=model, contents=contents, config=config)
+
+    def embed(self, model, texts):
+        return self.client.models.embed_content(model=model, contents=texts)
+
+
+# Response of the local backend, with the attributes GeminiHandler reads from google-genai responses
+LocalResponse = namedtuple("LocalResponse", ["text", "usage_metadata"])
+LocalEmbeddings = namedtuple("LocalEmbeddings", ["embeddings", "usage_metadata"])
+LocalEmbedding = namedtuple("LocalEmbedding", ["values"])
+
+
+class LocalBackend:
+    """
+    Stand-in for the Gemini API that answers offline, for tests and benchmarks.
+
+    Classification requests (JSON responses) get the answer of a responder,
+    by default batch_jobs.null_responder (project NULL for every message);
+    text requests get a fixed text; embeddings come from
+    semantic_index.LocalEmbedder. latency_ms plus ms_per_kchar per thousand
+    prompt characters of sleep imitate the time a real request takes, and
+    failure_rate makes that share of requests raise, to exercise fallbacks.
+    No tokens are reported, so local requests never count against the budget.
+    """
+
+    def __init__(self, responder=None, latency_ms=0.0, ms_per_kchar=0.0, failure_rate=0.0, embed_dim=256, seed=None):
+        """
+        Args:
+            responder (callable, optional): REST request dict -> response text. Defaults to batch_jobs.null_responder.
+            latency_ms (float, optional): Fixed delay of every request. Defaults to 0.
+            ms_per_kchar (float, optional): Extra delay per 1000 prompt characters. Defaults to 0.
+            failure_rate (float, optional): Share of requests that raise. Defaults to 0.
+            embed_dim (int, optional): Dimension of the local embeddings. Defaults to 256.
+            seed (int, optional): Seed of the simulated failures
+        """
+        import random
+
+        if responder is None:
+            from batch_jobs import null_responder
+            responder = null_responder
+        self.responder = responder
+        self.latency_ms = latency_ms
+        self.ms_per_kchar = ms_per_kchar
+        self.failure_rate = failure_rate
+        self.embed_dim = embed_dim
+        self.random = random.Random(seed)
+        self.embedder = None
+
+    def _wait(self, chars):
+        delay = self.latency_ms + self.ms_per_kchar * chars / 1000
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise RuntimeError("Simulated failure of the local backend")
 
-        self.model = "gemini-2.0-flash"
+    def generate(self, model, contents, config):
+        if isinstance(contents, str):
+            contents = [{"role": "user", "parts": [{"text": contents}]}]
+        self._wait(len(json.dumps(contents)))
+        if (config or {}).get("response_mime_type") == "application/json":
+            return LocalResponse(self.responder({"contents": contents}), None)
+        return LocalResponse(f"[{model}] offline response", None)
+
+    def generate_stream(self, model, contents, config):
+        yield self.generate(model, contents, config)
+
+    def embed(self, model, texts):
+        if self.embedder is None:
+            from semantic_index import LocalEmbedder
+            self.embedder = LocalEmbedder(self.embed_dim)
+        self._wait(sum(len(text) for text in texts))
+        return LocalEmbeddings([LocalEmbedding(vector.tolist()) for vector in self.embedder.embed(texts)], None)
+
+
+class GeminiHandler:
+    def __init__(self, api_key=None, ledger=None, models=None, router=None, local_backend=None):
+        """
+        Args:
+            api_key (str, optional): Gemini API key. Defaults to the GEMINI_API_KEY environment variable.
+            ledger (usage.UsageLedger, optional): Records every request and enforces its daily token budget
+            models (dict, optional): operation -> candidate models, preferred first (see model_router.DEFAULT_MODELS).
+                Models named 'local...' are answered by the local backend.
+            router (model_router.ModelRouter, optional): Picks the model of each request. Defaults to a router
+                over models that reads its stats from the ledger.
+            local_backend (LocalBackend, optional): Answers the 'local' models. Defaults to LocalBackend().
+        """
+        self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
+        self.ledger = ledger
+        self.router = router or ModelRouter(models, ledger)
+        self.local_backend = local_backend
+        # Created on the first request to a Gemini model, so offline runs need neither google-genai nor a key
+        self.gemini_backend = None
+
+        # Model of the requests the router does not pick, e.g. batch jobs
+        self.model = self.router.default_model("batch_classify")
+
+    def backend(self, model):
+        """Return the backend answering a model."""
+        if is_local(model):
+            if self.local_backend is None:
+                self.local_backend = LocalBackend()
+            return self.local_backend
+        if self.gemini_backend is None:
+            self.gemini_backend = GeminiBackend(self.api_key)
+        return self.gemini_backend
+
+    def can_reach(self, model):
+        """Return whether requests to a model can be sent: local models always, Gemini ones with google-genai and a key."""
+        return is_local(model) or (genai is not None and bool(self.api_key))
+
+    def track(self, operation, prompt_chars=0, context_chars=0, model=None):
+        """
+        Check the token budget, then time and record one request (see usage.UsageLedger.track).
+
+        Raises:
+            usage.BudgetExceeded: If today's budget is used up
+        """
+        if self.ledger is None:
+            return nullcontext(RequestRecord())
+        self.ledger.check_budget(model or self.model, operation)
+        return self.ledger.track(model or self.model, operation, prompt_chars, context_chars)
+
+    def dispatch(self, operation, send, prompt_chars=0, context_chars=0, max_latency_ms=None, check=None,
+                 models=None):
+        """
+        Send one request to the model the router picks, falling back to the next model on failure.
+
+        A model fails when send raises or when check finds its response unusable;
+        it is then tried last for a while (see ModelRouter.failed). The response
+        of the last model is returned even if check rejects it.
+
+        Args:
+            operation (str): Name the request is routed and recorded under
+            send (callable): (backend, model, RequestRecord) -> result; should call request.set_response
+            prompt_chars (int, optional): Characters sent
+            context_chars (int, optional): Part of prompt_chars repeated in every request
+            max_latency_ms (float, optional): Latency the caller needs
+            check (callable, optional): result -> description of why it is unusable, or None
+            models (list, optional): Models to try instead of the routed ones
+
+        Returns:
+            The result of send
+
+        Raises:
+            usage.BudgetExceeded: If today's budget is used up
+            Exception: What the last model raised, if every model failed
+        """
+        models = models or self.router.route(operation, prompt_chars, max_latency_ms)
+        for attempt, model in enumerate(models, 1):
+            last = attempt == len(models)
+            problem = None
+            try:
+                with self.track(operation, prompt_chars, context_chars, model) as request:
+                    request.attempt = attempt
+                    result = send(self.backend(model), model, request)
+                    problem = check(result) if check is not None else None
+                    if problem:
+                        request.mark_invalid(problem)
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                self.router.failed(model)
+                if last:
+                    raise
+                logger.warning("%s request to %s failed (%s), trying %s", operation, model, e, models[attempt])
+                continue
+
+            if problem:
+                self.router.failed(model)
+                if not last:
+                    logger.warning("%s response of %s is unusable (%s), trying %s",
+                                   operation, model, problem, models[attempt])
+                    continue
+            return result
 
     @staticmethod
     def split_into_chunks(text, extra="", chunk_size=16384):
@@ -71,40 +273,58 @@ class GeminiHandler:
 
         return chunks
 
-    def generate_generic(self, contents, response_mime_type="text/plain", streaming=False):
-        generate_content_config = types.GenerateContentConfig(
-            response_mime_type=response_mime_type,
-        )
+    def generate_generic(self, contents, response_mime_type="text/plain", streaming=False, max_latency_ms=None):
+        generate_content_config = {"response_mime_type": response_mime_type}
 
-        if streaming:
-            response = ""
-            for chunk in self.client.models.generate_content_stream(
-                model=self.model,
-                contents=contents,
-                config=generate_content_config,
-            ):
-                print(chunk.text, end="")
-                response += chunk.text
-            return response
+        def send(backend, model, request):
+            if streaming:
+                response = ""
+                for chunk in backend.generate_stream(model, contents, generate_content_config):
+                    logger.debug("%s streamed: %s", model, chunk.text)
+                    response += chunk.text
+                    # The last chunk carries the usage of the whole response
+                    if getattr(chunk, "usage_metadata", None) is not None:
+                        request.set_response(chunk)
+                return response
 
-        else:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=contents,
-                config=generate_content_config,
-            )
-            return response.text
+            else:
+                response = backend.generate(model, contents, generate_content_config)
+                request.set_response(response)
+                return response.text
 
-    def classify_messages(self, messages, projects):
+        return self.dispatch("generate", send, len(str(contents)), max_latency_ms=max_latency_ms)
 
-        new_messages = self.split_into_chunks(messages, extra=projects)
-        print("Classifying messages", new_messages)
+    def embed_texts(self, texts, model=None, batch_size=100):
+        """
+        Compute embeddings for a list of texts.
 
-        total_response = []
+        Args:
+            texts (list): The texts to embed
+            model (str, optional): The embedding model. Defaults to the routed 'embed' models; vectors of
+                different models do not mix, so a stored index should always pass its model.
+            batch_size (int, optional): Texts per request. Defaults to 100.
 
-        for chunk in new_messages:
+        Returns:
+            list: One list of floats per text
+        """
+        models = [model] if model else [self.router.default_model("embed")]
 
-            prompt = f"""
+        def send(backend, model, request):
+            response = backend.embed(model, batch)
+            request.set_response(response)
+            return response
+
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            response = self.dispatch("embed", send, sum(len(text) for text in batch), models=models)
+            embeddings.extend(embedding.values for embedding in response.embeddings)
+        return embeddings
+
+    @staticmethod
+    def classification_prompt(chunk, projects):
+        """Return the user prompt classifying one chunk of numbered messages."""
+        return f"""
 projects:
 {projects}
             
@@ -113,60 +333,152 @@ messages:
 
 """
 
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_text(text=prompt),
-                    ],
-                ),
-            ]
-            generate_content_config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=genai.types.Schema(
-                    type=genai.types.Type.OBJECT,
-                    required=["messages"],
-                    properties={
-                        "messages": genai.types.Schema(
-                            type=genai.types.Type.ARRAY,
-                            items=genai.types.Schema(
-                                type=genai.types.Type.OBJECT,
-                                required=["index of the message", "project"],
-                                properties={
-                                    "index of the message": genai.types.Schema(
-                                        type=genai.types.Type.INTEGER,
-                                    ),
-                                    "project": genai.types.Schema(
-                                        type=genai.types.Type.STRING,
-                                    ),
-                                    "reminder time": genai.types.Schema(
-                                        type=genai.types.Type.STRING,
-                                    ),
-                                },
-                            ),
-                        ),
-                    },
-                ),
-                system_instruction=[
-                    types.Part.from_text(text="""Your job is to analize each message (more thane might be provided) and check if they belong to any of the following categories:
-            minder, in this case specify the timestamp of when to remind YYYY-MM-DD HH:MM:SS, if it something that the user should remeber but it has no remind time than set the time as the day after at 20:00 
-             idea, in that case add the message to the project IDEAS
-    
-            are going to be provided all the projects that have already been created and the top messages from that project, use them as context to understand if a message should be part of that project, if the message is not part of any project just write NULL in the project field."""),
-                ],
-            )
+    @staticmethod
+    def check_classification(text):
+        """Return why a classification response is unusable, or None if it parses and matches the schema."""
+        try:
+            return validate(loads(text or ""), CLASSIFICATION_SCHEMA)
+        except ValueError:
+            return "malformed JSON"
+
+    def classify_messages(self, messages, projects, max_latency_ms=None):
+        """
+        Classify numbered message lines, one request per chunk.
+
+        Each chunk is routed on its own (see ModelRouter.route), so a short
+        backlog and a huge one may go to different models. A chunk whose
+        response is malformed or breaks the schema is sent to the next model.
+
+        Returns:
+            list: The raw JSON response of each chunk; classification.ResponseParser
+            turns them into Classification tuples
 
-            response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=contents,
-                    config=generate_content_config,
-            )
+        Raises:
+            usage.BudgetExceeded: If the daily token budget of the ledger is used up
+        """
+
+        new_messages = self.split_into_chunks(messages, extra=projects)
+        logger.debug("Classifying %d chunks: %s", len(new_messages), new_messages)
 
-            print(response.text)
+        total_response = []
+
+        generate_content_config = {
+            "response_mime_type": "application/json",
+            "response_schema": CLASSIFICATION_SCHEMA,
+            "system_instruction": CLASSIFICATION_INSTRUCTION,
+        }
 
-            total_response.append(response.text)
+        def send(backend, model, request):
+            response = backend.generate(model, contents, generate_content_config)
+            request.set_response(response)
+            return response.text
+
+        for chunk in new_messages:
+
+            prompt = self.classification_prompt(chunk, projects)
+
+            contents = [{"role": "user", "parts": [{"text": prompt}]}]
+
+            # The projects context is repeated in every chunk; recorded apart to see what it costs
+            text = self.dispatch("classify", send, len(prompt) + len(CLASSIFICATION_INSTRUCTION), len(projects),
+                                 max_latency_ms, check=self.check_classification)
+
+            logger.debug("Classification response: %s", text)
+
+            total_response.append(text)
 
         return total_response
 
+    def build_batch_request(self, chunk, projects):
+        """
+        Build the batch-API request classifying one chunk, as a JSON-serializable dict.
+
+        It is the same request classify_messages sends, in the REST format of a
+        line of a batch JSONL file.
+        """
+        return {
+            "contents": [{"role": "user", "parts": [{"text": self.classification_prompt(chunk, projects)}]}],
+            "system_instruction": {"parts": [{"text": CLASSIFICATION_INSTRUCTION}]},
+            "generation_config": {
+                "response_mime_type": "application/json",
+                "response_schema": CLASSIFICATION_SCHEMA,
+            },
+        }
+
+    def batch_service(self):
+        """Return the Gemini batch API wrapper used by batch_jobs.BatchClassifier."""
+        if is_local(self.model):
+            raise ValueError("Batch jobs of local models run through batch_jobs.LocalBatchService")
+        return GeminiBatchService(self.backend(self.model).client, self.model, self.ledger)
+
 
+class GeminiBatchService:
+    """
+    Offline batch jobs through the Gemini batch API.
 
+    Requests are uploaded as a JSONL file of {"key", "request"} lines and the
+    results come back as a JSONL file of {"key", "response"} or {"key", "error"}
+    lines. batch_jobs.LocalBatchService has the same interface and runs offline.
+    """
+
+    # Job states of the API, mapped to the states batch_jobs understands
+    STATES = {
+        "JOB_STATE_PENDING": "pending",
+        "JOB_STATE_QUEUED": "pending",
+        "JOB_STATE_RUNNING": "running",
+        "JOB_STATE_SUCCEEDED": "succeeded",
+        "JOB_STATE_FAILED": "failed",
+        "JOB_STATE_CANCELLED": "failed",
+        "JOB_STATE_EXPIRED": "failed",
+    }
+
+    def __init__(self, client, model, ledger=None):
+        self.client = client
+        self.model = model
+        # Batch requests are recorded when their results are downloaded
+        self.ledger = ledger
+
+    def submit(self, request_path, display_name):
+        """Upload a JSONL request file and start a batch job. Returns the job name."""
+        uploaded = self.client.files.upload(
+            file=request_path,
+            config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl"),
+        )
+        job = self.client.batches.create(
+            model=self.model,
+            src=uploaded.name,
+            config={"display_name": display_name},
+        )
+        return job.name
+
+    def status(self, job_name):
+        """Return 'pending', 'running', 'succeeded' or 'failed'."""
+        job = self.client.batches.get(name=job_name)
+        return self.STATES.get(job.state.name, "running")
+
+    def results(self, job_name):
+        """
+        Download the results of a finished job.
+
+        Returns:
+            list: (key, response text or None, error or None) tuples
+        """
+        job = self.client.batches.get(name=job_name)
+        content = self.client.files.download(file=job.dest.file_name).decode("utf-8")
+
+        results = []
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "response" in entry:
+                parts = entry["response"]["candidates"][0]["content"]["parts"]
+                results.append((entry["key"], "".join(part.get("text", "") for part in parts), None))
+                if self.ledger is not None:
+                    self.ledger.record(self.model, "batch_classify", usage_from_response(entry["response"]))
+            else:
+                results.append((entry["key"], None, str(entry.get("error", "missing response"))))
+                if self.ledger is not None:
+                    self.ledger.record(self.model, "batch_classify", outcome="error",
+                                       error=str(entry.get("error", "missing response"))[:500])
+        return results
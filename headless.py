@@ -0,0 +1,336 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from classification import ParseMetrics, ResponseParser
+from crypto_store import PASSPHRASE_ENV
+from database_utils import DatabaseHandler
+from reminders import NOTIFIERS, LogNotifier, ReminderPipeline
+from usage import BudgetExceeded, UsageLedger
+
+logger = logging.getLogger(__name__)
+
+
+class ThroughputMetrics:
+    """Counters describing how fast the headless runner works through the backlog."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.cycles = 0
+        self.batches = 0
+        self.messages_classified = 0
+        self.classification_errors = 0
+        self.classification_seconds = 0.0
+        self.reminders_fired = 0
+        self.messages_archived = 0
+        self.backlog_size = 0
+        # Cycles that skipped classification because the daily token budget was used up
+        self.budget_pauses = 0
+        self.parsing = ParseMetrics()
+
+    def record_batch(self, message_count, seconds):
+        """Record a successfully classified batch."""
+        self.batches += 1
+        self.messages_classified += message_count
+        self.classification_seconds += seconds
+
+    def as_dict(self):
+        """Return a snapshot of the metrics, including derived rates."""
+        uptime = time.time() - self.started_at
+        return {
+            "uptime_seconds": round(uptime, 1),
+            "cycles": self.cycles,
+            "batches": self.batches,
+            "messages_classified": self.messages_classified,
+            "classification_errors": self.classification_errors,
+            "reminders_fired": self.reminders_fired,
+            "messages_archived": self.messages_archived,
+            "backlog_size": self.backlog_size,
+            "budget_pauses": self.budget_pauses,
+            "malformed_responses": self.parsing.malformed_responses,
+            "parsing": self.parsing.as_dict(),
+            # Throughput while actually classifying, and averaged over the whole run
+            "messages_per_second": round(self.messages_classified / self.classification_seconds, 3)
+            if self.classification_seconds else 0.0,
+            "messages_per_minute_overall": round(self.messages_classified * 60 / uptime, 3) if uptime else 0.0,
+        }
+
+
+class HeadlessRunner:
+    """
+    Classify pending messages and fire due reminders without a Tk root.
+
+    Batches are claimed through DatabaseHandler.claim_unprocessed_messages, which takes
+    the SQLite write lock, so any number of runners and GUIs can share one chat.db
+    without classifying the same message twice.
+    """
+
+    def __init__(self, db_handler, gemini_handler, batch_size=50, max_batches=10,
+                 interval=60, lease_seconds=600, metrics_path=None, semantic_index=None, retention=None,
+                 reminders=None):
+        """
+        Args:
+            db_handler (DatabaseHandler): The database to work on
+            gemini_handler (GeminiHandler): Used to classify the messages
+            batch_size (int, optional): Messages claimed per batch. Defaults to 50.
+            max_batches (int, optional): Batches processed per cycle. Defaults to 10.
+            interval (int, optional): Seconds between cycles. Defaults to 60.
+            lease_seconds (int, optional): How long a claim stays valid. Defaults to 600.
+            metrics_path (str, optional): Write the metrics as JSON to this file after each cycle.
+            semantic_index (SemanticIndex, optional): Adds the project of similar notes to the prompt as a hint.
+            retention (RetentionManager, optional): Archives old messages and vacuums at the end of each cycle.
+            reminders (ReminderPipeline, optional): Delivers due reminders. Defaults to one writing to the log.
+        """
+        self.db_handler = db_handler
+        self.gemini_handler = gemini_handler
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self.metrics_path = metrics_path
+        self.semantic_index = semantic_index
+        self.retention = retention
+        self.reminders = reminders or ReminderPipeline(db_handler, LogNotifier(), window=interval)
+        self.metrics = ThroughputMetrics()
+        self.parser = ResponseParser(metrics=self.metrics.parsing)
+        self.stop_event = threading.Event()
+
+    def process_backlog_batch(self):
+        """
+        Claim, classify and store one batch of pending messages.
+
+        Returns:
+            int: Number of messages processed (0 when the backlog is empty)
+        """
+        messages = self.db_handler.claim_unprocessed_messages(self.batch_size, self.lease_seconds)
+        if not messages:
+            return 0
+
+        message_ids = [msg["id"] for msg in messages]
+        for msg in messages:
+            msg.message = self.db_handler.reveal(msg.message)
+        lines = [f"{i}. {msg['message']}{self.project_hint(msg)}" for i, msg in enumerate(messages)]
+
+        start = time.time()
+        try:
+            projects = self.db_handler.get_projects_context()
+            responses = self.gemini_handler.classify_messages(lines, projects)
+            # Messages the model did not mention are still marked as processed
+            classifications = self.parser.parse_all(responses, message_ids)
+        except BudgetExceeded as e:
+            logger.warning("%s, releasing %d messages", e, len(message_ids))
+            self.db_handler.release_claimed_messages(message_ids)
+            return 0
+        except Exception:
+            logger.exception("Classification failed, releasing %d messages", len(message_ids))
+            self.metrics.classification_errors += 1
+            self.db_handler.release_claimed_messages(message_ids)
+            return 0
+
+        self.db_handler.apply_classifications(classifications)
+
+        self.metrics.record_batch(len(message_ids), time.time() - start)
+        return len(message_ids)
+
+    def project_hint(self, msg):
+        """Return a prompt suffix naming the project most similar notes belong to, if any."""
+        if self.semantic_index is None:
+            return ""
+        suggestion = self.semantic_index.suggest_project(msg["message"])
+        if suggestion is None:
+            return ""
+        return f" (similar notes are in project {suggestion[0]})"
+
+    def budget_exhausted(self):
+        """Return True if the Gemini handler's ledger has no tokens left for today."""
+        ledger = getattr(self.gemini_handler, "ledger", None)
+        return ledger is not None and ledger.remaining_today() == 0
+
+    def fire_due_reminders(self):
+        """Deliver the reminders that are due, coalesced into one notification."""
+        self.metrics.reminders_fired += self.reminders.tick()
+
+    def run_once(self):
+        """Run a single cycle: process up to max_batches batches, then fire reminders."""
+        if self.semantic_index is not None:
+            # Pick up messages inserted by other processes since the last cycle
+            self.semantic_index.sync()
+
+        if self.budget_exhausted():
+            logger.info("Daily token budget used up, classification paused until tomorrow")
+            self.metrics.budget_pauses += 1
+        else:
+            for _ in range(self.max_batches):
+                if self.stop_event.is_set() or not self.process_backlog_batch():
+                    break
+
+        self.fire_due_reminders()
+
+        if self.retention is not None and not self.stop_event.is_set():
+            # The runner is idle until the next cycle anyway
+            self.metrics.messages_archived += self.retention.run()
+
+        self.metrics.cycles += 1
+        self.db_handler.cursor.execute("SELECT COUNT(*) FROM messages WHERE processed = 0")
+        self.metrics.backlog_size = self.db_handler.cursor.fetchone()[0]
+        self.write_metrics()
+
+    def run_forever(self):
+        """Run cycles every `interval` seconds until stop() is called or the process is interrupted."""
+        logger.info("Headless runner started on %s", self.db_handler.db_name)
+        try:
+            while not self.stop_event.is_set():
+                self.run_once()
+                logger.info("Metrics: %s", self.metrics.as_dict())
+                self.stop_event.wait(self.interval)
+        except KeyboardInterrupt:
+            pass
+        logger.info("Headless runner stopped")
+
+    def stop(self):
+        """Ask run_forever to return after the current batch."""
+        self.stop_event.set()
+
+    def write_metrics(self):
+        """Write the current metrics to metrics_path, if configured."""
+        if not self.metrics_path:
+            return
+        tmp_path = self.metrics_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.metrics.as_dict(), f, indent=2)
+        os.replace(tmp_path, self.metrics_path)
+
+
+def add_arguments(parser):
+    """Add the headless options to an argparse parser."""
+    parser.add_argument("--batch-size", type=int, default=50, help="Messages classified per batch")
+    parser.add_argument("--max-batches", type=int, default=10, help="Batches processed per cycle")
+    parser.add_argument("--interval", type=int, default=60, help="Seconds between cycles")
+    parser.add_argument("--lease-seconds", type=int, default=600, help="Seconds before an abandoned claim is retried")
+    parser.add_argument("--metrics-file", default=None, help="Write throughput metrics as JSON to this file")
+    parser.add_argument("--once", action="store_true", help="Run a single cycle and exit")
+    parser.add_argument("--semantic-hints", action="store_true",
+                        help="Hint the classifier with the projects of similar notes (needs numpy)")
+    parser.add_argument("--no-retention", action="store_true",
+                        help="Do not archive old messages or vacuum between cycles")
+    parser.add_argument("--daily-token-budget", type=int, default=None,
+                        help="Pause classification once this many Gemini tokens were used today")
+    parser.add_argument("--notifier", choices=sorted(NOTIFIERS), default="log",
+                        help="Where due reminders are delivered")
+    parser.add_argument("--reminder-window", type=int, default=None,
+                        help="Minimum seconds between two reminder notifications (defaults to --interval)")
+    parser.add_argument("--backend", choices=("gemini", "local"), default="gemini",
+                        help="Where requests go; 'local' answers offline without the API, e.g. for benchmarks")
+    parser.add_argument("--model", action="append", default=None, metavar="OPERATION=MODEL[,MODEL...]",
+                        help="Candidate models of an operation, preferred first, e.g. "
+                             "classify=gemini-2.0-flash-lite,gemini-2.0-flash (repeatable)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Classify the backlog through an offline batch job, wait for it and exit")
+    parser.add_argument("--batch-service", choices=("gemini", "local"), default="gemini",
+                        help="Where batch jobs run; 'local' answers offline without the API")
+    parser.add_argument("--batch-max-messages", type=int, default=10000, help="Messages submitted per batch job")
+
+
+def build_gemini_handler(args, ledger):
+    """Build the GeminiHandler of parsed command line arguments, routing its requests per --model and --backend."""
+    from gemini_utils import GeminiHandler
+    from model_router import DEFAULT_MODELS, parse_model_overrides
+
+    models = {}
+    if args.backend == "local":
+        models = {operation: ("local",) for operation in DEFAULT_MODELS}
+    models.update(parse_model_overrides(args.model))
+    return GeminiHandler(os.environ.get("GEMINI_API_KEY"), ledger=ledger, models=models)
+
+
+def run_from_args(args):
+    """Build a HeadlessRunner from parsed command line arguments and run it."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    db_handler = DatabaseHandler(args.db)
+    db_handler.ensure_schema()
+    passphrase = os.environ.get(PASSPHRASE_ENV)
+    if passphrase:
+        db_handler.enable_encryption(passphrase)
+
+    if args.batch:
+        try:
+            return run_batch(db_handler, args)
+        finally:
+            db_handler.close()
+
+    # Every request is recorded in the gemini_requests table (see usage.py)
+    ledger = UsageLedger(args.db, daily_token_budget=args.daily_token_budget)
+    gemini_handler = build_gemini_handler(args, ledger)
+
+    semantic_index = None
+    if args.semantic_hints:
+        from semantic_index import SemanticIndex, build_embedder
+        semantic_index = SemanticIndex(db_handler, build_embedder(gemini_handler))
+
+    retention = None
+    if not args.no_retention:
+        from retention import RetentionManager
+        retention = RetentionManager(db_handler)
+
+    reminders = ReminderPipeline(
+        db_handler, NOTIFIERS[args.notifier](),
+        window=args.interval if args.reminder_window is None else args.reminder_window
+    )
+
+    runner = HeadlessRunner(
+        db_handler,
+        gemini_handler,
+        batch_size=args.batch_size,
+        max_batches=args.max_batches,
+        interval=args.interval,
+        lease_seconds=args.lease_seconds,
+        metrics_path=args.metrics_file,
+        semantic_index=semantic_index,
+        retention=retention,
+        reminders=reminders,
+    )
+
+    try:
+        if args.once:
+            runner.run_once()
+            logger.info("Metrics: %s", runner.metrics.as_dict())
+        else:
+            runner.run_forever()
+    finally:
+        ledger.close()
+        db_handler.close()
+
+
+def run_batch(db_handler, args):
+    """Submit the backlog as a batch job (or resume the pending ones) and apply the results once done."""
+    from batch_jobs import BatchClassifier, LocalBatchService, LocalRequestBuilder
+
+    if args.batch_service == "local":
+        gemini_handler = LocalRequestBuilder()
+        service = LocalBatchService(f"{args.db}.batches/local")
+    else:
+        gemini_handler = build_gemini_handler(args, UsageLedger(args.db))
+        service = gemini_handler.batch_service()
+
+    classifier = BatchClassifier(db_handler, gemini_handler, service, f"{args.db}.batches")
+    try:
+        classifier.run(max_messages=args.batch_max_messages, initial_delay=min(30, args.interval),
+                       max_delay=max(600, args.interval))
+    except KeyboardInterrupt:
+        logger.info("Stopped; pending batch jobs are resumed by the next --batch run")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run classification and reminders without the Tk UI")
+    parser.add_argument("--db", default="chat.db", help="Path to the SQLite database")
+    add_arguments(parser)
+    return run_from_args(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
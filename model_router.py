@@ -0,0 +1,233 @@
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# What the router assumes about a model until the ledger has enough of its requests.
+# max_prompt_chars is a routing threshold (longest prompt the model is trusted with), not an API limit;
+# prices are USD per million input/output tokens.
+ModelSpec = namedtuple("ModelSpec", ["max_prompt_chars", "latency_ms", "input_price", "output_price"])
+
+MODEL_SPECS = {
+    "gemini-2.0-flash-lite": ModelSpec(6000, 600, 0.075, 0.30),
+    "gemini-2.0-flash": ModelSpec(None, 800, 0.10, 0.40),
+    "gemini-2.5-flash": ModelSpec(None, 2000, 0.30, 2.50),
+    "gemini-2.5-pro": ModelSpec(None, 5000, 1.25, 10.0),
+    "text-embedding-004": ModelSpec(None, 300, 0.0, 0.0),
+    "local": ModelSpec(None, 0, 0.0, 0.0),
+}
+UNKNOWN_MODEL = ModelSpec(None, 1000, 0.0, 0.0)
+
+# Candidate models of each operation, preferred first
+DEFAULT_MODELS = {
+    "classify": ("gemini-2.0-flash-lite", "gemini-2.0-flash"),
+    "generate": ("gemini-2.0-flash",),
+    "embed": ("text-embedding-004",),
+    "batch_classify": ("gemini-2.0-flash",),
+}
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# Models whose name starts with this are answered by the local stand-in backend
+LOCAL_PREFIX = "local"
+
+# Observed numbers of one model for one operation, from the ledger
+ModelStats = namedtuple("ModelStats", ["requests", "failures", "avg_latency_ms", "prompt_tokens", "response_tokens"])
+
+
+def is_local(model):
+    return model.startswith(LOCAL_PREFIX)
+
+
+def parse_model_overrides(values):
+    """
+    Parse command line overrides like "classify=gemini-2.0-flash-lite,gemini-2.0-flash".
+
+    Returns:
+        dict: operation -> tuple of models
+    """
+    models = {}
+    for value in values or ():
+        operation, sep, names = value.partition("=")
+        if not sep or not names.strip():
+            raise ValueError(f"Expected operation=model[,model...], got {value!r}")
+        models[operation.strip()] = tuple(name.strip() for name in names.split(",") if name.strip())
+    return models
+
+
+class ModelRouter:
+    """
+    Pick the model of each request from its operation, size, latency target and past results.
+
+    Every operation has a list of candidate models (DEFAULT_MODELS, overridden
+    per operation). route() orders them for one request:
+
+    1. models whose max_prompt_chars fits the prompt, so small chunks go to a
+       cheap model and large ones to a stronger one;
+    2. among those, models whose failure rate (errors and invalid responses
+       recorded by the UsageLedger) is at most max_failure_rate, that meet
+       the latency target and that did not fail in the last `cooldown`
+       seconds, cheapest expected cost first;
+    3. then the rest, as fallbacks: GeminiHandler tries the next model when
+       one raises or answers with an invalid response.
+
+    Latency and token counts come from the ledger once a model has min_samples
+    requests for the operation, and from MODEL_SPECS until then. The ledger is
+    read at most every stats_ttl seconds.
+    """
+
+    def __init__(self, models=None, ledger=None, max_failure_rate=0.2, min_samples=20, cooldown=60,
+                 stats_days=7, stats_ttl=300, clock=None):
+        """
+        Args:
+            models (dict, optional): operation -> candidate models, merged over DEFAULT_MODELS
+            ledger (usage.UsageLedger, optional): Where the past requests are read from. Defaults to None (specs only).
+            max_failure_rate (float, optional): Share of failed requests above which a model is avoided. Defaults to 0.2.
+            min_samples (int, optional): Requests needed before the observed numbers are trusted. Defaults to 20.
+            cooldown (int, optional): Seconds a model that just failed is tried last. Defaults to 60.
+            stats_days (int, optional): Days of requests the stats cover. Defaults to 7.
+            stats_ttl (int, optional): Seconds the stats are cached. Defaults to 300.
+            clock (callable, optional): Returns the current time as a datetime. Defaults to datetime.now.
+        """
+        self.models = dict(DEFAULT_MODELS)
+        self.models.update(models or {})
+        self.ledger = ledger
+        self.max_failure_rate = max_failure_rate
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.stats_days = stats_days
+        self.stats_ttl = stats_ttl
+        self.clock = clock or datetime.now
+
+        self.stats = {}
+        self.stats_loaded_at = None
+        # model -> time until which it is tried last
+        self.cooling = {}
+
+    def candidates(self, operation):
+        return tuple(self.models.get(operation) or (DEFAULT_MODEL,))
+
+    def default_model(self, operation):
+        return self.candidates(operation)[0]
+
+    def spec(self, model):
+        if is_local(model):
+            return MODEL_SPECS["local"]
+        return MODEL_SPECS.get(model, UNKNOWN_MODEL)
+
+    def load_stats(self):
+        """Read the per model and operation numbers of the last stats_days days from the ledger."""
+        now = time.monotonic()
+        if self.ledger is None or (self.stats_loaded_at is not None and now - self.stats_loaded_at < self.stats_ttl):
+            return self.stats
+        since = (self.clock() - timedelta(days=self.stats_days)).strftime("%Y-%m-%d")
+        self.stats = {
+            (row.model, row.operation): ModelStats(row.requests, row.errors or 0, row.avg_latency_ms,
+                                                   row.prompt_tokens or 0, row.response_tokens or 0)
+            for row in self.ledger.rollup(("model", "operation"), since)
+        }
+        self.stats_loaded_at = now
+        return self.stats
+
+    def observed(self, model, operation):
+        """Return the ModelStats of a model for an operation, or None while it has fewer than min_samples requests."""
+        stats = self.load_stats().get((model, operation))
+        if stats is None or stats.requests < self.min_samples:
+            return None
+        return stats
+
+    def failure_rate(self, model, operation):
+        stats = self.observed(model, operation)
+        return stats.failures / stats.requests if stats else 0.0
+
+    def expected_latency(self, model, operation):
+        stats = self.observed(model, operation)
+        if stats and stats.avg_latency_ms is not None:
+            return stats.avg_latency_ms
+        return self.spec(model).latency_ms
+
+    def expected_cost(self, model, operation, prompt_chars):
+        """Estimated USD of one request: about 4 characters per prompt token, plus the usual response length."""
+        spec = self.spec(model)
+        stats = self.observed(model, operation)
+        response_tokens = stats.response_tokens / stats.requests if stats else 0
+        return (prompt_chars / 4 * spec.input_price + response_tokens * spec.output_price) / 1e6
+
+    def fits(self, model, prompt_chars):
+        limit = self.spec(model).max_prompt_chars
+        return limit is None or prompt_chars <= limit
+
+    def route(self, operation, prompt_chars=0, max_latency_ms=None):
+        """
+        Order the candidate models of one request.
+
+        Args:
+            operation (str): 'classify', 'generate', 'embed', ...
+            prompt_chars (int, optional): Size of the prompt
+            max_latency_ms (float, optional): Latency the caller needs. Defaults to None (no target).
+
+        Returns:
+            list: Models to try, the chosen one first and the fallbacks after it
+        """
+        candidates = self.candidates(operation)
+        now = time.monotonic()
+        fitting = [model for model in candidates if self.fits(model, prompt_chars)]
+        if not fitting:
+            # Nothing is trusted with a prompt this large: the candidate trusted with the largest goes first
+            fitting = [max(candidates, key=lambda model: self.spec(model).max_prompt_chars or float("inf"))]
+
+        def preferred(model):
+            return (self.failure_rate(model, operation) <= self.max_failure_rate
+                    and self.cooling.get(model, 0) <= now
+                    and (max_latency_ms is None or self.expected_latency(model, operation) <= max_latency_ms))
+
+        best = sorted((model for model in fitting if preferred(model)),
+                      key=lambda model: self.expected_cost(model, operation, prompt_chars))
+        fallbacks = sorted((model for model in fitting if model not in best),
+                           key=lambda model: (self.cooling.get(model, 0) > now, self.failure_rate(model, operation),
+                                              self.expected_latency(model, operation)))
+        others = [model for model in candidates if model not in best and model not in fallbacks]
+        return best + fallbacks + others
+
+    def failed(self, model):
+        """Try a model last for the next `cooldown` seconds, after it raised or answered invalidly."""
+        self.cooling[model] = time.monotonic() + self.cooldown
+
+    def explain(self, operation, prompt_chars=0, max_latency_ms=None):
+        """Return one line per candidate with the numbers the route was chosen from."""
+        lines = []
+        for model in self.route(operation, prompt_chars, max_latency_ms):
+            stats = self.observed(model, operation)
+            lines.append(
+                f"{model}: fits={self.fits(model, prompt_chars)} "
+                f"failure_rate={self.failure_rate(model, operation):.1%} "
+                f"latency_ms={self.expected_latency(model, operation)} "
+                f"cost_usd={self.expected_cost(model, operation, prompt_chars):.6f} "
+                f"samples={stats.requests if stats else 0}"
+            )
+        return lines
+
+
+def main(argv=None):
+    import argparse
+
+    from usage import UsageLedger
+
+    parser = argparse.ArgumentParser(description="Show which models requests of a given size are routed to")
+    parser.add_argument("--db", default="chat.db", help="Path to the SQLite database with the recorded requests")
+    parser.add_argument("--operation", default="classify", help="Operation to route")
+    parser.add_argument("--model", action="append", default=None, metavar="OPERATION=MODEL[,MODEL...]",
+                        help="Candidate models of an operation, preferred first (repeatable)")
+    parser.add_argument("--max-latency-ms", type=float, default=None, help="Latency target")
+    parser.add_argument("chars", type=int, nargs="*", default=[500, 5000, 20000], help="Prompt sizes")
+    args = parser.parse_args(argv)
+
+    ledger = UsageLedger(args.db)
+    router = ModelRouter(parse_model_overrides(args.model), ledger)
+    for chars in args.chars:
+        print(f"{args.operation}, {chars} chars:")
+        for line in router.explain(args.operation, chars, args.max_latency_ms):
+            print(f"  {line}")
+    ledger.close()
+
+
+if __name__ == "__main__":
+    main()
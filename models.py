@@ -0,0 +1,121 @@
+from collections import namedtuple
+from itertools import starmap
+
+# Columns of the messages table, in the order DatabaseHandler selects them
+MESSAGE_FIELDS = (
+    "id", "sender", "message", "timestamp", "category", "message_type", "project", "file_path",
+    "processed", "claimed_at", "reminder_time", "reminder_fired", "duplicate_of", "duplicate_count",
+)
+
+# A row of the projects table with its maintained aggregates and its place in the hierarchy
+ProjectSummary = namedtuple(
+    "ProjectSummary",
+    ["name", "message_count", "last_activity", "pending_reminders", "revision", "id", "parent_id"]
+)
+
+# A project listed in a folder: its summary, how many direct children it has and
+# how many messages its whole subtree holds
+ProjectNode = namedtuple("ProjectNode", ProjectSummary._fields + ("child_count", "subtree_messages"))
+
+
+class Message:
+    """
+    A row of the messages table.
+
+    Uses __slots__ instead of a per-row dict, so a loaded chat history costs a
+    fraction of the memory. Item access (msg['sender']) is kept so code written
+    against the old dictionaries keeps working.
+    """
+
+    __slots__ = MESSAGE_FIELDS
+
+    def __init__(self, id=None, sender=None, message=None, timestamp=None, category=None,
+                 message_type=None, project=None, file_path=None, processed=None,
+                 claimed_at=None, reminder_time=None, reminder_fired=None, duplicate_of=None,
+                 duplicate_count=None):
+        self.id = id
+        self.sender = sender
+        self.message = message
+        self.timestamp = timestamp
+        self.category = category
+        self.message_type = message_type
+        self.project = project
+        self.file_path = file_path
+        self.processed = processed
+        self.claimed_at = claimed_at
+        self.reminder_time = reminder_time
+        self.reminder_fired = reminder_fired
+        self.duplicate_of = duplicate_of
+        self.duplicate_count = duplicate_count
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        """Return a field by name, or default if there is no such field."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """Return the field names, like dict.keys()."""
+        return MESSAGE_FIELDS
+
+    def as_dict(self):
+        """Return the message as a plain dictionary."""
+        return {field: getattr(self, field) for field in MESSAGE_FIELDS}
+
+    def __eq__(self, other):
+        if not isinstance(other, Message):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in MESSAGE_FIELDS)
+
+    def __repr__(self):
+        return f"Message(id={self.id!r}, sender={self.sender!r}, project={self.project!r}, message={self.message!r})"
+
+
+def rows_to_messages(rows, columns):
+    """
+    Convert database rows into Message objects.
+
+    When the columns are a prefix of MESSAGE_FIELDS (the usual case) each row is
+    passed positionally, with no per-column Python work at all.
+
+    Args:
+        rows (list): Row tuples
+        columns (list): Column names of the rows, in order
+
+    Returns:
+        list: The rows as Message objects
+    """
+    columns = tuple(columns)
+    if columns == MESSAGE_FIELDS[:len(columns)]:
+        return list(starmap(Message, rows))
+
+    unknown = [column for column in columns if column not in MESSAGE_FIELDS]
+    if unknown:
+        raise ValueError(f"Not message columns: {unknown}")
+    return [Message(**dict(zip(columns, row))) for row in rows]
+
+
+def rows_to_columns(rows, columns):
+    """
+    Convert database rows into a columnar result: one tuple of values per column.
+
+    Bulk consumers that only walk one or two fields (the classifier, exporters)
+    avoid building an object per row this way.
+
+    Args:
+        rows (list): Row tuples
+        columns (list): Column names of the rows, in order
+
+    Returns:
+        dict: Column name -> tuple of values, all of the same length
+    """
+    if not rows:
+        return {column: () for column in columns}
+    return dict(zip(columns, zip(*rows)))
@@ -0,0 +1,298 @@
+import hashlib
+import json
+import mimetypes
+import multiprocessing
+import os
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from crypto_store import is_encrypted_file
+
+# Optional PDF backends: PyMuPDF renders thumbnails, pypdf only reads pages and text
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+# Part of the cache key, so previews are rebuilt once a better backend is installed
+PDF_BACKEND = "pymupdf" if fitz is not None else "pypdf" if pypdf is not None else "none"
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+TEXT_EXTENSIONS = (".txt", ".md", ".csv", ".json", ".log", ".py", ".html", ".xml")
+
+# Characters of extracted text kept for the search index, and shown under a preview
+MAX_TEXT_CHARS = 20000
+EXCERPT_CHARS = 300
+
+
+def cache_key(file_path, thumb_size):
+    """Key of a preview in the disk cache; changes whenever the file does."""
+    stat = os.stat(file_path)
+    raw = (f"{os.path.abspath(file_path)}|{stat.st_mtime_ns}|{stat.st_size}|"
+           f"{thumb_size[0]}x{thumb_size[1]}|{PDF_BACKEND}")
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def build_preview(file_path, cache_dir, thumb_size=(300, 300)):
+    """
+    Build (or read from the disk cache) the preview of a file.
+
+    Runs in a worker process, so it must not touch Tk or the database.
+
+    Returns:
+        dict: kind ('pdf', 'image', 'text' or 'file'), mime, size, page_count,
+        text, thumbnail (path of a PNG in the cache or None) and error
+    """
+    key = cache_key(file_path, thumb_size)
+    json_path = os.path.join(cache_dir, key + ".json")
+    if os.path.exists(json_path):
+        with open(json_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    ext = os.path.splitext(file_path)[1].lower()
+    preview = {
+        "kind": "file",
+        "mime": mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+        "size": os.path.getsize(file_path),
+        "page_count": None,
+        "text": "",
+        "thumbnail": None,
+        "error": None,
+    }
+    thumbnail_path = os.path.join(cache_dir, key + ".png")
+
+    try:
+        if ext == ".pdf":
+            preview["kind"] = "pdf"
+            _pdf_preview(file_path, thumbnail_path, thumb_size, preview)
+        elif ext in IMAGE_EXTENSIONS:
+            from PIL import Image
+
+            preview["kind"] = "image"
+            with Image.open(file_path) as img:
+                img.thumbnail(thumb_size)
+                img.save(thumbnail_path, "PNG")
+            preview["thumbnail"] = thumbnail_path
+        elif ext in TEXT_EXTENSIONS or preview["mime"].startswith("text/"):
+            preview["kind"] = "text"
+            with open(file_path, encoding="utf-8", errors="replace") as f:
+                preview["text"] = f.read(MAX_TEXT_CHARS)
+    except Exception as e:
+        preview["error"] = str(e)
+
+    # Write through a temporary file so a crashed worker never leaves half a cache entry
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(preview, f)
+    os.replace(tmp_path, json_path)
+    return preview
+
+
+def _pdf_preview(file_path, thumbnail_path, thumb_size, preview):
+    if fitz is not None:
+        with fitz.open(file_path) as doc:
+            preview["page_count"] = doc.page_count
+            preview["text"] = _collect_text(page.get_text() for page in doc)
+            if doc.page_count:
+                page = doc[0]
+                zoom = min(thumb_size[0] / page.rect.width, thumb_size[1] / page.rect.height)
+                page.get_pixmap(matrix=fitz.Matrix(zoom, zoom)).save(thumbnail_path)
+                preview["thumbnail"] = thumbnail_path
+    elif pypdf is not None:
+        reader = pypdf.PdfReader(file_path)
+        preview["page_count"] = len(reader.pages)
+        preview["text"] = _collect_text(page.extract_text() or "" for page in reader.pages)
+    else:
+        preview["error"] = "Install PyMuPDF or pypdf for PDF previews"
+
+
+def _collect_text(pages):
+    """Join page texts, stopping once MAX_TEXT_CHARS are collected."""
+    parts = []
+    length = 0
+    for text in pages:
+        parts.append(text)
+        length += len(text)
+        if length >= MAX_TEXT_CHARS:
+            break
+    return "".join(parts)[:MAX_TEXT_CHARS]
+
+
+def describe(preview):
+    """One-line summary of a preview, e.g. 'PDF · 12 pages · 1.3 MB'."""
+    parts = [preview["kind"].upper() if preview["kind"] == "pdf" else preview["mime"]]
+    if preview["page_count"]:
+        parts.append(f"{preview['page_count']} page{'s' if preview['page_count'] != 1 else ''}")
+    size = preview["size"]
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            parts.append(f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}")
+            break
+        size /= 1024
+    return " · ".join(parts)
+
+
+class PreviewService:
+    """
+    Generate file previews in a pool of worker processes, with a disk cache.
+
+    Like WriteBehindQueue, results are not delivered through callbacks but
+    collected by the UI thread with drain_results, because Tk must only be
+    touched from its own thread. Requests for a file already being processed
+    are merged.
+    """
+
+    def __init__(self, cache_dir, max_workers=2, thumb_size=(300, 300), memory_size=512):
+        """
+        Args:
+            cache_dir (str): Directory of the cached previews and thumbnails
+            max_workers (int, optional): Worker processes. Defaults to 2.
+            thumb_size (tuple, optional): Maximum thumbnail width and height. Defaults to (300, 300).
+            memory_size (int, optional): Previews kept in memory, without their full text. Defaults to 512.
+        """
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.thumb_size = thumb_size
+        self.memory_size = memory_size
+
+        self.executor = None
+        self.results = queue.Queue()
+        # file path -> message IDs waiting for its preview
+        self.in_flight = {}
+        self.memory = OrderedDict()
+
+    def request(self, file_path, message_id=None):
+        """
+        Ask for the preview of a file.
+
+        Args:
+            file_path (str): The attached file
+            message_id (int, optional): Message whose attachment text should be indexed once the preview is built
+
+        Returns:
+            dict: The preview if it is already in memory (and no indexing was asked for), else None;
+            the preview is then reported by drain_results later
+        """
+        if message_id is None and file_path in self.memory:
+            self.memory.move_to_end(file_path)
+            return self.memory[file_path]
+
+        if file_path in self.in_flight:
+            self.in_flight[file_path].add(message_id)
+            return None
+
+        if self.executor is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Spawned workers do not inherit the Tk interpreter of the parent
+            self.executor = ProcessPoolExecutor(
+                self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+        self.in_flight[file_path] = {message_id}
+        future = self.executor.submit(build_preview, file_path, self.cache_dir, self.thumb_size)
+        future.add_done_callback(lambda f: self.results.put((file_path, f)))
+        return None
+
+    @property
+    def busy(self):
+        """True while previews are being generated."""
+        return bool(self.in_flight)
+
+    def drain_results(self):
+        """
+        Return every preview finished since the last call, without blocking.
+
+        Returns:
+            list: (file_path, message IDs, preview) tuples; message IDs exclude None
+        """
+        finished = []
+        while True:
+            try:
+                file_path, future = self.results.get_nowait()
+            except queue.Empty:
+                return finished
+
+            message_ids = {message_id for message_id in self.in_flight.pop(file_path, ()) if message_id is not None}
+            try:
+                preview = future.result()
+            except Exception as e:
+                preview = {"kind": "file", "mime": "", "size": 0, "page_count": None, "text": "",
+                           "thumbnail": None, "error": str(e)}
+            self._remember(file_path, preview)
+            finished.append((file_path, message_ids, preview))
+
+    def close(self):
+        """Stop the worker processes, dropping previews that are not started yet."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def _remember(self, file_path, preview):
+        self.memory[file_path] = dict(preview, text=preview["text"][:EXCERPT_CHARS])
+        self.memory.move_to_end(file_path)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+
+def index_attachments(db_handler, service, batch_size=100, progress=None):
+    """
+    Extract and store the text of every attachment that is not indexed yet.
+
+    Returns:
+        int: Number of attachments indexed
+    """
+    count = 0
+    while True:
+        attachments = db_handler.get_unindexed_attachments(batch_size)
+        if not attachments:
+            return count
+        for message_id, file_path in attachments:
+            file_path = db_handler.reveal(file_path, "file_path")
+            # Encrypted copies are not read back: the UI indexes an attachment from the original file when it is sent
+            if os.path.exists(file_path) and not is_encrypted_file(file_path):
+                service.request(file_path, message_id)
+            else:
+                # Indexed as empty so the file is not looked for again
+                db_handler.store_attachment_text(message_id, "", None)
+                count += 1
+        while service.busy:
+            for _, message_ids, preview in service.drain_results():
+                for message_id in message_ids:
+                    db_handler.store_attachment_text(message_id, preview["text"], preview["page_count"])
+                    count += 1
+            time.sleep(0.05)
+        if progress:
+            progress(count)
+
+
+def main(argv=None):
+    import argparse
+
+    from bulk_io import ProgressPrinter
+    from database_utils import DatabaseHandler
+
+    parser = argparse.ArgumentParser(description="Extract the text of attached files into the search index")
+    parser.add_argument("--db", default="chat.db", help="Path to the SQLite database")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Worker processes")
+    args = parser.parse_args(argv)
+
+    db_handler = DatabaseHandler(args.db)
+    service = PreviewService(f"{args.db}.previews", max_workers=args.workers)
+    try:
+        db_handler.ensure_schema()
+        index_attachments(db_handler, service, progress=ProgressPrinter("Indexed"))
+        print()
+    finally:
+        service.close()
+        db_handler.close()
+
+
+if __name__ == "__main__":
+    main()
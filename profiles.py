@@ -0,0 +1,248 @@
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from database_utils import DatabaseHandler
+from models import rows_to_messages
+
+# SQLite attaches at most 10 databases to a connection by default (SQLITE_MAX_ATTACHED)
+ATTACH_LIMIT = 10
+
+logger = logging.getLogger(__name__)
+
+# Columns every profile has, even one created before ensure_schema added the newer ones
+SEARCH_COLUMNS = ["id", "sender", "message", "message_type", "project", "file_path", "timestamp"]
+
+
+class ProfileManager:
+    """
+    Named databases (profiles) with a small LRU of open DatabaseHandler instances.
+
+    Switching back to a recently used profile reuses its open connection, so
+    its schema checks, column cache and SQLite page cache are still warm. The
+    least recently used handler is closed once more than max_open are open;
+    the active one never is.
+    """
+
+    def __init__(self, profiles, max_open=3, active=None):
+        """
+        Args:
+            profiles (dict): Profile name -> database file
+            max_open (int, optional): Handlers kept open. Defaults to 3.
+            active (str, optional): Profile opened by switch() when none is given. Defaults to the first one.
+        """
+        if not profiles:
+            raise ValueError("At least one profile is needed")
+        self.profiles = dict(profiles)
+        self.max_open = max(1, max_open)
+        self.default = active or next(iter(self.profiles))
+        self.active = None
+        self.handlers = OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_directory(cls, directory, max_open=3, active=None):
+        """
+        Use every database file in a directory as a profile named after the file.
+
+        The archive and write-queue side files of a profile are skipped. A
+        directory without databases gets a 'default' profile.
+        """
+        os.makedirs(directory, exist_ok=True)
+        profiles = {}
+        for file_name in sorted(os.listdir(directory)):
+            name, ext = os.path.splitext(file_name)
+            if ext == ".db" and "." not in name:
+                profiles[name] = os.path.join(directory, file_name)
+        if not profiles:
+            profiles["default"] = os.path.join(directory, "default.db")
+        if active and active not in profiles:
+            profiles[active] = os.path.join(directory, f"{active}.db")
+        return cls(profiles, max_open, active)
+
+    def names(self):
+        """Return the profile names, sorted."""
+        return sorted(self.profiles)
+
+    def add_profile(self, name, db_name):
+        """Register a new profile; its database is created when it is first opened."""
+        if name in self.profiles:
+            raise ValueError(f"Profile {name!r} already exists")
+        self.profiles[name] = db_name
+
+    def open(self, name):
+        """
+        Return the handler of a profile, opening it (and its schema) if needed.
+
+        Raises:
+            KeyError: If the profile does not exist
+        """
+        with self.lock:
+            handler = self.handlers.get(name)
+            if handler is not None:
+                self.handlers.move_to_end(name)
+                return handler
+
+            handler = DatabaseHandler(self.profiles[name])
+            handler.ensure_schema()
+            self.handlers[name] = handler
+            self._evict(keep=name)
+            return handler
+
+    def switch(self, name=None):
+        """Make a profile the active one and return its handler."""
+        name = name or self.default
+        handler = self.open(name)
+        self.active = name
+        return handler
+
+    def close(self):
+        """Close every open handler."""
+        with self.lock:
+            for handler in self.handlers.values():
+                handler.close()
+            self.handlers.clear()
+
+    def _evict(self, keep):
+        for name in list(self.handlers):
+            if len(self.handlers) <= self.max_open:
+                return
+            if name not in (keep, self.active):
+                self.handlers.pop(name).close()
+
+    def locked_profiles(self, names=None):
+        """
+        Return the encrypted profiles that search() cannot look into.
+
+        A profile is searchable once its handler is open and unlocked with
+        enable_encryption; encrypted profiles opened without their passphrase
+        (or not open at all) are locked.
+        """
+        locked = []
+        for name in names or self.names():
+            path = self.profiles[name]
+            handler = self.handlers.get(name)
+            if handler is not None and handler.cipher is not None:
+                continue
+            if os.path.exists(path) and _is_encrypted_database(path):
+                locked.append(name)
+        return locked
+
+    def search(self, search_term, names=None, limit=200, max_workers=4):
+        """
+        Search the messages of several profiles at once.
+
+        Profiles are split in groups of up to ATTACH_LIMIT databases. Each group
+        is attached read-only to one connection and searched with a single
+        UNION ALL query, and the groups run in parallel threads. Archived
+        messages are not searched.
+
+        Unlocked encrypted profiles are searched through their blind index, so
+        every word of the term must match a whole word, as in
+        DatabaseHandler.search_messages; their results come back decrypted.
+        Locked ones (see locked_profiles) are left out.
+
+        Args:
+            search_term (str): Text to look for in message bodies
+            names (list, optional): Profiles to search. Defaults to all of them.
+            limit (int, optional): Maximum results, newest first. Defaults to 200.
+            max_workers (int, optional): Groups searched at the same time. Defaults to 4.
+
+        Returns:
+            list: (profile name, Message) tuples
+        """
+        names = [name for name in (names or self.names()) if os.path.exists(self.profiles[name])]
+        locked = self.locked_profiles(names)
+        if locked:
+            logger.warning("Encrypted profiles not searched, they are locked: %s", ", ".join(locked))
+        names = [name for name in names if name not in locked]
+        ciphers = {}
+        for name in names:
+            handler = self.handlers.get(name)
+            if handler is not None and handler.cipher is not None:
+                ciphers[name] = handler.cipher
+
+        groups = [names[i:i + ATTACH_LIMIT] for i in range(0, len(names), ATTACH_LIMIT)]
+        if not groups:
+            return []
+
+        with ThreadPoolExecutor(min(max_workers, len(groups))) as executor:
+            batches = list(executor.map(lambda group: self._search_group(group, search_term, limit, ciphers), groups))
+
+        rows = sorted((row for batch in batches for row in batch), key=lambda row: row[1][-1] or "", reverse=True)
+        results = [(profile, rows_to_messages([row], SEARCH_COLUMNS)[0]) for profile, row in rows[:limit]]
+        for profile, msg in results:
+            cipher = ciphers.get(profile)
+            if cipher is not None:
+                msg.message = cipher.decrypt(msg.message, "message")
+                msg.file_path = cipher.decrypt(msg.file_path, "file_path")
+        return results
+
+    def _search_group(self, names, search_term, limit, ciphers):
+        # Runs on a worker thread: SQLite connections cannot be shared between threads,
+        # so every group gets its own in-memory connection with the profiles attached
+        conn = sqlite3.connect(":memory:", uri=True)
+        try:
+            selects = []
+            params = []
+            for i, name in enumerate(names):
+                uri = f"file:{quote(os.path.abspath(self.profiles[name]))}?mode=ro"
+                conn.execute(f"ATTACH DATABASE ? AS p{i}", (uri,))
+                select = f"SELECT ? AS profile, {', '.join(SEARCH_COLUMNS)} FROM p{i}.messages"
+                if name in ciphers:
+                    # Encrypted bodies cannot be matched with LIKE: look every word up in the blind index
+                    tokens = list(ciphers[name].blind_tokens(search_term))
+                    if not tokens:
+                        continue
+                    selects.append(f"{select} WHERE id IN (SELECT message_id FROM p{i}.message_tokens"
+                                   f" WHERE token IN ({', '.join(['?'] * len(tokens))})"
+                                   f" GROUP BY message_id HAVING COUNT(*) = ?)")
+                    params.extend([name] + tokens + [len(tokens)])
+                else:
+                    selects.append(f"{select} WHERE message LIKE ?")
+                    params.extend([name, f"%{search_term}%"])
+            if not selects:
+                return []
+
+            cursor = conn.execute(
+                " UNION ALL ".join(selects) + " ORDER BY timestamp DESC LIMIT ?", params + [limit]
+            )
+            return [(row[0], row[1:]) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+
+def _is_encrypted_database(path):
+    """Whether encryption was enabled on a database file, read without opening a DatabaseHandler."""
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'encryption'").fetchone() is None:
+            return False
+        return conn.execute("SELECT 1 FROM encryption WHERE id = 1").fetchone() is not None
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Search the messages of every profile in a directory")
+    parser.add_argument("--profiles-dir", required=True, help="Directory holding one database per profile")
+    parser.add_argument("--limit", type=int, default=50, help="Maximum number of results")
+    parser.add_argument("search_term")
+    args = parser.parse_args(argv)
+
+    manager = ProfileManager.from_directory(args.profiles_dir)
+    for profile, msg in manager.search(args.search_term, limit=args.limit):
+        print(f"[{profile}] {msg['timestamp']} {msg['project']}: {msg['message']}")
+    locked = manager.locked_profiles()
+    if locked:
+        print(f"Not searched (encrypted): {', '.join(locked)}")
+
+
+if __name__ == "__main__":
+    main()
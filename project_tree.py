@@ -0,0 +1,159 @@
+import bisect
+import tkinter as tk
+from tkinter import ttk
+
+# Child item standing in for the children of a project that were not loaded yet
+PLACEHOLDER_PREFIX = "\x1f"
+
+
+class ProjectTree:
+    """
+    A ttk.Treeview of the project hierarchy that loads children on demand.
+
+    Only the top level is queried up front; the children of a project are
+    fetched (one indexed query, see DatabaseHandler.get_child_projects) the
+    first time it is opened. Until then a placeholder child gives it an
+    expander. Items are keyed by project name, which is unique.
+    """
+
+    def __init__(self, parent, db_handler, columns=True, include_main=False, height=15):
+        """
+        Args:
+            parent (tk.Widget): Where the tree and its scrollbar are packed
+            db_handler (DatabaseHandler): The database to read the projects from
+            columns (bool, optional): Show the notes, reminders and last activity columns. Defaults to True.
+            include_main (bool, optional): List the main project too, e.g. in a picker. Defaults to False.
+            height (int, optional): Visible rows. Defaults to 15.
+        """
+        self.db_handler = db_handler
+        self.include_main = include_main
+        self.columns = ("notes", "reminders", "last_activity") if columns else ()
+
+        self.frame = ttk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=self.columns, height=height, selectmode="browse",
+                                 show="tree headings" if columns else "tree")
+        self.tree.heading("#0", text="Project")
+        for column, heading, width in zip(self.columns, ("Notes", "Reminders", "Last activity"), (70, 80, 140)):
+            self.tree.heading(column, text=heading)
+            self.tree.column(column, width=width, stretch=False, anchor=tk.E if width < 100 else tk.W)
+        scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # Projects whose children are shown ("" is the top level), and project ID -> name of every item
+        self.loaded = set()
+        self.names = {}
+        self.tree.bind("<<TreeviewOpen>>", lambda event: self.load_children(self.tree.focus()))
+        self.load_children("")
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def reset(self, db_handler=None):
+        """Forget every item and load the top level again, e.g. from another database."""
+        if db_handler is not None:
+            self.db_handler = db_handler
+        self.tree.delete(*self.tree.get_children(""))
+        self.loaded.clear()
+        self.names.clear()
+        self.load_children("")
+
+    def load_children(self, name):
+        """Show the children of a project ("" for the top level), if they are not shown yet."""
+        if name in self.loaded or (name and not self.tree.exists(name)):
+            return
+        self.loaded.add(name)
+        self.tree.delete(*self.tree.get_children(name))
+        for node in self.db_handler.get_child_projects(name or None):
+            if node.name != "main" or self.include_main:
+                self.insert(node, name, "end", node.child_count > 0)
+
+    def insert(self, summary, parent, index, has_children):
+        self.tree.insert(parent, index, iid=summary.name, text=f"📁 {summary.name}", values=self.values(summary))
+        self.names[summary.id] = summary.name
+        if has_children:
+            self.add_placeholder(summary.name)
+
+    def add_placeholder(self, name):
+        if name and name not in self.loaded and not self.tree.get_children(name):
+            self.tree.insert(name, "end", iid=PLACEHOLDER_PREFIX + name, text="…")
+
+    def values(self, summary):
+        if not self.columns:
+            return ()
+        return (summary.message_count, summary.pending_reminders or "", (summary.last_activity or "")[:16])
+
+    def apply(self, summaries):
+        """
+        Bring the shown items up to date with changed projects.
+
+        Args:
+            summaries (list): ProjectSummary tuples, e.g. from get_project_summaries(since_revision)
+        """
+        for summary in summaries:
+            if summary.name == "main" and not self.include_main:
+                continue
+            parent = "" if summary.parent_id is None else self.names.get(summary.parent_id)
+            shown = self.tree.exists(summary.name)
+
+            if parent is None or parent not in self.loaded:
+                # Its parent is not open: drop the item and let the parent load it when opened
+                if shown:
+                    self.forget(summary.name)
+                if parent is not None:
+                    self.add_placeholder(parent)
+            elif shown:
+                if self.tree.parent(summary.name) != parent:
+                    self.tree.move(summary.name, parent, self.index(parent, summary.name))
+                self.tree.item(summary.name, values=self.values(summary))
+            else:
+                has_children = len(self.db_handler.get_subtree_projects(summary.name)) > 1
+                self.insert(summary, parent, self.index(parent, summary.name), has_children)
+
+    def forget(self, name):
+        """Remove an item and everything below it."""
+        stack = [name]
+        while stack:
+            item = stack.pop()
+            self.loaded.discard(item)
+            stack.extend(self.tree.get_children(item))
+        self.names = {project_id: project for project_id, project in self.names.items()
+                      if self.tree.exists(project) and project != name
+                      and not self.is_below(project, name)}
+        self.tree.delete(name)
+
+    def is_below(self, item, ancestor):
+        item = self.tree.parent(item)
+        while item:
+            if item == ancestor:
+                return True
+            item = self.tree.parent(item)
+        return False
+
+    def index(self, parent, name):
+        """Position of name among the children of parent, which are sorted by name."""
+        children = [child for child in self.tree.get_children(parent) if child != name]
+        return bisect.bisect(children, name)
+
+    def selected(self):
+        """Return the name of the selected project, or None."""
+        selection = self.tree.selection()
+        if not selection or selection[0].startswith(PLACEHOLDER_PREFIX):
+            return None
+        return selection[0]
+
+    def reveal(self, name):
+        """Open the ancestors of a project and select it."""
+        path = self.db_handler.get_project_path(name)
+        for ancestor in path[:-1]:
+            self.load_children(ancestor)
+            if self.tree.exists(ancestor):
+                self.tree.item(ancestor, open=True)
+        if self.tree.exists(name):
+            self.tree.selection_set(name)
+            self.tree.see(name)
+
+    def top_level(self):
+        """Return the names of the top-level projects shown."""
+        return list(self.tree.get_children(""))
@@ -0,0 +1,80 @@
+class RefreshScheduler:
+    """
+    Poll for changes made by other processes with an adaptive interval.
+
+    Each tick calls check(); when it reports a change, refresh() runs and the
+    interval drops back to min_interval, otherwise the interval is multiplied
+    by backoff up to max_interval. activity() snaps back to the fast interval
+    (call it on user input) and pause()/resume() stop polling entirely while
+    the window cannot be seen. Scheduling goes through the Tk after() queue,
+    so check and refresh always run on the Tk thread.
+    """
+
+    def __init__(self, root, check, refresh, min_interval=1000, max_interval=60000, backoff=2.0):
+        """
+        Args:
+            root (tk.Tk): Any widget, used for after() and after_cancel()
+            check (callable): Returns True when something changed, e.g. DatabaseHandler.has_external_changes
+            refresh (callable): Brings the visible view up to date
+            min_interval (int, optional): Milliseconds between polls right after a change or user input. Defaults to 1000.
+            max_interval (int, optional): Longest interval the back-off reaches. Defaults to 60000.
+            backoff (float, optional): Interval multiplier after each poll that found nothing. Defaults to 2.0.
+        """
+        self.root = root
+        self.check = check
+        self.refresh = refresh
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self.interval = min_interval
+        self.job = None
+        self.running = False
+        self.paused = False
+
+    def start(self):
+        """Start polling."""
+        self.running = True
+        self._schedule(self.interval)
+
+    def stop(self):
+        """Stop polling for good."""
+        self.running = False
+        self._cancel()
+
+    def pause(self):
+        """Stop polling until resume(), e.g. while the window is iconified."""
+        self.paused = True
+        self._cancel()
+
+    def resume(self):
+        """Poll again right away, e.g. when the window is shown again."""
+        if self.paused:
+            self.paused = False
+            self.interval = self.min_interval
+            self._schedule(0)
+
+    def activity(self):
+        """Note user input: poll at the fast interval again from now on."""
+        if self.interval > self.min_interval:
+            self.interval = self.min_interval
+            self._schedule(self.interval)
+
+    def _tick(self):
+        self.job = None
+        if self.check():
+            self.refresh()
+            self.interval = self.min_interval
+        else:
+            self.interval = min(int(self.interval * self.backoff), self.max_interval)
+        self._schedule(self.interval)
+
+    def _schedule(self, delay):
+        self._cancel()
+        if self.running and not self.paused:
+            self.job = self.root.after(delay, self._tick)
+
+    def _cancel(self):
+        if self.job is not None:
+            self.root.after_cancel(self.job)
+            self.job = None
@@ -0,0 +1,284 @@
+import logging
+import shutil
+import subprocess
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from classification import REMINDER_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# One delivery: a title, a body and the reminders (Message objects) it covers
+Notification = namedtuple("Notification", ["title", "body", "reminders"])
+
+
+class FakeClock:
+    """A clock that only moves when told to, for driving ReminderPipeline in tests and simulations."""
+
+    def __init__(self, start=None):
+        """
+        Args:
+            start (datetime or str, optional): Initial time. Defaults to the current local time.
+        """
+        self.now = datetime.now().replace(microsecond=0)
+        if start is not None:
+            self.set(start)
+
+    def __call__(self):
+        return self.now
+
+    def set(self, when):
+        self.now = datetime.strptime(when, REMINDER_FORMAT) if isinstance(when, str) else when
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+
+class LogNotifier:
+    """Write notifications to the log, for headless runs."""
+
+    name = "log"
+
+    def notify(self, notification):
+        logger.info("%s: %s", notification.title, notification.body.replace("\n", " | "))
+
+
+class RecordingNotifier:
+    """Keep notifications in a list instead of showing them, for tests."""
+
+    name = "recording"
+
+    def __init__(self):
+        self.sent = []
+
+    def notify(self, notification):
+        self.sent.append(notification)
+
+
+class CommandNotifier:
+    """
+    Show notifications with a desktop command such as notify-send.
+
+    The command gets the title and the body as its last two arguments. A
+    non-zero exit status raises, so the pipeline retries the delivery later.
+    """
+
+    name = "notify-send"
+
+    def __init__(self, command=("notify-send", "--app-name=Reminder Project"), timeout=5):
+        """
+        Args:
+            command (tuple, optional): Program and leading arguments. Defaults to notify-send.
+            timeout (int, optional): Seconds to wait for the command. Defaults to 5.
+        """
+        self.command = list(command)
+        self.timeout = timeout
+
+    @classmethod
+    def available(cls, program="notify-send"):
+        return shutil.which(program) is not None
+
+    def notify(self, notification):
+        subprocess.run(self.command + [notification.title, notification.body],
+                       check=True, timeout=self.timeout, capture_output=True)
+
+
+class ToastNotifier:
+    """
+    Show notifications as small undecorated windows in the corner of the screen.
+
+    Toasts close themselves after `duration` milliseconds or when clicked, and
+    at most max_toasts are shown at once; they never take the focus or wait
+    for the user. Must be called on the Tk thread.
+    """
+
+    name = "toast"
+
+    def __init__(self, root, duration=8000, max_toasts=3, width=320):
+        """
+        Args:
+            root (tk.Tk): The application root window
+            duration (int, optional): Milliseconds a toast stays on screen. Defaults to 8000.
+            max_toasts (int, optional): Toasts shown at once; the oldest is closed first. Defaults to 3.
+            width (int, optional): Width of a toast in pixels. Defaults to 320.
+        """
+        self.root = root
+        self.duration = duration
+        self.max_toasts = max_toasts
+        self.width = width
+        self.toasts = []
+
+    def notify(self, notification):
+        import tkinter as tk
+
+        while len(self.toasts) >= self.max_toasts:
+            self.close(self.toasts[0])
+
+        toast = tk.Toplevel(self.root)
+        toast.overrideredirect(True)
+        toast.attributes("-topmost", True)
+        frame = tk.Frame(toast, bg="#333333", padx=10, pady=8)
+        frame.pack(fill=tk.BOTH, expand=True)
+        tk.Label(frame, text=notification.title, bg="#333333", fg="white", font=("Arial", 10, "bold"),
+                 anchor=tk.W, justify=tk.LEFT, wraplength=self.width - 20).pack(fill=tk.X)
+        tk.Label(frame, text=notification.body, bg="#333333", fg="white", anchor=tk.W,
+                 justify=tk.LEFT, wraplength=self.width - 20).pack(fill=tk.X)
+        for widget in (toast, frame, *frame.winfo_children()):
+            widget.bind("<Button-1>", lambda event, t=toast: self.close(t))
+
+        self.toasts.append(toast)
+        self.layout()
+        toast.after(self.duration, lambda: self.close(toast))
+
+    def close(self, toast):
+        if toast in self.toasts:
+            self.toasts.remove(toast)
+            toast.destroy()
+            self.layout()
+
+    def layout(self):
+        """Stack the toasts upwards from the bottom-right corner of the screen, newest at the bottom."""
+        bottom = self.root.winfo_screenheight() - 60
+        right = self.root.winfo_screenwidth() - 20
+        for toast in reversed(self.toasts):
+            toast.update_idletasks()
+            height = toast.winfo_reqheight()
+            bottom -= height
+            toast.geometry(f"{self.width}x{height}+{right - self.width}+{bottom}")
+            bottom -= 10
+
+
+# Notifiers that need no Tk root, by command line name
+NOTIFIERS = {
+    "log": LogNotifier,
+    "notify-send": CommandNotifier,
+}
+
+
+class ReminderPipeline:
+    """
+    Deliver due reminders in batches, coalescing the ones that come due close together.
+
+    Each tick claims up to batch_size due reminders (an index range scan, see
+    DatabaseHandler.claim_due_reminders) and hands them to the notifier as a
+    single notification, then records them as delivered. At most one
+    notification is sent per `window` seconds: reminders coming due in the
+    meantime wait in the database and go out together with the next one, so a
+    burst of reminders never floods the user.
+
+    Delivery state is stored in the database. A reminder that was delivered
+    never fires again, across restarts and processes; one whose notifier
+    failed is released and retried a window later; one claimed by a process
+    that died before delivering is claimed again once its lease ran out.
+
+    Time comes from clock (a callable returning a datetime), so a FakeClock
+    can drive the pipeline in tests.
+    """
+
+    def __init__(self, db_handler, notifier, clock=None, window=60, batch_size=100, lease_seconds=300,
+                 max_lines=5, max_idle=60):
+        """
+        Args:
+            db_handler (DatabaseHandler): The database holding the reminders
+            notifier: Object with a name and notify(Notification), e.g. ToastNotifier or LogNotifier
+            clock (callable, optional): Returns the current local time as a datetime. Defaults to datetime.now.
+            window (int, optional): Minimum seconds between two notifications. Defaults to 60.
+            batch_size (int, optional): Maximum reminders per notification. Defaults to 100.
+            lease_seconds (int, optional): How long a claim survives an undelivered notification. Defaults to 300.
+            max_lines (int, optional): Reminders listed in the body of a coalesced notification. Defaults to 5.
+            max_idle (int, optional): Longest delay suggested by next_delay, so reminders added by
+                other processes are noticed. Defaults to 60.
+        """
+        self.db_handler = db_handler
+        self.notifier = notifier
+        self.clock = clock or datetime.now
+        self.window = window
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_lines = max_lines
+        self.max_idle = max_idle
+
+        self.last_sent = None
+        self.notifications = 0
+        self.delivered = 0
+        self.failures = 0
+
+    def tick(self):
+        """
+        Send one notification for the reminders that are due, unless one was sent less than a window ago.
+
+        Returns:
+            int: Number of reminders delivered
+        """
+        now = self.clock()
+        if self.last_sent is not None and (now - self.last_sent).total_seconds() < self.window:
+            return 0
+
+        now_text = now.strftime(REMINDER_FORMAT)
+        reminders = self.db_handler.claim_due_reminders(now_text, self.batch_size, self.lease_seconds)
+        if not reminders:
+            return 0
+
+        message_ids = [reminder["id"] for reminder in reminders]
+        # Back off for a window whether or not the notifier works
+        self.last_sent = now
+        try:
+            self.notifier.notify(self.coalesce(reminders))
+        except Exception as e:
+            logger.exception("Could not deliver %d reminder(s) with %s", len(reminders), self.notifier.name)
+            self.failures += 1
+            self.db_handler.release_reminders(message_ids, str(e) or type(e).__name__)
+            return 0
+
+        self.db_handler.mark_reminders_delivered(message_ids, now_text, self.notifier.name)
+        self.notifications += 1
+        self.delivered += len(reminders)
+        return len(reminders)
+
+    def coalesce(self, reminders):
+        """Build one notification covering every reminder of a batch."""
+        if len(reminders) == 1:
+            reminder = reminders[0]
+            return Notification(f"Reminder ({reminder['project']})", self.db_handler.reveal(reminder["message"]),
+                                reminders)
+
+        projects = sorted({reminder["project"] or "main" for reminder in reminders})
+        title = f"{len(reminders)} reminders"
+        if len(projects) <= 3:
+            title += f" ({', '.join(projects)})"
+        lines = [f"• {self.shorten(self.db_handler.reveal(reminder['message']))}" for reminder in reminders[:self.max_lines]]
+        if len(reminders) > self.max_lines:
+            lines.append(f"… and {len(reminders) - self.max_lines} more")
+        return Notification(title, "\n".join(lines), reminders)
+
+    @staticmethod
+    def shorten(text, length=80):
+        text = " ".join((text or "").split())
+        return text if len(text) <= length else text[:length - 1] + "…"
+
+    def next_delay(self):
+        """
+        Return how many seconds to wait before the next tick is worth running.
+
+        Returns:
+            float: Seconds, between 0 and max_idle
+        """
+        now = self.clock()
+        delay = self.max_idle
+        next_time = self.db_handler.next_reminder_time()
+        if next_time is not None:
+            try:
+                due = datetime.strptime(next_time, REMINDER_FORMAT)
+            except ValueError:
+                due = now
+            delay = min(delay, (due - now).total_seconds())
+        if self.last_sent is not None:
+            delay = max(delay, self.window - (now - self.last_sent).total_seconds())
+        return max(0.0, min(delay, self.max_idle))
+
+    def as_dict(self):
+        return {
+            "notifications": self.notifications,
+            "reminders_delivered": self.delivered,
+            "delivery_failures": self.failures,
+        }
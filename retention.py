@@ -0,0 +1,228 @@
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Policy row that applies to every project without a policy of its own
+DEFAULT_POLICY = "*"
+
+
+class RetentionManager:
+    """
+    Move old messages to the archive database and give free pages back to the OS.
+
+    Policies say after how many days the messages of a project are archived,
+    with DEFAULT_POLICY covering the projects that have none. Messages still
+    waiting for classification or with a reminder that has not fired are never
+    archived. The work is split into small steps (step()) so it can run in the
+    idle time of the UI or between headless cycles.
+    """
+
+    def __init__(self, db_handler, compress_min_bytes=1024, batch_size=500, vacuum_pages=256):
+        """
+        Args:
+            db_handler (DatabaseHandler): The database to maintain; the archive is attached if it is not yet
+            compress_min_bytes (int, optional): Archived bodies of at least this many bytes are zlib compressed,
+                None to never compress. Defaults to 1024.
+            batch_size (int, optional): Messages archived per step. Defaults to 500.
+            vacuum_pages (int, optional): Free pages released per step. Defaults to 256.
+        """
+        self.db_handler = db_handler
+        self.compress_min_bytes = compress_min_bytes
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+
+        db_handler.attach_archive()
+        db_handler.create_table("retention_policies", {
+            "project": "TEXT PRIMARY KEY",
+            "max_age_days": "INTEGER NOT NULL"
+        })
+        # The age cutoff stops at the first recent message of a project thanks to
+        # idx_messages_project_timestamp, created by ensure_schema
+        db_handler.commit()
+
+    def set_policy(self, project, max_age_days):
+        """
+        Archive the messages of a project once they are older than max_age_days.
+
+        Args:
+            project (str): Project name, or DEFAULT_POLICY for every project without a policy
+            max_age_days (int): Age in days, or None to remove the policy (keep forever)
+        """
+        if max_age_days is None:
+            self.db_handler.cursor.execute("DELETE FROM retention_policies WHERE project = ?", (project,))
+        else:
+            self.db_handler.cursor.execute(
+                "INSERT OR REPLACE INTO retention_policies (project, max_age_days) VALUES (?, ?)",
+                (project, int(max_age_days))
+            )
+        self.db_handler.commit()
+
+    def get_policies(self):
+        """Return the policies as a {project: max_age_days} dictionary."""
+        self.db_handler.cursor.execute("SELECT project, max_age_days FROM retention_policies")
+        return dict(self.db_handler.cursor.fetchall())
+
+    def due_message_ids(self, now=None, limit=None):
+        """
+        Return the IDs of live messages that their policy says should be archived, oldest first.
+
+        Args:
+            now (datetime, optional): Reference UTC time (message timestamps are UTC). Defaults to now.
+            limit (int, optional): Maximum number of IDs. Defaults to batch_size.
+        """
+        now = now or datetime.utcnow()
+        limit = limit or self.batch_size
+        policies = self.get_policies()
+        default_days = policies.pop(DEFAULT_POLICY, None)
+
+        def cutoff(days):
+            return (now - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+        archivable = "processed = 1 AND (reminder_time IS NULL OR reminder_fired = 1)"
+        message_ids = []
+        cursor = self.db_handler.cursor
+        for project, days in policies.items():
+            cursor.execute(
+                f"""SELECT id FROM messages WHERE project = ? AND timestamp < ? AND {archivable}
+                    ORDER BY timestamp LIMIT ?""",
+                (project, cutoff(days), limit - len(message_ids))
+            )
+            message_ids.extend(row[0] for row in cursor.fetchall())
+            if len(message_ids) >= limit:
+                return message_ids
+
+        if default_days is not None:
+            cursor.execute(
+                f"""SELECT id FROM messages WHERE timestamp < ? AND {archivable}
+                    AND project NOT IN ({', '.join(['?'] * len(policies))})
+                    ORDER BY timestamp LIMIT ?""",
+                [cutoff(default_days), *policies, limit - len(message_ids)]
+            )
+            message_ids.extend(row[0] for row in cursor.fetchall())
+        return message_ids
+
+    def archive_due(self, now=None):
+        """Archive one batch of due messages. Returns the number of messages archived."""
+        message_ids = self.due_message_ids(now)
+        if not message_ids:
+            return 0
+        return self.db_handler.archive_messages(message_ids, self.compress_min_bytes)
+
+    def free_pages(self):
+        """Return the number of free pages in the live and archive databases."""
+        cursor = self.db_handler.cursor
+        cursor.execute("PRAGMA main.freelist_count")
+        count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA archive.freelist_count")
+        return count + cursor.fetchone()[0]
+
+    def incremental_vacuum(self, max_pages=None):
+        """
+        Release up to max_pages free pages of each database file to the OS.
+
+        Does nothing for a database created without auto_vacuum = INCREMENTAL (new files get it from
+        DatabaseHandler.init_db; older ones need enable_incremental_vacuum).
+
+        Returns:
+            int: Number of pages released
+        """
+        max_pages = max_pages or self.vacuum_pages
+        before = self.free_pages()
+        cursor = self.db_handler.cursor
+        for schema in ("main", "archive"):
+            # The pragma frees pages while its rows are stepped through
+            cursor.execute(f"PRAGMA {schema}.incremental_vacuum({int(max_pages)})").fetchall()
+        self.db_handler.commit()
+        return before - self.free_pages()
+
+    def enable_incremental_vacuum(self):
+        """
+        Switch the live database to auto_vacuum = INCREMENTAL.
+
+        Existing databases need a full VACUUM for the setting to take effect,
+        which rewrites the whole file, so this is a one-off command-line step
+        rather than something done at startup.
+
+        Returns:
+            bool: True if the database had to be vacuumed
+        """
+        cursor = self.db_handler.cursor
+        cursor.execute("PRAGMA main.auto_vacuum")
+        if cursor.fetchone()[0] == 2:
+            return False
+        self.db_handler.commit()
+        cursor.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM main")
+        return True
+
+    def step(self, now=None):
+        """
+        Do one bounded unit of maintenance: archive a batch, or else release free pages.
+
+        Returns:
+            bool: True if there is more work to do right away
+        """
+        archived = self.archive_due(now)
+        if archived:
+            logger.info("Archived %d messages", archived)
+            return True
+        return self.incremental_vacuum() > 0
+
+    def run(self, now=None):
+        """
+        Archive everything that is due and release all free pages.
+
+        Returns:
+            int: Number of messages archived
+        """
+        total = 0
+        while True:
+            archived = self.archive_due(now)
+            if not archived:
+                break
+            total += archived
+        while self.incremental_vacuum() > 0:
+            pass
+        return total
+
+
+def parse_policy(value):
+    """Parse a PROJECT=DAYS command line value."""
+    project, sep, days = value.rpartition("=")
+    if not sep or not project:
+        raise ValueError(f"Expected PROJECT=DAYS, got {value!r}")
+    return project, int(days)
+
+
+def add_arguments(parser):
+    """Add the archive options to an argparse parser."""
+    parser.add_argument("--default-days", type=int, default=None,
+                        help="Archive messages of projects without a policy after this many days")
+    parser.add_argument("--policy", action="append", default=[], metavar="PROJECT=DAYS",
+                        help="Archive messages of PROJECT after DAYS days (repeatable)")
+    parser.add_argument("--compress-min-bytes", type=int, default=1024,
+                        help="Compress archived bodies of at least this many bytes")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Switch the database to incremental vacuum (runs a full VACUUM once)")
+
+
+def run_from_args(args):
+    """Store the given policies, then archive everything that is due."""
+    from database_utils import DatabaseHandler
+
+    db_handler = DatabaseHandler(args.db)
+    db_handler.ensure_schema()
+    try:
+        manager = RetentionManager(db_handler, compress_min_bytes=args.compress_min_bytes)
+        if args.default_days is not None:
+            manager.set_policy(DEFAULT_POLICY, args.default_days)
+        for value in args.policy:
+            manager.set_policy(*parse_policy(value))
+        if args.enable_incremental_vacuum and manager.enable_incremental_vacuum():
+            print("Database vacuumed, incremental vacuum enabled")
+
+        archived = manager.run()
+        print(f"Archived {archived} messages, policies: {manager.get_policies()}")
+    finally:
+        db_handler.close()
@@ -0,0 +1,371 @@
+import hashlib
+import os
+import re
+from collections import defaultdict
+
+import numpy as np
+
+from database_utils import MessageInserted, MessageDeleted
+from model_router import is_local
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class LocalEmbedder:
+    """
+    Deterministic offline embedder based on feature hashing.
+
+    Words and word pairs are hashed into a fixed number of signed buckets. It
+    knows nothing about meaning, but texts sharing vocabulary end up close, it
+    needs no network and always gives the same vectors (useful for tests).
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"local-hash-{dim}"
+
+    def _features(self, text):
+        words = _TOKEN_RE.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        """
+        Embed a list of texts.
+
+        Returns:
+            numpy.ndarray: float32 array of shape (len(texts), dim), rows L2-normalized
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text or ""):
+                h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        return _normalize(vectors)
+
+
+class GeminiEmbedder:
+    """Embedder backed by the Gemini embedding API through GeminiHandler.embed_texts."""
+
+    def __init__(self, gemini_handler, model="text-embedding-004"):
+        self.gemini_handler = gemini_handler
+        self.model = model
+        self.name = f"gemini-{model}"
+
+    def embed(self, texts):
+        """Embed a list of texts. Returns a float32 array with L2-normalized rows."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = np.asarray(self.gemini_handler.embed_texts(texts, model=self.model), dtype=np.float32)
+        return _normalize(vectors)
+
+
+def build_embedder(gemini_handler=None):
+    """
+    Pick the embedder of an index: Gemini embeddings when the API can be reached, LocalEmbedder when offline.
+
+    Args:
+        gemini_handler (GeminiHandler, optional): Handler whose routed 'embed' model is used
+
+    Returns:
+        GeminiEmbedder or LocalEmbedder
+    """
+    if gemini_handler is not None:
+        model = gemini_handler.router.default_model("embed")
+        # A local embed model is answered by LocalEmbedder anyway; using it directly keeps its stored vectors
+        if not is_local(model) and gemini_handler.can_reach(model):
+            return GeminiEmbedder(gemini_handler, model)
+    return LocalEmbedder()
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class SemanticIndex:
+    """
+    Brute-force cosine-similarity index over message embeddings.
+
+    Embeddings are the source of truth in SQLite (message_embeddings, float32
+    blobs). For querying they are also written to a .npy matrix next to the
+    database that is memory-mapped, so opening the index costs no parsing and
+    the OS pages vectors in as needed. Inserts and deletes are applied
+    incrementally: new vectors go to an in-memory delta and deleted IDs are
+    masked, until compact() rewrites the matrix.
+
+    Database events only queue their message; the queue is embedded and
+    committed in one batch by flush(), which search() and sync() call, so
+    inserting a message never waits for the embedder.
+    """
+
+    def __init__(self, db_handler, embedder, index_path=None, compact_threshold=1000, flush_threshold=256):
+        """
+        Args:
+            db_handler (DatabaseHandler): The database whose messages are indexed
+            embedder: LocalEmbedder, GeminiEmbedder or any object with name and embed(texts)
+            index_path (str, optional): Prefix of the matrix files. Defaults to next to the database.
+            compact_threshold (int, optional): Pending inserts/deletes before compact() runs. Defaults to 1000.
+            flush_threshold (int, optional): Queued events before they are flushed without a search. Defaults to 256.
+        """
+        self.db_handler = db_handler
+        self.embedder = embedder
+        self.index_path = index_path or f"{db_handler.db_name}.{embedder.name}"
+        self.compact_threshold = compact_threshold
+        self.flush_threshold = flush_threshold
+
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.vectors = None
+        self.delta_ids = []
+        self.delta_vectors = []
+        self.deleted = set()
+        self.loaded = False
+        # message ID -> stored text of messages inserted since the last flush, None for deleted ones
+        self.queued = {}
+
+        self.db_handler.create_table("message_embeddings", {
+            "message_id": "INTEGER NOT NULL",
+            "model": "TEXT NOT NULL",
+            "vector": "BLOB NOT NULL",
+            "PRIMARY KEY": "(message_id, model)"
+        })
+
+    def subscribe(self):
+        """Keep the index up to date with messages inserted or deleted in this process."""
+        self.db_handler.subscribe(self.on_database_change, MessageInserted, MessageDeleted)
+
+    def on_database_change(self, event):
+        if isinstance(event, MessageInserted):
+            if event.message is None:
+                return
+            self.queued[event.message['id']] = event.message['message']
+        else:
+            self.queued[event.message_id] = None
+        if len(self.queued) >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        """Embed the queued inserts in one embedder call and apply them and the queued deletes in one commit."""
+        if not self.queued:
+            return
+        queued, self.queued = self.queued, {}
+        inserted = [(message_id, text) for message_id, text in queued.items() if text is not None]
+        removed = [message_id for message_id, text in queued.items() if text is None]
+
+        if removed:
+            self.db_handler.cursor.executemany("DELETE FROM message_embeddings WHERE message_id = ?",
+                                               [(message_id,) for message_id in removed])
+        if inserted:
+            vectors = self.embedder.embed([self.db_handler.reveal(text) for _, text in inserted])
+            self._store([message_id for message_id, _ in inserted], vectors)
+        self.db_handler.commit()
+
+        self.deleted.update(removed)
+        for (message_id, _), vector in zip(inserted, vectors if inserted else ()):
+            self.deleted.discard(message_id)
+            self.delta_ids.append(message_id)
+            self.delta_vectors.append(vector)
+        self._maybe_compact()
+
+    def sync(self, batch_size=256, progress=None):
+        """
+        Embed every message that has no vector yet, drop vectors of deleted messages and load the index.
+
+        The matrix file is only rewritten when something changed, so calling this
+        periodically (e.g. once per headless cycle) is cheap.
+
+        Args:
+            batch_size (int, optional): Texts per embedder call. Defaults to 256.
+            progress (callable, optional): Called with the number of messages embedded so far
+        """
+        # The queued messages are caught up with below, straight from the database
+        self.queued = {}
+        model = self.embedder.name
+        cursor = self.db_handler.cursor
+        cursor.execute(
+            """DELETE FROM message_embeddings WHERE model = ?
+               AND message_id NOT IN (SELECT id FROM messages)""",
+            (model,)
+        )
+        changed = cursor.rowcount > 0
+        cursor.execute(
+            """SELECT id, message FROM messages WHERE id NOT IN
+               (SELECT message_id FROM message_embeddings WHERE model = ?) ORDER BY id""",
+            (model,)
+        )
+        missing = cursor.fetchall()
+
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            self._store([message_id for message_id, _ in batch],
+                        self.embedder.embed([self.db_handler.reveal(text) for _, text in batch]))
+            if progress:
+                progress(start + len(batch))
+        self.db_handler.commit()
+
+        if changed or missing or self.delta_ids or self.deleted:
+            self._write_matrix()
+        self.load()
+
+    def load(self):
+        """Memory-map the matrix files, rebuilding them if they are missing."""
+        if not os.path.exists(self._ids_file) or not os.path.exists(self._vectors_file):
+            self._write_matrix()
+        self.ids = np.load(self._ids_file)
+        self.vectors = np.load(self._vectors_file, mmap_mode="r")
+        self.delta_ids = []
+        self.delta_vectors = []
+        self.deleted = set()
+        self.loaded = True
+
+    def ensure_loaded(self):
+        """Sync and load the index the first time it is needed."""
+        if not self.loaded:
+            self.sync()
+
+    def add(self, message_id, text):
+        """Embed and index a new message."""
+        vector = self.embedder.embed([text])
+        self._store([message_id], vector)
+        self.db_handler.commit()
+        self.deleted.discard(message_id)
+        self.delta_ids.append(message_id)
+        self.delta_vectors.append(vector[0])
+        self._maybe_compact()
+
+    def remove(self, message_id):
+        """Remove a message from the index."""
+        self.db_handler.cursor.execute("DELETE FROM message_embeddings WHERE message_id = ?", (message_id,))
+        self.db_handler.commit()
+        self.deleted.add(message_id)
+        self._maybe_compact()
+
+    def compact(self):
+        """Fold pending inserts and deletes into the memory-mapped matrix."""
+        self._write_matrix()
+        self.load()
+
+    def search(self, query, k=10, exclude=None):
+        """
+        Find the messages most similar to a text or a vector.
+
+        Args:
+            query (str or numpy.ndarray): Text to embed, or an already normalized vector
+            k (int, optional): Number of results. Defaults to 10.
+            exclude (set, optional): Message IDs to leave out of the results
+
+        Returns:
+            list: (message_id, cosine similarity) pairs, best first
+        """
+        self.ensure_loaded()
+        self.flush()
+        vector = self.embedder.embed([query])[0] if isinstance(query, str) else query
+
+        ids = self.ids
+        scores = self.vectors @ vector if len(ids) else np.zeros(0, dtype=np.float32)
+        if self.delta_ids:
+            ids = np.concatenate([ids, np.asarray(self.delta_ids, dtype=np.int64)])
+            scores = np.concatenate([scores, np.asarray(self.delta_vectors) @ vector])
+
+        skip = self.deleted | set(exclude or ())
+        if skip:
+            mask = ~np.isin(ids, np.fromiter(skip, dtype=np.int64))
+            ids, scores = ids[mask], scores[mask]
+        if not len(ids):
+            return []
+
+        # A message restored by undo can be both in the matrix and in the delta
+        n = min(k + len(self.delta_ids), len(ids))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        seen = set()
+        for i in top:
+            message_id = int(ids[i])
+            if message_id not in seen:
+                seen.add(message_id)
+                results.append((message_id, float(scores[i])))
+        return results[:k]
+
+    def similar_to(self, message_id, k=10):
+        """Find the messages most similar to a stored message (the message itself is excluded)."""
+        msg = self.db_handler.get_message(message_id)
+        if msg is None:
+            return []
+        return self.search(self.db_handler.reveal(msg['message']), k, exclude={message_id})
+
+    def suggest_project(self, text, k=10, min_score=0.3):
+        """
+        Suggest a project for a text from the projects of its nearest neighbours.
+
+        Neighbours still in the global chat ('main') do not vote.
+
+        Returns:
+            tuple: (project, summed similarity) of the best project, or None
+        """
+        neighbours = [(message_id, score) for message_id, score in self.search(text, k) if score >= min_score]
+        if not neighbours:
+            return None
+
+        votes = defaultdict(float)
+        for msg in self.db_handler.get_messages_by_ids([message_id for message_id, _ in neighbours]):
+            if msg.project and msg.project != "main":
+                votes[msg.project] += dict(neighbours)[msg.id]
+        if not votes:
+            return None
+        return max(votes.items(), key=lambda item: item[1])
+
+    @property
+    def _ids_file(self):
+        return self.index_path + ".ids.npy"
+
+    @property
+    def _vectors_file(self):
+        return self.index_path + ".vectors.npy"
+
+    def _store(self, message_ids, vectors):
+        self.db_handler.cursor.executemany(
+            "INSERT OR REPLACE INTO message_embeddings (message_id, model, vector) VALUES (?, ?, ?)",
+            [(message_id, self.embedder.name, vector.astype(np.float32).tobytes())
+             for message_id, vector in zip(message_ids, vectors)]
+        )
+
+    def _write_matrix(self):
+        cursor = self.db_handler.conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM message_embeddings WHERE model = ?", (self.embedder.name,))
+        count = cursor.fetchone()[0]
+
+        # Release the old mapping before the file is replaced
+        self.vectors = None
+
+        # Stream the blobs straight into a memory-mapped file instead of building the matrix in memory
+        ids = np.zeros(count, dtype=np.int64)
+        dim = getattr(self.embedder, "dim", None)
+        vectors = None
+        tmp_vectors = self._vectors_file + ".tmp.npy"
+
+        cursor.execute(
+            "SELECT message_id, vector FROM message_embeddings WHERE model = ? ORDER BY message_id",
+            (self.embedder.name,)
+        )
+        for row, (message_id, blob) in enumerate(cursor):
+            vector = np.frombuffer(blob, dtype=np.float32)
+            if vectors is None:
+                dim = len(vector)
+                vectors = np.lib.format.open_memmap(tmp_vectors, mode="w+", dtype=np.float32, shape=(count, dim))
+            ids[row] = message_id
+            vectors[row] = vector
+        cursor.close()
+
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(tmp_vectors, mode="w+", dtype=np.float32, shape=(0, dim or 0))
+        vectors.flush()
+        del vectors
+
+        np.save(self._ids_file, ids)
+        os.replace(tmp_vectors, self._vectors_file)
+
+    def _maybe_compact(self):
+        if self.loaded and len(self.delta_ids) + len(self.deleted) >= self.compact_threshold:
+            self.compact()
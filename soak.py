@@ -0,0 +1,394 @@
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tkinter as tk
+
+logger = logging.getLogger(__name__)
+
+# Relative frequency of each kind of synthetic action
+DEFAULT_WEIGHTS = {
+    "send_text": 10,
+    "send_image": 2,
+    "delete": 3,
+    "move": 2,
+    "search": 1,
+    "switch_tab": 2,
+}
+
+
+def rss_bytes():
+    """Resident set size of this process, or the peak RSS where the current one is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def count_widgets(widget):
+    """Number of widgets in the tree under widget, itself included."""
+    count = 1
+    stack = list(widget.winfo_children())
+    while stack:
+        child = stack.pop()
+        count += 1
+        stack.extend(child.winfo_children())
+    return count
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def start_virtual_display():
+    """
+    Start Xvfb when there is no display, so the harness can run on a headless machine.
+
+    Returns:
+        subprocess.Popen: The Xvfb process to terminate at the end, or None if a display was already set
+    """
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        return None
+    if shutil.which("Xvfb") is None:
+        raise RuntimeError("No DISPLAY and Xvfb is not installed; run under xvfb-run or install Xvfb")
+    display = f":{random.randint(100, 999)}"
+    process = subprocess.Popen(["Xvfb", display, "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0)
+    os.environ["DISPLAY"] = display
+    return process
+
+
+class SoakHarness:
+    """
+    Drive a ReminderApp with synthetic traffic for a long time and record how it holds up.
+
+    Actions (sending text and image messages, deleting, moving, searching,
+    switching tabs) go through the same UIManager methods and dialogs a user
+    triggers. Confirmation and info boxes are answered automatically. Another
+    connection writes to the database now and then, so the refresh scheduler
+    reloads views the way it does when the headless runner is active.
+
+    Every sample_interval seconds it records the event-loop latency (how late
+    after() callbacks run), the number of live widgets, the size of
+    message_widgets, the rows actually shown and the RSS; analyze() then
+    flags growth that points at a leak or at per-message work.
+    """
+
+    def __init__(self, app, rate=2.0, duration=600.0, sample_interval=10.0, probe_interval=100,
+                 external_interval=5.0, weights=None, output=None, seed=0):
+        """
+        Args:
+            app (ReminderApp): The application to drive
+            rate (float, optional): Average synthetic actions per second. Defaults to 2.0.
+            duration (float, optional): Seconds to run. Defaults to 600.
+            sample_interval (float, optional): Seconds between samples. Defaults to 10.
+            probe_interval (int, optional): Milliseconds between event-loop latency probes. Defaults to 100.
+            external_interval (float, optional): Seconds between writes from another connection, 0 for none.
+                Defaults to 5.
+            weights (dict, optional): Action name -> relative frequency. Defaults to DEFAULT_WEIGHTS.
+            output (str, optional): Append every sample as a JSON line to this file.
+            seed (int, optional): Seed of the traffic generator. Defaults to 0.
+        """
+        self.app = app
+        self.ui = app.ui_manager
+        self.root = app.root
+        self.rate = rate
+        self.duration = duration
+        self.sample_interval = sample_interval
+        self.probe_interval = probe_interval
+        self.external_interval = external_interval
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.output = output
+        self.random = random.Random(seed)
+
+        self.samples = []
+        self.latencies = []
+        self.actions = dict.fromkeys(self.weights, 0)
+        self.action_errors = 0
+        self.started_at = None
+        self.image_dir = tempfile.mkdtemp(prefix="soak-images-")
+        self.images = []
+        self.external_db = None
+
+    def run(self):
+        """Run the soak test until duration has passed. Returns the samples."""
+        self._patch_dialogs()
+        self._make_images()
+        if self.external_interval:
+            from database_utils import DatabaseHandler
+
+            self.external_db = DatabaseHandler(self.ui.db_handler.db_name)
+
+        self.started_at = time.monotonic()
+        self._probe()
+        self.root.after(0, self._next_action)
+        self.root.after(int(self.sample_interval * 1000), self._sample)
+        if self.external_db is not None:
+            self.root.after(int(self.external_interval * 1000), self._external_write)
+        self.root.after(int(self.duration * 1000), self.root.quit)
+        try:
+            self.root.mainloop()
+        finally:
+            self._sample(reschedule=False)
+            if self.external_db is not None:
+                self.external_db.close()
+            shutil.rmtree(self.image_dir, ignore_errors=True)
+        return self.samples
+
+    # Synthetic traffic
+
+    def _next_action(self):
+        names = list(self.weights)
+        name = self.random.choices(names, [self.weights[n] for n in names])[0]
+        try:
+            getattr(self, f"action_{name}")()
+            self.actions[name] += 1
+        except Exception:
+            self.action_errors += 1
+            logger.exception("Soak action %s failed", name)
+        delay = self.random.expovariate(self.rate) if self.rate > 0 else 1.0
+        self.root.after(max(1, int(delay * 1000)), self._next_action)
+
+    def action_send_text(self):
+        entry, is_global = self._visible_entry()
+        entry.delete(0, tk.END)
+        entry.insert(0, f"soak note {self.random.getrandbits(32):08x} " + "lorem ipsum " * self.random.randint(0, 20))
+        self.ui.send_message(is_global=is_global)
+
+    def action_send_image(self):
+        _, is_global = self._visible_entry()
+        self.ui.current_file_path = self.random.choice(self.images)
+        self.ui.current_file_type = "image"
+        self.ui.send_message(is_global=is_global)
+
+    def action_delete(self):
+        message_id = self._random_stored_message()
+        if message_id is not None:
+            self.ui.delete_message(message_id, self.ui.message_widgets.get(message_id))
+
+    def action_move(self):
+        message_id = self._random_stored_message()
+        if message_id is None:
+            return
+        self.ui.change_message_project(message_id)
+        dialog = self._newest_dialog()
+        entry = self._find(dialog, lambda w: w.winfo_class() == "TEntry")
+        entry.insert(0, self.random.choice(["soak-a", "soak-b", "soak-c"]))
+        self._find(dialog, lambda w: w.winfo_class() == "TButton" and w.cget("text") == "Submit").invoke()
+        if dialog.winfo_exists():
+            dialog.destroy()
+
+    def action_search(self):
+        self.ui.search_messages()
+        dialog = self._newest_dialog()
+        entry = self._find(dialog, lambda w: w.winfo_class() == "TEntry")
+        entry.insert(0, self.random.choice(["soak", "lorem", "image", "nothing-matches"]))
+        self._find(dialog, lambda w: w.winfo_class() == "TButton" and w.cget("text") == "Search").invoke()
+        dialog.destroy()
+
+    def action_switch_tab(self):
+        projects = self.ui.project_tree.top_level()
+        if projects and self.random.random() < 0.5:
+            self.ui.open_project(self.random.choice(projects))
+        else:
+            self.ui.pages.select(self.random.choice([0, 1]))
+
+    def _external_write(self):
+        """Insert a message from another connection, like the headless runner or a second window."""
+        self.external_db.insert_message("soak-external", f"external note {time.time():.0f}")
+        self.root.after(int(self.external_interval * 1000), self._external_write)
+
+    def _visible_entry(self):
+        if self.ui.pages.index(self.ui.pages.select()) == 2 and self.ui.current_project != "main":
+            return self.ui.entry, False
+        return self.ui.global_entry, True
+
+    def _random_stored_message(self):
+        stored = [message_id for message_id, frame in self.ui.message_widgets.items()
+                  if message_id > 0 and frame.winfo_exists()]
+        return self.random.choice(stored) if stored else None
+
+    def _newest_dialog(self):
+        dialogs = [w for w in self.root.winfo_children() if isinstance(w, tk.Toplevel)]
+        if not dialogs:
+            raise RuntimeError("No dialog was opened")
+        dialog = dialogs[-1]
+        dialog.update_idletasks()
+        return dialog
+
+    @staticmethod
+    def _find(parent, predicate):
+        stack = list(parent.winfo_children())
+        while stack:
+            widget = stack.pop(0)
+            if predicate(widget):
+                return widget
+            stack.extend(widget.winfo_children())
+        raise LookupError("Widget not found")
+
+    def _patch_dialogs(self):
+        """Answer modal message boxes right away and skip grabs, since nobody is there to click."""
+        import ui_manager
+
+        box = ui_manager.messagebox
+        box.askyesno = lambda *args, **kwargs: True
+        box.showinfo = box.showerror = box.showwarning = lambda *args, **kwargs: "ok"
+        # A grab fails on a dialog that is not mapped yet, and would block the next actions anyway
+        tk.Toplevel.grab_set = lambda self: None
+
+    def _make_images(self):
+        from PIL import Image
+
+        for i, color in enumerate(["red", "green", "blue", "orange"]):
+            path = os.path.join(self.image_dir, f"soak-{i}.png")
+            Image.new("RGB", (640, 480), color).save(path)
+            self.images.append(path)
+
+    # Measurements
+
+    def _probe(self):
+        scheduled = time.monotonic()
+
+        def fired():
+            self.latencies.append((time.monotonic() - scheduled) * 1000 - self.probe_interval)
+            self._probe()
+
+        self.root.after(self.probe_interval, fired)
+
+    def _sample(self, reschedule=True):
+        ui = self.ui
+        latencies, self.latencies = self.latencies, []
+        sample = {
+            "elapsed": round(time.monotonic() - self.started_at, 1),
+            "actions": sum(self.actions.values()),
+            "action_errors": self.action_errors,
+            "latency_ms_p50": round(percentile(latencies, 0.5), 2),
+            "latency_ms_p99": round(percentile(latencies, 0.99), 2),
+            "latency_ms_max": round(max(latencies, default=0.0), 2),
+            "widgets": count_widgets(self.root),
+            "message_widgets": len(ui.message_widgets),
+            # Rows kept for reuse are unpacked, so only packed rows are shown
+            "rows_shown": sum(1 for frame in (ui.global_messages_frame, ui.messages_frame)
+                              for row in frame.winfo_children() if row.winfo_manager()),
+            "pending_messages": len(ui.pending_messages),
+            "rss_mb": round(rss_bytes() / 2 ** 20, 1),
+        }
+        if hasattr(ui, "debug_counters"):
+            sample.update(ui.debug_counters())
+        self.samples.append(sample)
+        logger.info("%s", sample)
+        if self.output:
+            with open(self.output, "a") as f:
+                f.write(json.dumps(sample) + "\n")
+        if reschedule:
+            self.root.after(int(self.sample_interval * 1000), self._sample)
+
+
+def analyze(samples, max_rss_growth_mb_per_hour=50.0, max_latency_growth=5.0, min_latency_ms=50.0):
+    """
+    Look for leaks and per-message slowdowns in soak samples.
+
+    Compares the first and last quarter of the run, so warm-up does not count.
+
+    Returns:
+        list: Descriptions of the problems found, empty if the run looks healthy
+    """
+    if len(samples) < 8:
+        return []
+    quarter = len(samples) // 4
+    first, last = samples[:quarter], samples[-quarter:]
+
+    def mean(values):
+        return sum(values) / len(values)
+
+    problems = []
+    final = samples[-1]
+    # Every tracked row must still be on screen; anything more is a stale reference
+    if final["message_widgets"] > final["rows_shown"] + final["pending_messages"] + 10:
+        problems.append(f"message_widgets holds {final['message_widgets']} rows "
+                        f"but only {final['rows_shown']} are shown")
+
+    def widgets_per_row(sample):
+        # Pooled rows hold widgets too, up to a fixed limit
+        return sample["widgets"] / max(1, sample["rows_shown"] + sample.get("pooled_rows", 0))
+
+    widgets_per_row_first = mean([widgets_per_row(s) for s in first])
+    widgets_per_row_last = mean([widgets_per_row(s) for s in last])
+    if widgets_per_row_last > widgets_per_row_first * 1.5 + 5:
+        problems.append(f"widgets per shown row grew from {widgets_per_row_first:.1f} to {widgets_per_row_last:.1f}")
+
+    hours = (mean([s["elapsed"] for s in last]) - mean([s["elapsed"] for s in first])) / 3600
+    if hours > 0:
+        growth = (mean([s["rss_mb"] for s in last]) - mean([s["rss_mb"] for s in first])) / hours
+        if growth > max_rss_growth_mb_per_hour:
+            problems.append(f"RSS grows by {growth:.0f} MB per hour")
+
+    latency_first = mean([s["latency_ms_p99"] for s in first])
+    latency_last = mean([s["latency_ms_p99"] for s in last])
+    if latency_last > min_latency_ms and latency_last > max_latency_growth * max(latency_first, 1.0):
+        problems.append(f"event-loop p99 latency grew from {latency_first:.0f} ms to {latency_last:.0f} ms")
+
+    if final["action_errors"]:
+        problems.append(f"{final['action_errors']} synthetic actions raised")
+    return problems
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Soak-test the Tk UI with synthetic traffic")
+    parser.add_argument("--db", default=None, help="Database to use (default: a new temporary one)")
+    parser.add_argument("--duration", type=float, default=600, help="Seconds to run")
+    parser.add_argument("--rate", type=float, default=2.0, help="Synthetic actions per second")
+    parser.add_argument("--sample-interval", type=float, default=10.0, help="Seconds between samples")
+    parser.add_argument("--external-interval", type=float, default=5.0,
+                        help="Seconds between writes from another connection (0 for none)")
+    parser.add_argument("--output", default=None, help="Append the samples as JSON lines to this file")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the traffic generator")
+    parser.add_argument("--max-rss-growth", type=float, default=50.0, help="Tolerated RSS growth in MB per hour")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    display = start_virtual_display()
+    work_dir = None
+    try:
+        from app import ReminderApp
+
+        db_name = args.db
+        if db_name is None:
+            work_dir = tempfile.mkdtemp(prefix="soak-")
+            db_name = os.path.join(work_dir, "soak.db")
+        app = ReminderApp(db_name)
+        harness = SoakHarness(app, rate=args.rate, duration=args.duration, sample_interval=args.sample_interval,
+                              external_interval=args.external_interval, output=args.output, seed=args.seed)
+        samples = harness.run()
+        app.ui_manager.on_closing()
+
+        problems = analyze(samples, max_rss_growth_mb_per_hour=args.max_rss_growth)
+        print(json.dumps({"actions": harness.actions, "final": samples[-1] if samples else None,
+                          "problems": problems}, indent=2))
+        return 1 if problems else 0
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if display is not None:
+            display.terminate()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
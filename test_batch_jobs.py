@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+from batch_jobs import BatchClassifier, LocalBatchService, LocalRequestBuilder, null_responder
+
+
+def project_responder(request):
+    """Put every message in project 'errands', with a reminder for the ones mentioning 'tomorrow'."""
+    answer = json.loads(null_responder(request))
+    prompt = request["contents"][0]["parts"][0]["text"].split("messages:", 1)[-1]
+    lines = {int(line.split(".", 1)[0]): line for line in prompt.strip().splitlines() if line[:1].isdigit()}
+    for entry in answer["messages"]:
+        entry["project"] = "errands"
+        if "tomorrow" in lines[entry["index of the message"]]:
+            entry["reminder time"] = "2026-01-02 09:00:00"
+    return json.dumps(answer)
+
+
+def make_classifier(db_handler, tmp_path, responder=project_responder, chunk_size=16384):
+    service = LocalBatchService(str(tmp_path / "jobs"), responder)
+    return BatchClassifier(db_handler, LocalRequestBuilder(), service, str(tmp_path / "requests"),
+                           chunk_size=chunk_size)
+
+
+def states(db_handler):
+    db_handler.cursor.execute("SELECT id, processed, project, reminder_time FROM messages ORDER BY id")
+    return {row[0]: row[1:] for row in db_handler.cursor.fetchall()}
+
+
+def job_states(db_handler):
+    db_handler.cursor.execute("SELECT state FROM batch_jobs ORDER BY id")
+    return [row[0] for row in db_handler.cursor.fetchall()]
+
+
+def test_submit_poll_ingest(db_handler, tmp_path):
+    first = db_handler.insert_message("You", "buy milk tomorrow")
+    second = db_handler.insert_message("You", "pick up the parcel")
+    classifier = make_classifier(db_handler, tmp_path)
+
+    job_id = classifier.submit()
+    assert job_states(db_handler) == ["submitted"]
+    assert {state[0] for state in states(db_handler).values()} == {-1}
+
+    assert classifier.poll() == 0
+    assert job_states(db_handler) == ["applied"]
+    assert states(db_handler) == {
+        first: (1, "errands", "2026-01-02 09:00:00"),
+        second: (1, "errands", None),
+    }
+    assert classifier.submit() is None
+    assert job_id is not None
+
+
+def test_error_line_releases_its_chunk(db_handler, tmp_path):
+    ids = [db_handler.insert_message("You", f"note {i} " + "x" * 60) for i in range(6)]
+    ids.append(db_handler.insert_message("You", "poison " + "x" * 60))
+
+    def responder(request):
+        if "poison" in request["contents"][0]["parts"][0]["text"].split("messages:", 1)[-1]:
+            raise RuntimeError("model refused")
+        return project_responder(request)
+
+    # Small chunks, so only the chunk holding the poisoned message fails
+    classifier = make_classifier(db_handler, tmp_path, responder, chunk_size=200)
+    classifier.submit()
+    assert classifier.poll() == 0
+
+    db_handler.cursor.execute("SELECT chunks, state, error FROM batch_jobs")
+    chunks, state, error = db_handler.cursor.fetchone()
+    poisoned = next(chunk for chunk in json.loads(chunks).values() if ids[-1] in chunk)
+    assert state == "applied" and error == f"{len(poisoned)} messages released"
+
+    after = states(db_handler)
+    for message_id in ids:
+        if message_id in poisoned:
+            assert after[message_id] == (0, "main", None)
+        else:
+            assert after[message_id][:2] == (1, "errands")
+
+
+def test_prepared_job_is_submitted_by_the_next_poll(db_handler, tmp_path):
+    message_id = db_handler.insert_message("You", "book flights")
+    crashed = make_classifier(db_handler, tmp_path)
+    # The process dies after writing the request file, before the job was submitted
+    crashed._submit = lambda job_id, request_path: None
+    crashed.submit()
+    assert job_states(db_handler) == ["prepared"]
+
+    resumed = make_classifier(db_handler, tmp_path)
+    assert resumed.poll() == 0
+    assert job_states(db_handler) == ["applied"]
+    assert states(db_handler)[message_id] == (1, "errands", None)
+
+
+def test_ingest_is_atomic(db_handler, tmp_path):
+    message_id = db_handler.insert_message("You", "renew passport")
+    classifier = make_classifier(db_handler, tmp_path)
+    classifier.submit()
+
+    real_apply = db_handler.apply_classifications
+
+    def apply_then_crash(classifications, table_name="messages"):
+        real_apply(classifications, table_name)
+        raise RuntimeError("crash before the job is marked applied")
+
+    db_handler.apply_classifications = apply_then_crash
+    with pytest.raises(RuntimeError):
+        classifier.poll()
+    assert job_states(db_handler) == ["submitted"]
+    assert states(db_handler)[message_id] == (-1, "main", None)
+
+    # The next poll applies the results once
+    db_handler.apply_classifications = real_apply
+    assert classifier.poll() == 0
+    assert job_states(db_handler) == ["applied"]
+    assert states(db_handler)[message_id] == (1, "errands", None)
+
+
+def test_short_lease_claimer_leaves_batch_claims_alone(db_handler, tmp_path):
+    batched = db_handler.insert_message("You", "file the tax return")
+    classifier = make_classifier(db_handler, tmp_path)
+    classifier.submit()
+
+    # A headless runner with the default 10 minute lease, an hour later
+    db_handler.cursor.execute("UPDATE messages SET claimed_at = datetime(claimed_at, '-1 hour')")
+    db_handler.commit()
+    fresh = db_handler.insert_message("You", "call the bank")
+    assert [msg["id"] for msg in db_handler.claim_unprocessed_messages(10, lease_seconds=600)] == [fresh]
+
+    # Once the batch lease itself has run out, the message is up for grabs again
+    db_handler.cursor.execute("UPDATE messages SET claimed_until = datetime('now', '-1 second') WHERE id = ?",
+                              (batched,))
+    db_handler.commit()
+    assert [msg["id"] for msg in db_handler.claim_unprocessed_messages(10, lease_seconds=600)] == [batched]
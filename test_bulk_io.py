@@ -0,0 +1,94 @@
+import pytest
+
+from bulk_io import export_table, import_file, import_rows
+from database_utils import DatabaseHandler
+
+
+def make_handler(path):
+    handler = DatabaseHandler(str(path))
+    handler.ensure_schema()
+    return handler
+
+
+@pytest.fixture
+def source(tmp_path):
+    handler = make_handler(tmp_path / "source.db")
+    handler.create_project("work")
+    handler.insert_messages([
+        {"sender": "You", "message": "plain note"},
+        {"sender": "Bot", "message": "with, a comma \"and quotes\"\nand a newline", "project": "work"},
+        {"sender": "You", "message": "", "project": "work", "reminder_time": "2026-01-02 09:00:00"},
+    ])
+    yield handler
+    handler.close()
+
+
+def rows(handler, columns="sender, message, project, reminder_time"):
+    handler.cursor.execute(f"SELECT {columns} FROM messages ORDER BY id")
+    return handler.cursor.fetchall()
+
+
+@pytest.mark.parametrize("suffix", ["jsonl", "csv"])
+def test_export_import_round_trip(source, tmp_path, suffix):
+    path = str(tmp_path / f"messages.{suffix}")
+    assert export_table(source, "messages", path) == 3
+
+    target = make_handler(tmp_path / f"target-{suffix}.db")
+    assert import_file(target, "messages", path, keep_ids=True) == 3
+    assert rows(target) == rows(source)
+    # NULL and '' are told apart, also in CSV
+    assert rows(target, "reminder_time")[:2] == [(None,), (None,)]
+    assert rows(target, "message")[2] == ("",)
+    # Projects of imported messages are created, and the dropped indexes are back
+    assert "work" in target.get_projects()
+    target.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'idx_messages_project'")
+    assert target.cursor.fetchone() is not None
+    target.close()
+
+
+def test_failed_import_leaves_nothing_behind(tmp_path):
+    target = make_handler(tmp_path / "target.db")
+    bad_rows = [{"sender": "You", "message": "fine"}] * 10 + [{"sender": None, "message": "no sender"}]
+    with pytest.raises(Exception):
+        import_rows(target, "messages", bad_rows, batch_size=4)
+    assert rows(target) == []
+    target.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'idx_messages_project'")
+    assert target.cursor.fetchone() is not None
+    target.close()
+
+
+def test_import_into_an_encrypted_database_encrypts_and_indexes(source, tmp_path):
+    pytest.importorskip("cryptography")
+    target = make_handler(tmp_path / "secret.db")
+    target.enable_encryption("correct horse")
+    path = str(tmp_path / "messages.jsonl")
+    export_table(source, "messages", path)
+
+    assert import_file(target, "messages", path) == 3
+    target.cursor.execute("SELECT message FROM messages WHERE sender = 'You' ORDER BY id LIMIT 1")
+    stored = target.cursor.fetchone()[0]
+    assert stored != "plain note" and target.reveal(stored) == "plain note"
+    assert [msg["message"] for msg in target.search_messages("note")] == [stored]
+
+    # An export of the encrypted database imports back to the same plaintext
+    export_table(target, "messages", str(tmp_path / "secret.jsonl"))
+    assert import_file(target, "messages", str(tmp_path / "secret.jsonl")) == 3
+    assert len(target.search_messages("note")) == 2
+    target.close()
+
+
+@pytest.mark.parametrize("suffix", ["jsonl", "csv"])
+def test_imported_projects_keep_their_parents_under_new_ids(source, tmp_path, suffix):
+    source.create_project("sub", parent="work")
+    path = str(tmp_path / f"projects.{suffix}")
+    export_table(source, "projects", path)
+
+    target = make_handler(tmp_path / "target.db")
+    target.create_project("x1")
+    target.create_project("x2")
+    import_file(target, "projects", path)
+    assert target.get_project_path("sub") == ["work", "sub"]
+    # Counts come from the target's own messages, not from the file
+    target.cursor.execute("SELECT message_count FROM projects WHERE name = 'work'")
+    assert target.cursor.fetchone()[0] == 0
+    target.close()
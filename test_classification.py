@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from classification import normalize_reminder_time
+
+
+@pytest.fixture
+def rome(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/Rome")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2026-01-02 09:00:00", "2026-01-02 09:00:00"),
+    ("2026-01-02T09:00:00", "2026-01-02 09:00:00"),
+    ("2026-01-02 09:00", "2026-01-02 09:00:00"),
+    ("2026-01-02T09:00:00.250", "2026-01-02 09:00:00"),
+    ("2026-01-02", "2026-01-02 00:00:00"),
+    # Offsets are converted to local time (UTC+1 in January)
+    ("2026-01-02T09:00:00Z", "2026-01-02 10:00:00"),
+    ("2026-01-02T09:00+02:00", "2026-01-02 08:00:00"),
+    ("2026-01-02T09:00:00.5-05:00", "2026-01-02 15:00:00"),
+    ("2026-07-02T09:00:00+00:00", "2026-07-02 11:00:00"),
+])
+def test_reminder_times_are_normalized_to_local_time(rome, value, expected):
+    assert normalize_reminder_time(value) == expected
+
+
+@pytest.mark.parametrize("value", [None, "", "  ", "NULL", "null"])
+def test_missing_reminder_time(value):
+    assert normalize_reminder_time(value) is None
+
+
+def test_unreadable_reminder_time():
+    with pytest.raises(ValueError):
+        normalize_reminder_time("tomorrow evening")
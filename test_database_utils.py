@@ -0,0 +1,227 @@
+import pytest
+
+from database_utils import DatabaseHandler, MessageQuery
+
+
+@pytest.fixture
+def filled_handler(db_handler):
+    db_handler.insert_messages([
+        {"sender": "You" if i % 2 else "Bot", "message": f"note {i}", "project": f"project{i % 5}",
+         "timestamp": f"2026-01-{i % 28 + 1:02d} 10:00:00"}
+        for i in range(200)
+    ])
+    return db_handler
+
+
+def assert_covering_without_sort(plan):
+    assert any("COVERING INDEX idx_messages_project_facets" in step for step in plan), plan
+    assert not any("USE TEMP B-TREE" in step for step in plan), plan
+
+
+def test_project_facets_use_covering_index_without_sort(filled_handler):
+    plans = filled_handler.explain_query_messages(MessageQuery().project("project1"))
+    assert_covering_without_sort(plans["facets"])
+    assert not any("USE TEMP B-TREE" in step for step in plans["page"])
+
+
+def test_timestamp_range_facets_use_covering_index_without_sort(filled_handler):
+    plans = filled_handler.explain_query_messages(MessageQuery().between("2026-01-05", "2026-01-10"))
+    assert_covering_without_sort(plans["facets"])
+    assert not any("USE TEMP B-TREE" in step for step in plans["page"])
+
+
+def test_facets_of_a_subset_of_columns_are_folded(filled_handler):
+    result = filled_handler.query_messages(MessageQuery().between("2026-01-05", "2026-01-10"), facets=("sender",))
+    assert result.total == sum(count for _, count in result.facets["sender"])
+    filled_handler.cursor.execute(
+        "SELECT sender, COUNT(*) FROM messages WHERE timestamp >= '2026-01-05' AND timestamp < '2026-01-10' "
+        "GROUP BY sender"
+    )
+    assert dict(result.facets["sender"]) == dict(filled_handler.cursor.fetchall())
+    assert_covering_without_sort(filled_handler.explain_query_messages(facets=("sender",))["facets"])
+
+
+def test_old_facet_index_is_rebuilt(tmp_path):
+    handler = DatabaseHandler(str(tmp_path / "old.db"))
+    handler.ensure_schema()
+    handler.cursor.execute("DROP INDEX idx_messages_project_facets")
+    handler.cursor.execute("CREATE INDEX idx_messages_project_facets "
+                           "ON messages (project, timestamp, sender, message_type, category)")
+    handler.ensure_schema()
+    handler.cursor.execute("PRAGMA index_info(idx_messages_project_facets)")
+    assert [row[2] for row in handler.cursor.fetchall()] == [
+        "project", "sender", "message_type", "category", "timestamp"
+    ]
+    handler.close()
+
+
+def test_new_database_uses_incremental_vacuum(tmp_path, caplog):
+    handler = DatabaseHandler(str(tmp_path / "new.db"))
+    handler.ensure_schema()
+    handler.cursor.execute("PRAGMA auto_vacuum")
+    assert handler.cursor.fetchone()[0] == 2
+    handler.close()
+
+    old = DatabaseHandler(str(tmp_path / "old.db"))
+    old.cursor.execute("CREATE TABLE legacy (x)")
+    old.ensure_schema()
+    old.cursor.execute("PRAGMA auto_vacuum")
+    assert old.cursor.fetchone()[0] == 0
+    assert "without incremental vacuum" in caplog.text
+    old.close()
+
+
+def test_begin_immediate_refuses_to_commit_an_open_transaction(filled_handler):
+    filled_handler.cursor.execute("UPDATE messages SET project = 'moved' WHERE id = 1")
+    with pytest.raises(RuntimeError):
+        filled_handler.begin_immediate()
+    filled_handler.conn.rollback()
+    filled_handler.cursor.execute("SELECT project FROM messages WHERE id = 1")
+    assert filled_handler.cursor.fetchone()[0] == "project0"
+
+
+def encrypted_handler(tmp_path):
+    pytest.importorskip("cryptography")
+    handler = DatabaseHandler(str(tmp_path / "secret.db"))
+    handler.ensure_schema()
+    handler.enable_encryption("correct horse")
+    return handler
+
+
+def token_count(handler, message_id):
+    handler.cursor.execute("SELECT COUNT(*) FROM message_tokens WHERE message_id = ?", (message_id,))
+    return handler.cursor.fetchone()[0]
+
+
+def test_encrypted_search_matches_whole_words_of_body_and_attachment_text(tmp_path):
+    handler = encrypted_handler(tmp_path)
+    invoice = handler.insert_message("You", "Pay the invoice", project="bills")
+    handler.insert_message("You", "Call the plumber")
+    handler.store_attachment_text(invoice, "Acme Corp, due Friday")
+
+    assert [msg["id"] for msg in handler.search_messages("invoice")] == [invoice]
+    assert [msg["id"] for msg in handler.search_messages("pay friday")] == [invoice]
+    assert handler.search_messages("invoi") == []
+    handler.cursor.execute("SELECT message FROM messages WHERE id = ?", (invoice,))
+    assert "invoice" not in handler.cursor.fetchone()[0]
+    handler.close()
+
+
+def test_text_that_looks_encrypted_is_still_encrypted(tmp_path):
+    handler = encrypted_handler(tmp_path)
+    message_id = handler.insert_message("You", "enc1:not a ciphertext")
+    handler.cursor.execute("SELECT message FROM messages WHERE id = ?", (message_id,))
+    stored = handler.cursor.fetchone()[0]
+    assert stored != "enc1:not a ciphertext"
+    assert handler.reveal(stored) == "enc1:not a ciphertext"
+    # Encrypting the stored messages again leaves them alone
+    assert handler.encrypt_existing_messages() == 0
+    handler.close()
+
+
+def test_message_tokens_are_deleted_with_their_message_and_restored_by_undo(tmp_path):
+    handler = encrypted_handler(tmp_path)
+    kept = handler.insert_message("You", "water the plants")
+    gone = handler.insert_message("You", "water the lawn")
+    assert token_count(handler, gone) == 3
+
+    handler.delete_message(gone)
+    assert token_count(handler, gone) == 0
+    assert [msg["id"] for msg in handler.search_messages("water")] == [kept]
+
+    doomed = handler.insert_message("You", "water the roses")
+    handler.bulk_delete_messages([doomed])
+    assert token_count(handler, doomed) == 0
+    handler.undo_last_batch()
+    assert [msg["id"] for msg in handler.search_messages("roses")] == [doomed]
+
+    handler.attach_archive(str(tmp_path / "secret.archive.db"))
+    handler.archive_messages([kept])
+    assert [msg["id"] for msg in handler.search_messages("plants")] == [kept]
+    handler.close()
+
+
+def message_state(handler):
+    handler.cursor.execute("SELECT id, message, project, processed FROM messages ORDER BY id")
+    return handler.cursor.fetchall()
+
+
+def test_undo_reverts_bulk_operations_newest_first(db_handler):
+    ids = db_handler.insert_messages([{"sender": "You", "message": f"note {i}", "processed": 1} for i in range(4)])
+    before = message_state(db_handler)
+    events = []
+    db_handler.subscribe(events.append)
+
+    assert db_handler.bulk_move_messages(ids[:2], "errands") == 2
+    assert db_handler.bulk_reclassify_messages(ids[1:3]) == 2
+    assert db_handler.bulk_delete_messages(ids[2:]) == 2
+    assert [row[0] for row in message_state(db_handler)] == ids[:2]
+
+    events.clear()
+    assert db_handler.undo_last_batch() == 2
+    assert sorted(type(event).__name__ for event in events) == ["MessageInserted", "MessageInserted"]
+    assert db_handler.undo_last_batch() == 2
+    assert db_handler.undo_last_batch() == 2
+    assert message_state(db_handler) == before
+    assert db_handler.undo_last_batch() == 0
+
+
+def test_undo_journal_keeps_the_last_batches(db_handler):
+    message_id = db_handler.insert_message("You", "wandering note")
+    for i in range(25):
+        db_handler.bulk_move_messages([message_id], f"project{i}")
+    db_handler.cursor.execute("SELECT COUNT(DISTINCT batch_id) FROM undo_journal")
+    assert db_handler.cursor.fetchone()[0] == 20
+
+    while db_handler.undo_last_batch():
+        pass
+    assert db_handler.get_message(message_id)["project"] == "project4"
+
+
+def closure(handler):
+    handler.cursor.execute("SELECT ancestor_id, descendant_id, depth FROM project_tree")
+    return set(handler.cursor.fetchall())
+
+
+def closure_from_parents(handler):
+    handler.cursor.execute("""
+        WITH RECURSIVE up(descendant_id, ancestor_id, depth) AS (
+            SELECT id, id, 0 FROM projects
+            UNION ALL
+            SELECT up.descendant_id, p.parent_id, up.depth + 1 FROM up JOIN projects p ON p.id = up.ancestor_id
+            WHERE p.parent_id IS NOT NULL
+        )
+        SELECT ancestor_id, descendant_id, depth FROM up""")
+    return set(handler.cursor.fetchall())
+
+
+def test_project_tree_closure_follows_creates_moves_and_deletes(db_handler):
+    db_handler.create_project("home")
+    db_handler.create_project("garden", parent="home")
+    db_handler.create_project("roses", parent="garden")
+    db_handler.create_project("work")
+    db_handler.insert_messages([{"sender": "You", "message": "prune", "project": "roses"},
+                                   {"sender": "You", "message": "water", "project": "garden"}])
+    assert closure(db_handler) == closure_from_parents(db_handler)
+    assert db_handler.get_project_path("roses") == ["home", "garden", "roses"]
+    assert db_handler.count_subtree_messages("home") == 2
+
+    assert db_handler.move_project("garden", "work")
+    assert closure(db_handler) == closure_from_parents(db_handler)
+    assert db_handler.get_project_path("roses") == ["work", "garden", "roses"]
+    assert db_handler.get_subtree_projects("work") == ["work", "garden", "roses"]
+    assert db_handler.count_subtree_messages("home") == 0
+
+    with pytest.raises(ValueError):
+        db_handler.move_project("work", "roses")
+    assert closure(db_handler) == closure_from_parents(db_handler)
+
+    # Deleting a project hangs its children on its parent
+    db_handler.cursor.execute("DELETE FROM projects WHERE name = 'garden'")
+    db_handler.commit()
+    assert closure(db_handler) == closure_from_parents(db_handler)
+    assert db_handler.get_project_path("roses") == ["work", "roses"]
+
+    assert db_handler.move_project("roses")
+    assert db_handler.get_project_path("roses") == ["roses"]
+    assert closure(db_handler) == closure_from_parents(db_handler)
@@ -0,0 +1,94 @@
+import pytest
+
+from database_utils import DatabaseHandler
+from dedup import MinHasher, benchmark, content_hash, normalize_text
+
+
+@pytest.fixture
+def db_handler(db_handler):
+    db_handler.enable_deduplication()
+    return db_handler
+
+
+def duplicate_columns(handler, message_id):
+    handler.cursor.execute("SELECT duplicate_of, duplicate_count, processed FROM messages WHERE id = ?", (message_id,))
+    return handler.cursor.fetchone()
+
+
+def test_normalize_text():
+    assert normalize_text("  Café, au   LAIT!  ") == "cafe au lait"
+
+
+def test_similarity_estimate():
+    hasher = MinHasher()
+    base = hasher.signature(normalize_text("remember to renew the car insurance before the end of march"))
+    close = hasher.signature(normalize_text("remember to renew the car insurance before the end of april"))
+    other = hasher.signature(normalize_text("the quarterly report needs the sales figures from the north team"))
+    assert hasher.similarity(base, close) > 0.6
+    assert hasher.similarity(base, other) < 0.2
+
+
+def test_exact_duplicate_is_collapsed(db_handler):
+    original = db_handler.insert_message("You", "Buy milk!")
+    assert db_handler.insert_messages([{"sender": "You", "message": "buy   MILK"}]) == [original]
+    db_handler.cursor.execute("SELECT COUNT(*) FROM messages")
+    assert db_handler.cursor.fetchone()[0] == 1
+    assert duplicate_columns(db_handler, original)[1] == 1
+
+
+def test_exact_repeats_collapse_into_a_classified_original(db_handler):
+    original = db_handler.insert_message("You", "water the plants")
+    db_handler.apply_classifications([(original, "home", None)])
+    # Later repeats from the global chat would be re-homed to 'home', so they collapse there
+    for _ in range(3):
+        assert db_handler.insert_messages([{"sender": "You", "message": "Water the plants"}]) == [original]
+    db_handler.cursor.execute("SELECT COUNT(*) FROM messages")
+    assert db_handler.cursor.fetchone()[0] == 1
+    assert duplicate_columns(db_handler, original)[1] == 3
+
+
+def test_near_duplicate_is_linked_and_not_classified_again(db_handler):
+    original = db_handler.insert_message("You", "remember to renew the car insurance before the end of march please")
+    near = db_handler.insert_message("You", "remember to renew the car insurance before the end of march please, thanks")
+    other = db_handler.insert_message("You", "the quarterly report needs the sales figures from the north team")
+    assert near != original
+    duplicate_of, _, processed = duplicate_columns(db_handler, near)
+    assert (duplicate_of, processed) == (original, 1)
+    assert duplicate_columns(db_handler, other)[0] is None
+
+
+def test_fingerprints_go_away_with_their_message_and_backfill_catches_up(db_handler, tmp_path):
+    message_id = db_handler.insert_message("You", "call the dentist")
+    db_handler.delete_message(message_id)
+    db_handler.cursor.execute("SELECT COUNT(*) FROM message_fingerprints")
+    assert db_handler.cursor.fetchone()[0] == 0
+    db_handler.cursor.execute("SELECT COUNT(*) FROM message_lsh")
+    assert db_handler.cursor.fetchone()[0] == 0
+
+    # Stored by a handler without deduplication, e.g. before it was enabled
+    plain = DatabaseHandler(db_handler.db_name)
+    old_ids = plain.insert_messages([{"sender": "You", "message": f"old note number {i}"} for i in range(5)])
+    plain.close()
+    assert db_handler.deduplicator.backfill(batch_size=2) == 5
+    assert db_handler.insert_messages([{"sender": "You", "message": "Old note number 3."}]) == [old_ids[3]]
+
+
+def test_benchmark_counts_collapsed_and_linked_rows(tmp_path):
+    results = benchmark(count=300, batch_size=100, directory=str(tmp_path))
+    assert results["plain"]["collapsed"] == results["plain"]["linked"] == 0
+    assert results["dedup"]["collapsed"] > 0 and results["dedup"]["linked"] > 0
+
+
+def test_fingerprints_of_an_encrypted_database_are_keyed(tmp_path):
+    pytest.importorskip("cryptography")
+    handler = DatabaseHandler(str(tmp_path / "secret.db"))
+    handler.ensure_schema()
+    handler.enable_deduplication()
+    plain = handler.insert_message("You", "renew the passport")
+    handler.enable_encryption("correct horse")
+
+    # The fingerprint computed before encryption is replaced by a keyed one
+    handler.cursor.execute("SELECT content_hash FROM message_fingerprints WHERE message_id = ?", (plain,))
+    assert handler.cursor.fetchone()[0] != content_hash(normalize_text("renew the passport"))
+    assert handler.insert_messages([{"sender": "You", "message": "Renew the passport!"}]) == [plain]
+    handler.close()
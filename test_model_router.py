@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import pytest
+
+from gemini_utils import GeminiHandler
+from model_router import ModelRouter, parse_model_overrides
+from usage import UsageLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "chat.db"), clock=lambda: datetime(2026, 3, 1, 12))
+    yield ledger
+    ledger.close()
+
+
+def test_small_prompts_go_to_the_cheap_model_and_large_ones_past_it():
+    router = ModelRouter()
+    assert router.route("classify", 2000) == ["gemini-2.0-flash-lite", "gemini-2.0-flash"]
+    assert router.route("classify", 20000) == ["gemini-2.0-flash", "gemini-2.0-flash-lite"]
+
+
+def test_models_failing_too_often_are_tried_last(ledger):
+    for i in range(20):
+        ledger.record("gemini-2.0-flash-lite", "classify", outcome="error" if i % 2 else "ok")
+    router = ModelRouter(ledger=ledger, clock=lambda: datetime(2026, 3, 1, 12))
+    assert router.route("classify", 2000) == ["gemini-2.0-flash", "gemini-2.0-flash-lite"]
+    assert router.failure_rate("gemini-2.0-flash-lite", "classify") == 0.5
+
+
+def test_a_model_that_just_failed_cools_down():
+    router = ModelRouter(cooldown=60)
+    router.failed("gemini-2.0-flash-lite")
+    assert router.route("classify", 2000) == ["gemini-2.0-flash", "gemini-2.0-flash-lite"]
+
+
+def test_dispatch_falls_back_on_errors_and_invalid_responses(ledger):
+    handler = GeminiHandler(ledger=ledger, models=parse_model_overrides(["classify=local-a,local-b,local-c"]))
+    answers = {"local-a": RuntimeError("unavailable"), "local-b": "not json", "local-c": '{"messages": []}'}
+
+    def send(backend, model, request):
+        if isinstance(answers[model], Exception):
+            raise answers[model]
+        return answers[model]
+
+    assert handler.dispatch("classify", send, check=handler.check_classification) == '{"messages": []}'
+    rows = ledger.conn.execute("SELECT model, attempt, outcome FROM gemini_requests ORDER BY id").fetchall()
+    assert rows == [("local-a", 1, "error"), ("local-b", 2, "invalid"), ("local-c", 3, "ok")]
+    # Both failed models now go last
+    assert handler.router.route("classify") == ["local-c", "local-a", "local-b"]
+
+
+def test_the_last_model_raises_when_every_model_fails(ledger):
+    handler = GeminiHandler(ledger=ledger, models={"classify": ("local-a", "local-b")})
+
+    def send(backend, model, request):
+        raise RuntimeError(f"{model} is down")
+
+    with pytest.raises(RuntimeError, match="local-b is down"):
+        handler.dispatch("classify", send)
+
+
+def test_model_overrides_are_validated():
+    assert parse_model_overrides(["embed = text-embedding-004"]) == {"embed": ("text-embedding-004",)}
+    with pytest.raises(ValueError):
+        parse_model_overrides(["classify"])
@@ -0,0 +1,24 @@
+import pytest
+
+from database_utils import DatabaseHandler
+from profiles import ProfileManager
+
+
+def test_search_uses_the_blind_index_of_unlocked_profiles_and_skips_locked_ones(tmp_path):
+    pytest.importorskip("cryptography")
+    for name in ("home", "secret", "vault"):
+        handler = DatabaseHandler(str(tmp_path / f"{name}.db"))
+        handler.ensure_schema()
+        if name != "home":
+            handler.enable_encryption("correct horse")
+        handler.insert_message("You", f"renew the passport ({name})")
+        handler.close()
+
+    manager = ProfileManager.from_directory(str(tmp_path))
+    manager.open("secret").enable_encryption("correct horse")
+    try:
+        found = sorted((profile, msg["message"]) for profile, msg in manager.search("passport"))
+        assert found == [("home", "renew the passport (home)"), ("secret", "renew the passport (secret)")]
+        assert manager.locked_profiles() == ["vault"]
+    finally:
+        manager.close()
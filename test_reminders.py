@@ -0,0 +1,97 @@
+import pytest
+
+from database_utils import DatabaseHandler
+from reminders import FakeClock, RecordingNotifier, ReminderPipeline
+
+
+class FailingNotifier:
+    name = "failing"
+
+    def __init__(self):
+        self.attempts = 0
+
+    def notify(self, notification):
+        self.attempts += 1
+        raise RuntimeError("notifier is down")
+
+
+def add_reminder(db_handler, text, when, project="main"):
+    return db_handler.insert_message("You", text, project=project, reminder_time=when)
+
+
+def fired_states(db_handler):
+    db_handler.cursor.execute("SELECT id, reminder_fired FROM messages ORDER BY id")
+    return dict(db_handler.cursor.fetchall())
+
+
+def test_reminders_due_within_one_window_are_coalesced(db_handler):
+    clock = FakeClock("2026-01-01 10:00:00")
+    notifier = RecordingNotifier()
+    pipeline = ReminderPipeline(db_handler, notifier, clock=clock, window=60)
+    add_reminder(db_handler, "call the plumber", "2026-01-01 10:00:00")
+    assert pipeline.tick() == 1
+
+    # Both come due while the window of the first notification is still open
+    add_reminder(db_handler, "pay rent", "2026-01-01 10:00:20")
+    add_reminder(db_handler, "water plants", "2026-01-01 10:00:40", project="home")
+    clock.advance(30)
+    assert pipeline.tick() == 0
+    clock.advance(30)
+    assert pipeline.tick() == 2
+
+    assert len(notifier.sent) == 2
+    coalesced = notifier.sent[1]
+    assert coalesced.title == "2 reminders (home, main)"
+    assert "pay rent" in coalesced.body and "water plants" in coalesced.body
+    assert set(fired_states(db_handler).values()) == {1}
+
+
+def test_delivered_reminders_are_not_sent_again_after_a_restart(db_path, db_handler):
+    clock = FakeClock("2026-01-01 10:00:00")
+    add_reminder(db_handler, "renew passport", "2026-01-01 09:00:00")
+    assert ReminderPipeline(db_handler, RecordingNotifier(), clock=clock).tick() == 1
+
+    restarted = DatabaseHandler(db_path)
+    notifier = RecordingNotifier()
+    clock.advance(3600)
+    assert ReminderPipeline(restarted, notifier, clock=clock).tick() == 0
+    assert notifier.sent == []
+    restarted.close()
+
+
+def test_failed_delivery_is_released_and_retried_after_the_window(db_handler):
+    clock = FakeClock("2026-01-01 10:00:00")
+    message_id = add_reminder(db_handler, "dentist", "2026-01-01 10:00:00")
+    failing = FailingNotifier()
+    pipeline = ReminderPipeline(db_handler, failing, clock=clock, window=60)
+
+    assert pipeline.tick() == 0
+    assert failing.attempts == 1
+    assert fired_states(db_handler)[message_id] == 0
+    db_handler.cursor.execute("SELECT error FROM reminder_deliveries WHERE message_id = ?", (message_id,))
+    assert db_handler.cursor.fetchone()[0] == "notifier is down"
+
+    pipeline.notifier = notifier = RecordingNotifier()
+    clock.advance(30)
+    assert pipeline.tick() == 0
+    clock.advance(30)
+    assert pipeline.tick() == 1
+    assert [n.body for n in notifier.sent] == ["dentist"]
+    assert fired_states(db_handler)[message_id] == 1
+
+
+def test_abandoned_claim_is_reclaimed_after_the_lease(db_handler):
+    clock = FakeClock("2026-01-01 10:00:00")
+    message_id = add_reminder(db_handler, "submit report", "2026-01-01 09:59:00")
+    # A process claimed it and died before delivering
+    assert [msg["id"] for msg in db_handler.claim_due_reminders("2026-01-01 10:00:00")] == [message_id]
+    assert fired_states(db_handler)[message_id] == -1
+
+    notifier = RecordingNotifier()
+    pipeline = ReminderPipeline(db_handler, notifier, clock=clock, window=0, lease_seconds=300)
+    clock.advance(299)
+    assert pipeline.tick() == 0
+    clock.advance(2)
+    assert pipeline.tick() == 1
+    assert [n.body for n in notifier.sent] == ["submit report"]
+    assert fired_states(db_handler)[message_id] == 1
@@ -0,0 +1,61 @@
+from semantic_index import GeminiEmbedder, LocalEmbedder, SemanticIndex, build_embedder
+
+
+class CountingEmbedder(LocalEmbedder):
+    def __init__(self):
+        super().__init__(dim=64)
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(len(texts))
+        return super().embed(texts)
+
+
+def test_inserts_are_embedded_in_one_batch_on_the_next_search(db_handler):
+    embedder = CountingEmbedder()
+    index = SemanticIndex(db_handler, embedder)
+    index.sync()
+    index.subscribe()
+    embedder.calls.clear()
+
+    first = db_handler.insert_message("You", "buy oat milk")
+    db_handler.insert_message("You", "book the train to Turin")
+    removed = db_handler.insert_message("You", "buy oat milk and bread")
+    db_handler.delete_message(removed)
+    assert embedder.calls == []
+
+    results = index.search("oat milk", k=5)
+    # Two queued inserts in one call, then the query
+    assert embedder.calls == [2, 1]
+    assert results[0][0] == first
+    assert removed not in dict(results)
+    db_handler.cursor.execute("SELECT COUNT(*) FROM message_embeddings")
+    assert db_handler.cursor.fetchone()[0] == 2
+
+
+def test_queue_is_flushed_when_it_reaches_the_threshold(db_handler):
+    embedder = CountingEmbedder()
+    index = SemanticIndex(db_handler, embedder, flush_threshold=3)
+    index.sync()
+    index.subscribe()
+    for i in range(7):
+        db_handler.insert_message("You", f"note {i}")
+    assert embedder.calls == [3, 3]
+    assert len(index.queued) == 1
+
+
+class FakeHandler:
+    def __init__(self, model, reachable):
+        from model_router import ModelRouter
+        self.router = ModelRouter({"embed": (model,)})
+        self.reachable = reachable
+
+    def can_reach(self, model):
+        return self.reachable
+
+
+def test_gemini_embeddings_are_used_only_when_reachable():
+    assert isinstance(build_embedder(FakeHandler("text-embedding-004", True)), GeminiEmbedder)
+    assert isinstance(build_embedder(FakeHandler("text-embedding-004", False)), LocalEmbedder)
+    assert isinstance(build_embedder(FakeHandler("local", True)), LocalEmbedder)
+    assert isinstance(build_embedder(None), LocalEmbedder)
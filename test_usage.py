@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from usage import BudgetExceeded, Usage, UsageLedger, usage_from_response
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = datetime.strptime(now, "%Y-%m-%d %H:%M:%S")
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock("2026-03-01 23:00:00")
+
+
+@pytest.fixture
+def ledger(tmp_path, clock):
+    ledger = UsageLedger(str(tmp_path / "chat.db"), daily_token_budget=1000, clock=clock)
+    yield ledger
+    ledger.close()
+
+
+def response(prompt, candidates):
+    return {"usageMetadata": {"promptTokenCount": prompt, "candidatesTokenCount": candidates}}
+
+
+def test_usage_is_read_from_rest_and_sdk_responses():
+    assert usage_from_response(response(10, 5)) == Usage(10, 0, 5, 0, 15)
+    assert usage_from_response(object()) == Usage(0, 0, 0, 0, 0)
+
+
+def test_track_records_outcomes_and_rollup_sums_them(ledger):
+    with ledger.track("flash", "classify", prompt_chars=400, context_chars=100) as request:
+        request.set_response(response(100, 20))
+    with ledger.track("flash", "classify") as request:
+        request.set_response(response(50, 5))
+        request.mark_invalid("not JSON")
+    with pytest.raises(RuntimeError):
+        with ledger.track("flash", "classify"):
+            raise RuntimeError("timeout")
+    with ledger.track("embedder", "embed") as request:
+        request.set_response(response(30, 0))
+
+    embed, classify = ledger.rollup(("model", "operation"))
+    assert (classify.model, classify.operation, classify.requests, classify.errors) == ("flash", "classify", 3, 2)
+    assert (classify.prompt_chars, classify.context_chars, classify.total_tokens) == (400, 100, 175)
+    assert (embed.requests, embed.errors, embed.total_tokens) == (1, 0, 30)
+    outcomes = ledger.conn.execute("SELECT outcome, error FROM gemini_requests ORDER BY id").fetchall()
+    assert outcomes == [("ok", None), ("invalid", "not JSON"), ("error", "RuntimeError: timeout"), ("ok", None)]
+
+
+def test_budget_blocks_requests_until_the_next_day(ledger, clock):
+    ledger.record("flash", "classify", Usage(900, 0, 100, 0, 1000))
+    assert ledger.remaining_today() == 0
+    with pytest.raises(BudgetExceeded):
+        ledger.check_budget("flash", "classify")
+    blocked = ledger.rollup(("day",))[0]
+    assert (blocked.requests, blocked.errors, blocked.total_tokens) == (2, 1, 1000)
+
+    clock.now += timedelta(hours=2)
+    assert ledger.remaining_today() == 1000
+    ledger.check_budget("flash", "classify")
+    assert [row.day for row in ledger.rollup(("day",))] == ["2026-03-01"]
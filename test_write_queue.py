@@ -0,0 +1,23 @@
+from database_utils import DatabaseHandler
+from write_queue import WriteBehindQueue
+
+
+def test_queue_commits_are_not_reported_as_external_changes(db_handler):
+    write_queue = WriteBehindQueue(db_handler.db_name)
+    db_handler.has_external_changes()
+
+    write_queue.submit(-1, {"sender": "You", "message": "first"})
+    write_queue.submit(-2, {"sender": "You", "message": "second"})
+    write_queue.flush()
+    results = write_queue.drain_results()
+    assert [result.provisional_id for result in results if result.ok] == [-1, -2]
+
+    db_handler.absorb_external_changes()
+    assert not db_handler.has_external_changes()
+
+    # A commit of another process afterwards is still noticed
+    other = DatabaseHandler(db_handler.db_name)
+    other.insert_message("Bot", "from the headless runner")
+    other.close()
+    assert db_handler.has_external_changes()
+    assert write_queue.close() == {}
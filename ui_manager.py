@@ -1,27 +1,196 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from datetime import datetime
+from tkinter import ttk, filedialog, messagebox, simpledialog
+from datetime import datetime, timedelta
 import os
 import shutil
 from PIL import Image, ImageTk
 import base64
+import sqlite3
 import threading
+from database_utils import MessageInserted, MessageDeleted, MessageMoved, MessageQuery, FACET_COLUMNS
+from write_queue import WriteBehindQueue, save_unsaved_messages, load_unsaved_messages
+from retention import RetentionManager
+from refresh import RefreshScheduler
+from previews import PreviewService, describe
+from chat_rows import RowRegistry, attach_image, live_images
+from reminders import ReminderPipeline, ToastNotifier
+from project_tree import ProjectTree
+from crypto_store import is_encrypted_file
+
+# Views that can go stale while another tab is shown, by notebook tab index
+VIEW_GLOBAL_CHAT, VIEW_PROJECTS, VIEW_PROJECT_CHAT = 0, 1, 2
 
 class UIManager:
-    def __init__(self, root, db_handler):
+    def __init__(self, root, db_handler, profiles=None):
         self.root = root
         self.db_handler = db_handler
+        # ProfileManager the database came from, if the app runs with several profiles
+        self.profiles = profiles
         self.current_project = "main"
-        self.message_widgets = {}
+        # The rows of each chat view; a view releases its own rows when it is reloaded
+        self.chat_rows = {VIEW_GLOBAL_CHAT: RowRegistry(), VIEW_PROJECT_CHAT: RowRegistry()}
+        # Message IDs ticked for the bulk actions
+        self.selected_messages = set()
+        # Built by get_semantic_index the first time similarity search is used
+        self.semantic_index = None
+        # Records the embedding requests of the similarity index
+        self.usage_ledger = None
         self.current_file_path = None
         self.current_file_type = None
+        # Attachments of an encrypted database decrypted to be opened, see decrypt_attachment
+        self.decrypted_dir = None
+
+        # canvas -> rows whose preview was not requested yet
+        self.lazy_previews = {}
+        # file path -> rows waiting for its preview
+        self.preview_waiters = {}
+        self.preview_checks_scheduled = set()
+        # Chat canvases with a layout update pending, see schedule_layout_update
+        self.layout_updates_scheduled = set()
+        self.preview_poll_active = False
         self.auto_update_active = True
 
+        # Messages handed to the write-behind queue, keyed by provisional (negative) ID
+        self.pending_messages = {}
+        self.next_provisional_id = -1
+        # The queue is polled only while it has work outstanding
+        self.write_poll_active = False
+        # Due reminders are shown as toasts, never as dialogs blocking the Tk thread
+        self.toasts = ToastNotifier(self.root)
+        self.reminder_job = None
+
+        self.open_database()
+
         # Initialize UI components
         self.setup_ui()
 
-        # Start auto-update
-        self.auto_update()
+        self.watch_database()
+
+        # Poll for changes made by other processes, backing off while nothing
+        # changes; only the visible tab is reloaded, the others when shown
+        self.stale_views = set()
+        self.refresh_scheduler = RefreshScheduler(
+            self.root, lambda: self.db_handler.has_external_changes(), self.refresh_visible_view
+        )
+        self.refresh_scheduler.start()
+        self.bind_activity_events()
+        self.schedule_maintenance(60000)
+
+    def open_database(self):
+        """Start the services that work on the files of the current database."""
+        # Attachment previews are built in worker processes, only for rows scrolled into view
+        self.previews = PreviewService(f"{self.db_handler.db_name}.previews")
+        self.write_queue = WriteBehindQueue(self.db_handler.db_name, deduplicate=True, cipher=self.db_handler.cipher)
+        self.recovery_path = self.db_handler.db_name + ".unsaved.jsonl"
+
+        # Messages that could not be saved when the app was last closed
+        for row in load_unsaved_messages(self.recovery_path):
+            self.queue_message(row)
+
+    def watch_database(self):
+        """Follow the changes of the current database, once its views are loaded."""
+        # Apply in-process changes as they happen instead of re-querying everything
+        self.db_handler.subscribe(self.on_database_change)
+        # Mark the current state as seen, the views were just loaded
+        self.db_handler.has_external_changes()
+
+        # Archiving and vacuuming run in small steps while Tk has nothing else to do
+        self.retention = RetentionManager(self.db_handler)
+
+        self.reminders = ReminderPipeline(self.db_handler, self.toasts)
+        self.schedule_reminders()
+
+    def release_database(self):
+        """Stop the services of the current database, keeping messages that could not be saved."""
+        self.db_handler.unsubscribe(self.on_database_change)
+        if self.reminder_job is not None:
+            self.root.after_cancel(self.reminder_job)
+            self.reminder_job = None
+        if self.semantic_index is not None:
+            self.db_handler.unsubscribe(self.semantic_index.on_database_change)
+            self.semantic_index = None
+        if self.usage_ledger is not None:
+            self.usage_ledger.close()
+            self.usage_ledger = None
+        self.previews.close()
+
+        # Wait for queued messages to be committed; keep whatever still fails for the next start
+        unsaved = self.write_queue.close()
+        if unsaved:
+            save_unsaved_messages(self.recovery_path, unsaved.values())
+            messagebox.showerror(
+                "Unsaved messages",
+                f"{len(unsaved)} message(s) could not be saved. They were kept in "
+                f"{self.recovery_path} and will be saved on the next start."
+            )
+        self.pending_messages.clear()
+
+        if self.decrypted_dir is not None:
+            shutil.rmtree(self.decrypted_dir, ignore_errors=True)
+            self.decrypted_dir = None
+
+    def switch_database(self, db_handler):
+        """
+        Show another database (e.g. another profile) in every view.
+
+        The services of the old database are stopped and the views are
+        rebuilt from the new one in the same Tk callback, so no view ever
+        shows a mix of both.
+        """
+        if db_handler is self.db_handler:
+            return
+        self.release_database()
+        self.db_handler = db_handler
+
+        # Forget everything shown from the old database
+        for registry in self.chat_rows.values():
+            registry.clear(recycle=False)
+        self.project_tree.reset(db_handler)
+        self.projects_revision = db_handler.get_projects_revision()
+        self.selected_messages.clear()
+        self.lazy_previews.clear()
+        self.preview_waiters.clear()
+        self.stale_views = set()
+        self.current_project = "main"
+        self.project_label.config(text="Current Project: main")
+
+        self.open_database()
+        self.load_projects()
+        self.load_global_chat_history()
+        self.pages.select(VIEW_GLOBAL_CHAT)
+        self.watch_database()
+        self.refresh_scheduler.activity()
+
+    def switch_profile(self, name):
+        """Make another profile of the ProfileManager the one shown."""
+        if name == self.profiles.active:
+            return
+        try:
+            db_handler = self.profiles.switch(name)
+        except sqlite3.Error as e:
+            messagebox.showerror("Error", f"Could not open profile {name}: {e}")
+            self.profile_var.set(self.profiles.active)
+            return
+        self.switch_database(db_handler)
+        self.profile_var.set(name)
+        self.root.title(f"Reminder Project - {name}")
+
+    def create_profile(self):
+        """Ask for a name and create a new, empty profile next to the others."""
+        name = simpledialog.askstring("New Profile", "Profile name:", parent=self.root)
+        if not name:
+            return
+        name = name.strip()
+        if not name or name in self.profiles.profiles or "." in name or os.sep in name:
+            messagebox.showerror("Error", "Invalid or existing profile name")
+            return
+        directory = os.path.dirname(self.profiles.profiles[self.profiles.active])
+        self.profiles.add_profile(name, os.path.join(directory, f"{name}.db"))
+        self.profiles_menu.insert_radiobutton(
+            self.profiles.names().index(name), label=name, value=name, variable=self.profile_var,
+            command=lambda: self.switch_profile(name)
+        )
+        self.switch_profile(name)
 
     def setup_ui(self):
         """Initialize all UI components."""
@@ -65,26 +234,23 @@ class UIManager:
         self.load_global_chat_history()
 
     def setup_projects_page(self):
-        """Set up the projects page with a grid of project folders."""
-        # Create a frame for the grid
+        """Set up the projects page with the project tree."""
         self.projects_frame = ttk.Frame(self.projects_page)
         self.projects_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-        # Create a canvas with scrollbar for projects
-        self.projects_canvas = tk.Canvas(self.projects_frame)
-        self.projects_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-
-        self.projects_scrollbar = ttk.Scrollbar(self.projects_frame, orient=tk.VERTICAL, command=self.projects_canvas.yview)
-        self.projects_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.projects_canvas.configure(yscrollcommand=self.projects_scrollbar.set)
+        # Children are loaded when a project is opened; double-click or Enter opens its chat
+        self.projects_revision = self.db_handler.get_projects_revision()
+        self.project_tree = ProjectTree(self.projects_frame, self.db_handler)
+        self.project_tree.pack(fill=tk.BOTH, expand=True)
+        self.project_tree.tree.bind("<Double-1>", lambda e: self.open_selected_project())
+        self.project_tree.tree.bind("<Return>", lambda e: self.open_selected_project())
 
-        # Create a frame inside the canvas for project folders
-        self.projects_grid = ttk.Frame(self.projects_canvas)
-        self.projects_canvas.create_window((0, 0), window=self.projects_grid, anchor=tk.NW)
-
-        # Add new project button
-        self.new_project_btn = ttk.Button(self.projects_page, text="New Project", command=self.create_new_project)
-        self.new_project_btn.pack(pady=10)
+        buttons = ttk.Frame(self.projects_page)
+        buttons.pack(pady=10)
+        self.new_project_btn = ttk.Button(buttons, text="New Project", command=self.create_new_project)
+        self.new_project_btn.pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="Open", command=self.open_selected_project).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="Move Project...", command=self.move_selected_project).pack(side=tk.LEFT, padx=5)
 
     def setup_global_chat_page(self):
         """Set up the global chat page with message display and input area."""
@@ -118,7 +284,8 @@ class UIManager:
         global_scrollbar = ttk.Scrollbar(self.global_chat_page, orient=tk.VERTICAL, 
                                        command=self.global_messages_canvas.yview)
         global_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.global_messages_canvas.configure(yscrollcommand=global_scrollbar.set)
+        self.global_messages_canvas.configure(yscrollcommand=lambda first, last: self.on_chat_scrolled(
+            self.global_messages_canvas, global_scrollbar, first, last))
 
         # Create input area
         global_input_frame = ttk.Frame(self.global_chat_page)
@@ -164,7 +331,7 @@ class UIManager:
         self.search_entry = ttk.Entry(search_frame, width=20)
         self.search_entry.pack(side=tk.LEFT, padx=5)
 
-        search_button = ttk.Button(search_frame, text="Search", command=self.search_messages)
+        search_button = ttk.Button(search_frame, text="Search", command=lambda: self.search_messages(project=self.current_project))
         search_button.pack(side=tk.LEFT)
 
         # Create messages area
@@ -177,7 +344,8 @@ class UIManager:
         # Add scrollbar
         self.scrollbar = ttk.Scrollbar(self.chat_page, orient=tk.VERTICAL, command=self.messages_canvas.yview)
         self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.messages_canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.messages_canvas.configure(yscrollcommand=lambda first, last: self.on_chat_scrolled(
+            self.messages_canvas, self.scrollbar, first, last))
 
         # Create input area
         self.input_frame = ttk.Frame(self.chat_page)
@@ -216,52 +384,56 @@ class UIManager:
         edit_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Edit", menu=edit_menu)
         edit_menu.add_command(label="Search Messages", command=self.search_messages)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Move Selected...", command=self.move_selected_messages)
+        edit_menu.add_command(label="Delete Selected", command=self.delete_selected_messages)
+        edit_menu.add_command(label="Reclassify Selected", command=self.reclassify_selected_messages)
+        edit_menu.add_command(label="Clear Selection", command=self.clear_selection)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Undo Last Bulk Action", command=self.undo_last_bulk_action)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Debug Counters", command=self.show_debug_counters)
+
+        # Profiles menu, when the app runs with a ProfileManager
+        if self.profiles is not None:
+            self.profile_var = tk.StringVar(self.root, value=self.profiles.active)
+            self.profiles_menu = tk.Menu(menubar, tearoff=0)
+            menubar.add_cascade(label="Profiles", menu=self.profiles_menu)
+            for name in self.profiles.names():
+                self.profiles_menu.add_radiobutton(
+                    label=name, value=name, variable=self.profile_var,
+                    command=lambda n=name: self.switch_profile(n)
+                )
+            self.profiles_menu.add_separator()
+            self.profiles_menu.add_command(label="New Profile...", command=self.create_profile)
 
     def load_projects(self):
-        """Load and display all projects as folders."""
-        # Clear existing projects
-        for widget in self.projects_grid.winfo_children():
-            widget.destroy()
-
-        # Get projects
-        projects = self.db_handler.get_projects()
-
-        # Create project folders
-        row = 0
-        col = 0
-        max_cols = 3  # Number of columns in the grid
-
-        for project in projects:
-            if project == "main":
-                continue  # Skip main project as it's not shown in folders
-
-            # Create project folder frame
-            folder_frame = ttk.Frame(self.projects_grid, padding=10)
-            folder_frame.grid(row=row, column=col, padx=10, pady=10, sticky="nsew")
-
-            # Create folder icon (using a button with text)
-            folder_btn = ttk.Button(folder_frame, text=f"📁 {project}", 
-                                  command=lambda p=project: self.open_project(p))
-            folder_btn.pack(fill=tk.BOTH, expand=True)
-
-            # Update grid position
-            col += 1
-            if col >= max_cols:
-                col = 0
-                row += 1
-
-        # Configure grid columns to be equal width
-        for i in range(max_cols):
-            self.projects_grid.grid_columnconfigure(i, weight=1)
-
-        # Update canvas scroll region
-        self.projects_canvas.update_idletasks()
-        self.projects_canvas.configure(scrollregion=self.projects_canvas.bbox("all"))
+        """
+        Bring the project tree up to date.
+
+        Only projects whose aggregates or parent changed since the last call
+        are read (see DatabaseHandler.get_project_summaries), and only the
+        ones in an opened part of the tree are shown.
+        """
+        summaries = self.db_handler.get_project_summaries(since_revision=self.projects_revision)
+        if not summaries:
+            return
+        self.projects_revision = max(summary.revision for summary in summaries)
+        self.project_tree.apply(summaries)
+
+    def open_selected_project(self):
+        """Open the chat of the project selected in the tree."""
+        project = self.project_tree.selected()
+        if project is not None:
+            self.open_project(project)
 
     def open_project(self, project_name):
         """Open a project's chat."""
         self.current_project = project_name
-        self.project_label.config(text=f"Current Project: {project_name}")
+        path = " / ".join(self.db_handler.get_project_path(project_name)) or project_name
+        self.project_label.config(
+            text=f"Current Project: {path} ({self.db_handler.count_subtree_messages(project_name)} notes with subprojects)"
+        )
         # Show the Project Chat tab
         self.pages.select(2)  # Index 2 is the Project Chat tab
         self.load_chat_history()
@@ -269,44 +441,322 @@ class UIManager:
     def back_to_projects(self):
         """Switch back to the projects page."""
         self.pages.select(self.projects_page)
-        self.load_projects()
 
     def on_tab_changed(self, event):
         """Handle tab selection events."""
         selected_tab = self.pages.index(self.pages.select())
 
-        # Tab index 0: Projects
-        if selected_tab == 0:
-            self.load_projects()
-
-        # Tab index 1: Global Chat
-        elif selected_tab == 1:
-            self.load_global_chat_history()
-
+        # The views are kept up to date by on_database_change, so switching tabs
+        # only reloads a view that missed changes made by another process.
         # Tab index 2: Project Chat
-        elif selected_tab == 2:
-            # Only load project chat if a project is selected
-            if self.current_project != "main":
-                self.load_chat_history()
-            else:
-                # If no project is selected, switch back to Global Chat
-                self.pages.select(1)
+        if selected_tab == VIEW_PROJECT_CHAT and self.current_project == "main":
+            # If no project is selected, switch back to Global Chat
+            self.pages.select(0)
+        elif selected_tab in self.stale_views:
+            self.refresh_view(selected_tab)
+
+    def refresh_visible_view(self):
+        """Reload the visible tab after another process changed the database; mark the others stale."""
+        visible = self.pages.index(self.pages.select())
+        self.stale_views = {VIEW_GLOBAL_CHAT, VIEW_PROJECTS, VIEW_PROJECT_CHAT} - {visible}
+        self.refresh_view(visible)
+
+    def refresh_view(self, view):
+        """Reload one view and clear its stale mark."""
+        self.stale_views.discard(view)
+        if view == VIEW_GLOBAL_CHAT:
+            self.load_global_chat_history()
+        elif view == VIEW_PROJECTS:
+            self.load_projects()
+        elif view == VIEW_PROJECT_CHAT and self.current_project != "main":
+            self.load_chat_history()
+
+    def bind_activity_events(self):
+        """Speed polling up on user input and pause it while the window is iconified or withdrawn."""
+        for sequence in ("<KeyPress>", "<ButtonPress>", "<MouseWheel>"):
+            self.root.bind_all(sequence, self.on_user_activity, add="+")
+        self.root.bind("<FocusIn>", self.on_user_activity, add="+")
+        self.root.bind("<Map>", self.on_window_mapped, add="+")
+        self.root.bind("<Unmap>", self.on_window_unmapped, add="+")
+
+    def on_user_activity(self, event=None):
+        self.refresh_scheduler.activity()
+
+    def on_window_mapped(self, event):
+        # The root's bindings also fire for every child widget
+        if event.widget is self.root:
+            self.refresh_scheduler.resume()
+
+    def on_window_unmapped(self, event):
+        if event.widget is self.root:
+            self.refresh_scheduler.pause()
+
+    def schedule_maintenance(self, delay):
+        """Run the next retention step once Tk is idle, at least delay ms from now."""
+        if self.auto_update_active:
+            self.root.after(
+                delay, lambda: self.root.after_idle(self.run_maintenance_step)
+            )
 
-    def auto_update(self):
-        """Periodically refresh the chat and projects."""
+    def schedule_reminders(self):
+        """Run the reminder pipeline again when the next reminder is due (within a minute at most)."""
         if self.auto_update_active:
-            # Load global chat history
-            self.load_global_chat_history()
+            self.reminder_job = self.root.after(int(self.reminders.next_delay() * 1000), self.deliver_reminders)
+
+    def deliver_reminders(self):
+        """Show the reminders that are due as one toast, then reschedule."""
+        self.reminder_job = None
+        try:
+            self.reminders.tick()
+        except sqlite3.OperationalError:
+            # Another process holds the write lock; the reminders are picked up next time
+            pass
+        self.schedule_reminders()
+
+    def run_maintenance_step(self):
+        """Archive one batch of old messages or release free pages, then reschedule."""
+        if not self.auto_update_active:
+            return
+        try:
+            more = self.retention.step()
+        except sqlite3.OperationalError:
+            # Another process holds the write lock; try again later
+            more = False
+        # Keep going while there is work, otherwise check again in ten minutes
+        self.schedule_maintenance(200 if more else 600000)
+
+    def on_database_change(self, event):
+        """Apply a change event from the database handler to the affected rows only."""
+        if isinstance(event, MessageInserted):
+            self.show_message(event.message)
+
+        elif isinstance(event, MessageDeleted):
+            self.remove_message_widget(event.message_id)
+
+        elif isinstance(event, MessageMoved):
+            if event.old_project in ("main", self.current_project):
+                self.remove_message_widget(event.message_id)
+            if event.new_project in ("main", self.current_project):
+                self.show_message(self.db_handler.get_message(event.message_id))
+
+        # Project counts are kept by triggers; pick up the folders that changed
+        self.load_projects()
 
-            # Load project chat history if a project is selected
-            if self.current_project != "main":
-                self.load_chat_history()
+    def show_message(self, msg):
+        """Add a message to whichever open view it belongs to, if it is not shown already."""
+        if msg is None:
+            return
+        if self.find_row(msg['id'])[1] is not None:
+            return
 
-            # Load projects
-            self.load_projects()
+        if msg['project'] == "main":
+            self.add_message_to_global_chat(
+                msg['sender'], msg['message'], msg['message_type'], msg['file_path'], msg['id']
+            )
+        elif msg['project'] == self.current_project:
+            self.add_message_to_chat(
+                msg['sender'], msg['message'], msg['message_type'], msg['file_path'], msg['id'], msg['project']
+            )
 
-            # Schedule next update
-            self.root.after(5000, self.auto_update)
+    def queue_message(self, row):
+        """
+        Hand a new message to the write-behind queue.
+
+        Returns:
+            int: The provisional ID the message is shown under until it is stored
+        """
+        provisional_id = self.next_provisional_id
+        self.next_provisional_id -= 1
+        self.pending_messages[provisional_id] = {"row": row, "error": None}
+        self.write_queue.submit(provisional_id, row)
+        self.start_write_polling()
+        return provisional_id
+
+    def show_pending_message(self, provisional_id):
+        """Add a message that is not stored yet to the view it belongs to."""
+        row = self.pending_messages[provisional_id]["row"]
+        if row["project"] == "main":
+            self.add_message_to_global_chat(
+                row["sender"], row["message"], row["message_type"], row["file_path"], provisional_id
+            )
+        elif row["project"] == self.current_project:
+            self.add_message_to_chat(
+                row["sender"], row["message"], row["message_type"], row["file_path"], provisional_id
+            )
+
+    def retry_message(self, provisional_id):
+        """Queue a message that failed to save once more."""
+        pending = self.pending_messages.get(provisional_id)
+        if pending is None:
+            return
+        pending["error"] = None
+        self.write_queue.submit(provisional_id, pending["row"])
+        self.start_write_polling()
+
+        msg_frame = self.find_row(provisional_id)[1]
+        if msg_frame is not None:
+            self.show_write_status(msg_frame, provisional_id)
+
+    def start_write_polling(self):
+        """Poll the write-behind queue until every queued message is stored or has failed."""
+        if not self.write_poll_active:
+            self.write_poll_active = True
+            self.root.after(100, self.process_write_results)
+
+    def process_write_results(self):
+        """Reconcile provisional rows with the outcome of the write-behind queue."""
+        results = self.write_queue.drain_results()
+        if any(result.ok for result in results):
+            # The queue's group commits come from another connection; their rows are handled below,
+            # so the change poller must not take them for another process and reload the view
+            self.db_handler.absorb_external_changes()
+        for result in results:
+            registry, msg_frame = self.find_row(result.provisional_id)
+
+            if not result.ok:
+                self.pending_messages[result.provisional_id]["error"] = str(result.error)
+                if msg_frame is not None:
+                    self.show_write_status(msg_frame, result.provisional_id)
+                continue
+
+            pending = self.pending_messages.pop(result.provisional_id, None)
+            if pending is not None and pending["row"].get("file_path"):
+                # Extract the attachment's text for search
+                self.previews.request(pending["row"]["file_path"], result.message_id)
+                self.start_preview_polling()
+            if msg_frame is not None and result.message_id in registry:
+                # A reload already picked up the stored row
+                registry.remove(result.provisional_id)
+            elif msg_frame is not None:
+                registry.rename(result.provisional_id, result.message_id)
+                self.bind_message_actions(msg_frame, result.message_id)
+
+            # The row was committed on the writer's connection, so forward the
+            # event to in-process subscribers (the row itself is already shown)
+            self.db_handler.emit(MessageInserted(self.db_handler.get_message(result.message_id)))
+
+        # Failed rows wait for a retry, so only rows still in flight keep the poll going
+        in_flight = any(pending["error"] is None for pending in self.pending_messages.values())
+        if self.auto_update_active and in_flight:
+            self.root.after(100, self.process_write_results)
+        else:
+            self.write_poll_active = False
+
+    @property
+    def message_widgets(self):
+        """Message ID -> row, over every chat view (a snapshot, for inspection)."""
+        rows = {}
+        for registry in self.chat_rows.values():
+            rows.update(registry.items())
+        return rows
+
+    def find_row(self, message_id):
+        """
+        Return the row showing a message and the registry of its view.
+
+        Returns:
+            tuple: (RowRegistry, row frame), or (None, None) if no view shows the message
+        """
+        for registry in self.chat_rows.values():
+            msg_frame = registry.get(message_id)
+            if msg_frame is not None:
+                return registry, msg_frame
+        return None, None
+
+    def remove_message_widget(self, message_id):
+        """Remove a message row from the views, if it is shown."""
+        for registry in self.chat_rows.values():
+            registry.remove(message_id)
+        self.selected_messages.discard(message_id)
+
+    def debug_counters(self):
+        """
+        Return counts of the live rows, widgets and images, to check that memory stays flat.
+
+        Walks the whole widget tree, so it is meant for debugging and soak runs.
+        """
+        counters = {
+            "global_rows": self.chat_rows[VIEW_GLOBAL_CHAT].counters()["rows"],
+            "project_rows": self.chat_rows[VIEW_PROJECT_CHAT].counters()["rows"],
+        }
+        for registry in self.chat_rows.values():
+            for name, value in registry.counters().items():
+                if name != "rows":
+                    counters[name] = counters.get(name, 0) + value
+
+        live_widgets = 0
+        stack = [self.root]
+        while stack:
+            widget = stack.pop()
+            live_widgets += 1
+            stack.extend(widget.winfo_children())
+        counters["live_widgets"] = live_widgets
+        counters["row_images"] = len(live_images)
+        # Includes the images of the ttk theme
+        counters["tk_images"] = len(self.root.image_names())
+        counters["lazy_previews"] = sum(len(rows) for rows in self.lazy_previews.values())
+        counters["preview_waiters"] = sum(len(rows) for rows in self.preview_waiters.values())
+        return counters
+
+    def show_debug_counters(self):
+        """Show debug_counters in a message box."""
+        counters = self.debug_counters()
+        messagebox.showinfo("Debug Counters", "\n".join(f"{name}: {value}" for name, value in counters.items()))
+
+    def toggle_selection(self, message_id, selected):
+        """Add a message to, or remove it from, the bulk selection."""
+        if selected:
+            self.selected_messages.add(message_id)
+        else:
+            self.selected_messages.discard(message_id)
+
+    def clear_selection(self):
+        """Unselect every message."""
+        self.selected_messages.clear()
+        for registry in self.chat_rows.values():
+            for msg_frame in registry.rows.values():
+                msg_frame.select_var.set(False)
+
+    def get_selection(self):
+        """Return the selected message IDs, or None after telling the user nothing is selected."""
+        if not self.selected_messages:
+            messagebox.showinfo("No selection", "Select messages with their checkbox first.")
+            return None
+        return sorted(self.selected_messages)
+
+    def delete_selected_messages(self):
+        """Delete every selected message in one transaction."""
+        message_ids = self.get_selection()
+        if message_ids is None:
+            return
+        if messagebox.askyesno("Confirm Delete", f"Delete {len(message_ids)} selected message(s)?"):
+            # Rows are removed by on_database_change
+            deleted = self.db_handler.bulk_delete_messages(message_ids)
+            self.clear_selection()
+            messagebox.showinfo("Success", f"{deleted} message(s) deleted. Use Edit > Undo to restore them.")
+
+    def move_selected_messages(self):
+        """Move every selected message to a project in one transaction."""
+        message_ids = self.get_selection()
+        if message_ids is not None:
+            self.change_message_project(message_ids)
+
+    def reclassify_selected_messages(self):
+        """Send the selected messages back to the classification backlog."""
+        message_ids = self.get_selection()
+        if message_ids is None:
+            return
+        queued = self.db_handler.bulk_reclassify_messages(message_ids)
+        self.clear_selection()
+        messagebox.showinfo("Success", f"{queued} message(s) will be classified again.")
+
+    def undo_last_bulk_action(self):
+        """Revert the last bulk move, delete or reclassify."""
+        restored = self.db_handler.undo_last_batch()
+        if restored:
+            messagebox.showinfo("Undo", f"{restored} message(s) restored.")
+        else:
+            messagebox.showinfo("Undo", "Nothing to undo.")
 
     def attach_file(self, is_global=False):
         """Handle attaching a file to the message."""
@@ -367,20 +817,19 @@ class UIManager:
             if not message:
                 message = f"Sent a {message_type}: {os.path.basename(self.current_file_path)}"
 
-        message_id = self.db_handler.insert_message(
-            "You", 
-            message, 
-            category="user_message", 
-            message_type=message_type,
-            project=project,
-            file_path=file_content if file_content else ""
-        )
+        row = {
+            "sender": "You",
+            "message": message,
+            "category": "user_message",
+            "message_type": message_type,
+            "project": project,
+            "file_path": file_content if file_content else ""
+        }
 
-        # Add message to the appropriate chat
-        if is_global:
-            self.add_message_to_global_chat("You", message, message_type, file_content, message_id)
-        else:
-            self.add_message_to_chat("You", message, message_type, file_content, message_id)
+        # Show the message right away; the write-behind queue stores it and
+        # process_write_results swaps in the real ID once it is committed
+        provisional_id = self.queue_message(row)
+        self.show_pending_message(provisional_id)
 
         entry_widget.delete(0, tk.END)
         self.current_file_path = None
@@ -389,127 +838,234 @@ class UIManager:
 
     def add_message_to_global_chat(self, sender, message, message_type='text', file_path=None, message_id=None):
         """Add a message to the global chat display."""
-        msg_frame = ttk.Frame(self.global_messages_frame)
-        msg_frame.pack(fill=tk.X, padx=5, pady=5)
-
-        sender_label = ttk.Label(msg_frame, text=f"{sender}:", font=("Arial", 10, "bold"))
-        sender_label.pack(anchor=tk.W, padx=5, pady=2)
-
-        if message_type == 'text':
-            msg_content = ttk.Label(msg_frame, text=message, wraplength=400, justify=tk.LEFT)
-            msg_content.pack(anchor=tk.W, padx=5, pady=2)
-        elif message_type == 'image' and file_path and os.path.exists(file_path):
-            try:
-                img = Image.open(file_path)
-                img.thumbnail((300, 300))
-                photo = ImageTk.PhotoImage(img)
-                msg_content = ttk.Label(msg_frame, image=photo)
-                msg_content.image = photo
-                msg_content.pack(anchor=tk.W, padx=5, pady=2)
-            except Exception as e:
-                msg_content = ttk.Label(msg_frame, text=f"Error displaying image: {str(e)}")
-                msg_content.pack(anchor=tk.W, padx=5, pady=2)
-        elif message_type == 'pdf' and file_path and os.path.exists(file_path):
-            msg_content = ttk.Label(msg_frame, text=message, wraplength=400, justify=tk.LEFT)
-            msg_content.pack(anchor=tk.W, padx=5, pady=2)
-
-            # Create a frame for PDF actions
-            pdf_actions = ttk.Frame(msg_frame)
-            pdf_actions.pack(anchor=tk.W, padx=5, pady=2)
-
-            # Add both buttons to the same frame
-            open_btn = ttk.Button(pdf_actions, text="Open PDF", command=lambda: self.open_file(file_path))
-            open_btn.pack(side=tk.LEFT, padx=2)
-
-        else:
-            msg_content = ttk.Label(msg_frame, text=message, wraplength=400, justify=tk.LEFT)
-            msg_content.pack(anchor=tk.W, padx=5, pady=2)
-
-        action_frame = ttk.Frame(msg_frame)
-        action_frame.pack(anchor=tk.W, padx=5, pady=2)
-
-        copy_btn = ttk.Button(action_frame, text="Copy", command=lambda: self.copy_message(message))
-        copy_btn.pack(side=tk.LEFT, padx=2)
-
-        if message_id:
-            delete_btn = ttk.Button(action_frame, text="Delete", 
-                                  command=lambda: self.delete_message(message_id, msg_frame))
-            delete_btn.pack(side=tk.LEFT, padx=2)
-
-            change_proj_btn = ttk.Button(action_frame, text="Move to Project", 
-                                       command=lambda: self.change_message_project(message_id))
-            change_proj_btn.pack(side=tk.LEFT, padx=2)
-
-            self.message_widgets[message_id] = msg_frame
-
-        self.global_messages_canvas.update_idletasks()
-        self.global_messages_canvas.configure(scrollregion=self.global_messages_canvas.bbox("all"))
-        self.global_messages_canvas.yview_moveto(1.0)
+        self.add_message_row(self.global_messages_frame, self.global_messages_canvas,
+                             sender, message, message_type, file_path, message_id)
 
     def add_message_to_chat(self, sender, message, message_type='text', file_path=None, message_id=None, project=None):
         """Add a message to the project chat display."""
-        msg_frame = ttk.Frame(self.messages_frame)
+        self.add_message_row(self.messages_frame, self.messages_canvas,
+                             sender, message, message_type, file_path, message_id)
+
+    def add_message_row(self, messages_frame, messages_canvas, sender, message, message_type='text',
+                        file_path=None, message_id=None):
+        """
+        Add a message row to a chat display.
+
+        A negative message_id is a provisional ID for a message the write-behind
+        queue has not stored yet; its actions stay disabled until the real ID is known.
+        Text rows are taken from the view's pool of released rows when it has one.
+        """
+        view = VIEW_GLOBAL_CHAT if messages_frame is self.global_messages_frame else VIEW_PROJECT_CHAT
+        registry = self.chat_rows[view]
+        # Encrypted databases are decrypted here, one row at a time, only for the rows shown
+        message = self.db_handler.reveal(message)
+        file_path = self.db_handler.reveal(file_path, "file_path")
+        recyclable = message_type == 'text' and bool(message_id)
+
+        msg_frame = registry.acquire() if recyclable else None
+        created = msg_frame is None
+        if created:
+            msg_frame = self.build_message_row(messages_frame, messages_canvas, message_type, file_path, message_id)
+            msg_frame.recyclable = recyclable
         msg_frame.pack(fill=tk.X, padx=5, pady=5)
 
-        sender_label = ttk.Label(msg_frame, text=f"{sender}:", font=("Arial", 10, "bold"))
-        sender_label.pack(anchor=tk.W, padx=5, pady=2)
+        msg_frame.sender_label.config(text=f"{sender}:")
+        msg_frame.content_label.config(text=message)
+        msg_frame.copy_btn.config(command=lambda: self.copy_message(message))
 
-        if message_type == 'text':
-            msg_content = ttk.Label(msg_frame, text=message, wraplength=400, justify=tk.LEFT)
-            msg_content.pack(anchor=tk.W, padx=5, pady=2)
-        elif message_type == 'image' and file_path and os.path.exists(file_path):
-            try:
-                img = Image.open(file_path)
-                img.thumbnail((300, 300))
-                photo = ImageTk.PhotoImage(img)
-                msg_content = ttk.Label(msg_frame, image=photo)
-                msg_content.image = photo
-                msg_content.pack(anchor=tk.W, padx=5, pady=2)
-            except Exception as e:
-                msg_content = ttk.Label(msg_frame, text=f"Error displaying image: {str(e)}")
-                msg_content.pack(anchor=tk.W, padx=5, pady=2)
-        elif message_type == 'pdf' and file_path and os.path.exists(file_path):
-            msg_content = ttk.Label(msg_frame, text=message, wraplength=400, justify=tk.LEFT)
-            msg_content.pack(anchor=tk.W, padx=5, pady=2)
-
-            # Create a frame for PDF actions
-            pdf_actions = ttk.Frame(msg_frame)
-            pdf_actions.pack(anchor=tk.W, padx=5, pady=2)
-
-            # Add both buttons to the same frame
-            open_btn = ttk.Button(pdf_actions, text="Open PDF", command=lambda: self.open_file(file_path))
+        if message_id:
+            msg_frame.select_var.set(message_id in self.selected_messages)
+            if message_id < 0:
+                self.show_write_status(msg_frame, message_id)
+            else:
+                self.bind_message_actions(msg_frame, message_id)
+        registry.register(message_id, msg_frame, created)
+        self.schedule_layout_update(messages_canvas)
+
+    def schedule_layout_update(self, canvas):
+        """
+        Lay out a chat canvas once Tk is idle (at most one pending update per canvas).
+
+        A history load adds every row before Tk gets idle, so the geometry pass
+        and the scroll region update run once for the whole batch.
+        """
+        if canvas not in self.layout_updates_scheduled:
+            self.layout_updates_scheduled.add(canvas)
+            self.root.after_idle(lambda: self.update_chat_layout(canvas))
+
+    def update_chat_layout(self, canvas):
+        """Fit the scroll region of a chat canvas to its rows and scroll to the newest one."""
+        self.layout_updates_scheduled.discard(canvas)
+        canvas.update_idletasks()
+        canvas.configure(scrollregion=canvas.bbox("all"))
+        canvas.yview_moveto(1.0)
+        self.schedule_preview_check(canvas)
+
+    def build_message_row(self, messages_frame, messages_canvas, message_type, file_path, message_id):
+        """Create the widgets of a message row; add_message_row fills in the message."""
+        msg_frame = ttk.Frame(messages_frame)
+
+        msg_frame.sender_label = ttk.Label(msg_frame, font=("Arial", 10, "bold"))
+        msg_frame.sender_label.pack(anchor=tk.W, padx=5, pady=2)
+
+        msg_frame.content_label = ttk.Label(msg_frame, wraplength=400, justify=tk.LEFT)
+        msg_frame.content_label.pack(anchor=tk.W, padx=5, pady=2)
+
+        if message_type != 'text' and file_path and os.path.exists(file_path):
+            # No previews of encrypted attachments: their thumbnails would be cached unencrypted
+            if not is_encrypted_file(file_path):
+                # Filled in by render_preview once the row scrolls into view
+                msg_frame.preview_label = ttk.Label(msg_frame, text="Loading preview…", foreground="gray",
+                                                    wraplength=400, justify=tk.LEFT)
+                msg_frame.preview_label.pack(anchor=tk.W, padx=5, pady=2)
+                msg_frame.preview_path = file_path
+                msg_frame.preview_requested = False
+                self.lazy_previews.setdefault(messages_canvas, []).append(msg_frame)
+
+            # Create a frame for file actions
+            file_actions = ttk.Frame(msg_frame)
+            file_actions.pack(anchor=tk.W, padx=5, pady=2)
+
+            open_btn = ttk.Button(file_actions, text="Open PDF" if message_type == 'pdf' else "Open File",
+                                  command=lambda: self.open_file(file_path))
             open_btn.pack(side=tk.LEFT, padx=2)
 
-        else:
-            msg_content = ttk.Label(msg_frame, text=message, wraplength=400, justify=tk.LEFT)
-            msg_content.pack(anchor=tk.W, padx=5, pady=2)
-
         action_frame = ttk.Frame(msg_frame)
         action_frame.pack(anchor=tk.W, padx=5, pady=2)
 
-        copy_btn = ttk.Button(action_frame, text="Copy", command=lambda: self.copy_message(message))
-        copy_btn.pack(side=tk.LEFT, padx=2)
+        msg_frame.copy_btn = ttk.Button(action_frame, text="Copy")
+        msg_frame.copy_btn.pack(side=tk.LEFT, padx=2)
 
         if message_id:
-            delete_btn = ttk.Button(action_frame, text="Delete", 
-                                  command=lambda: self.delete_message(message_id, msg_frame))
-            delete_btn.pack(side=tk.LEFT, padx=2)
-
-            change_proj_btn = ttk.Button(action_frame, text="Move to Project", 
-                                       command=lambda: self.change_message_project(message_id))
-            change_proj_btn.pack(side=tk.LEFT, padx=2)
-
-            self.message_widgets[message_id] = msg_frame
+            # Checkbox for the bulk actions of the Edit menu
+            msg_frame.select_var = tk.BooleanVar(msg_frame, value=False)
+            msg_frame.select_check = ttk.Checkbutton(action_frame, variable=msg_frame.select_var)
+            msg_frame.select_check.pack(side=tk.LEFT, padx=2, before=msg_frame.copy_btn)
+
+            msg_frame.delete_btn = ttk.Button(action_frame, text="Delete")
+            msg_frame.delete_btn.pack(side=tk.LEFT, padx=2)
+
+            msg_frame.move_btn = ttk.Button(action_frame, text="Move to Project")
+            msg_frame.move_btn.pack(side=tk.LEFT, padx=2)
+
+            # Shows the state of a write-behind insert
+            msg_frame.status_label = ttk.Label(action_frame, text="", foreground="gray")
+            msg_frame.retry_btn = ttk.Button(action_frame, text="Retry")
+
+        return msg_frame
+
+    def on_chat_scrolled(self, canvas, scrollbar, first, last):
+        """yscrollcommand of the chat canvases: move the scrollbar and load previews that came into view."""
+        scrollbar.set(first, last)
+        self.schedule_preview_check(canvas)
+
+    def schedule_preview_check(self, canvas):
+        """Look for rows needing a preview once Tk is idle (at most one pending check per canvas)."""
+        if canvas not in self.preview_checks_scheduled:
+            self.preview_checks_scheduled.add(canvas)
+            self.root.after_idle(lambda: self.load_visible_previews(canvas))
+
+    def load_visible_previews(self, canvas):
+        """Request the previews of the rows currently visible in a chat canvas."""
+        self.preview_checks_scheduled.discard(canvas)
+        rows = [row for row in self.lazy_previews.get(canvas, ()) if row.winfo_exists()]
+        if not rows:
+            self.lazy_previews.pop(canvas, None)
+            return
 
-        self.messages_canvas.update_idletasks()
-        self.messages_canvas.configure(scrollregion=self.messages_canvas.bbox("all"))
-        self.messages_canvas.yview_moveto(1.0)
+        # Rows live in a frame placed at the canvas origin, so their y is a canvas coordinate
+        top = canvas.canvasy(0)
+        bottom = top + canvas.winfo_height()
+        for row in rows:
+            y = row.winfo_y()
+            if y + row.winfo_height() < top or y > bottom:
+                continue
+            row.preview_requested = True
+            preview = self.previews.request(row.preview_path)
+            if preview is not None:
+                self.render_preview(row, preview)
+            else:
+                self.preview_waiters.setdefault(row.preview_path, []).append(row)
+
+        self.lazy_previews[canvas] = [row for row in rows if not row.preview_requested]
+        self.start_preview_polling()
+
+    def render_preview(self, msg_frame, preview):
+        """Show a finished preview (thumbnail, summary and text excerpt) in a message row."""
+        caption = describe(preview)
+        if preview["error"]:
+            caption += f"\n{preview['error']}"
+        elif preview["text"]:
+            caption += "\n" + preview["text"][:200].strip()
+
+        label = msg_frame.preview_label
+        label.config(text=caption, foreground="")
+        if preview["thumbnail"] and os.path.exists(preview["thumbnail"]):
+            try:
+                photo = ImageTk.PhotoImage(Image.open(preview["thumbnail"]))
+                label.config(compound=tk.TOP)
+                # Released with the row (see chat_rows.release_images)
+                attach_image(label, photo)
+            except Exception as e:
+                label.config(text=f"{caption}\nError displaying preview: {str(e)}")
+
+    def start_preview_polling(self):
+        """Poll the preview workers until every requested preview is done."""
+        if not self.preview_poll_active and self.previews.busy:
+            self.preview_poll_active = True
+            self.root.after(100, self.process_preview_results)
+
+    def process_preview_results(self):
+        """Render finished previews and store the extracted text for search."""
+        for file_path, message_ids, preview in self.previews.drain_results():
+            for message_id in message_ids:
+                self.db_handler.store_attachment_text(message_id, preview["text"], preview["page_count"])
+            for row in self.preview_waiters.pop(file_path, ()):
+                if row.winfo_exists():
+                    self.render_preview(row, preview)
+
+        if self.auto_update_active and self.previews.busy:
+            self.root.after(100, self.process_preview_results)
+        else:
+            self.preview_poll_active = False
+
+    def bind_message_actions(self, msg_frame, message_id):
+        """Point the Delete and Move buttons of a row at a stored message."""
+        msg_frame.delete_btn.config(command=lambda: self.delete_message(message_id, msg_frame))
+        msg_frame.move_btn.config(command=lambda: self.change_message_project(message_id))
+        msg_frame.select_check.config(
+            command=lambda: self.toggle_selection(message_id, msg_frame.select_var.get())
+        )
+        msg_frame.delete_btn.state(["!disabled"])
+        msg_frame.move_btn.state(["!disabled"])
+        msg_frame.select_check.state(["!disabled"])
+        msg_frame.status_label.pack_forget()
+        msg_frame.retry_btn.pack_forget()
+
+    def show_write_status(self, msg_frame, provisional_id):
+        """Show whether a provisional row is still being saved or failed to save."""
+        msg_frame.delete_btn.state(["disabled"])
+        msg_frame.move_btn.state(["disabled"])
+        msg_frame.select_check.state(["disabled"])
+
+        error = self.pending_messages.get(provisional_id, {}).get("error")
+        if error is None:
+            msg_frame.status_label.config(text="Saving…", foreground="gray")
+            msg_frame.retry_btn.pack_forget()
+        else:
+            msg_frame.status_label.config(text=f"Not saved: {error}", foreground="red")
+            msg_frame.retry_btn.config(command=lambda: self.retry_message(provisional_id))
+            msg_frame.retry_btn.pack(side=tk.RIGHT, padx=2)
+        msg_frame.status_label.pack(side=tk.RIGHT, padx=2)
 
     def open_file(self, file_path):
         """Open a file with the system's default application."""
         import subprocess
         import platform
 
+        if self.db_handler.cipher is not None and is_encrypted_file(file_path):
+            file_path = self.decrypt_attachment(file_path)
+
         if platform.system() == 'Darwin':  # macOS
             subprocess.call(('open', file_path))
         elif platform.system() == 'Windows':
@@ -517,6 +1073,20 @@ class UIManager:
         else:  # Linux
             subprocess.call(('xdg-open', file_path))
 
+    def decrypt_attachment(self, file_path):
+        """Decrypt an attachment from the vault into a private temporary directory, removed on close."""
+        import tempfile
+
+        if self.decrypted_dir is None:
+            self.decrypted_dir = tempfile.mkdtemp(prefix="reminder-attachments-")
+        name = os.path.basename(file_path)
+        if name.endswith(".enc"):
+            name = name[:-len(".enc")]
+        decrypted_path = os.path.join(self.decrypted_dir, name)
+        if not os.path.exists(decrypted_path):
+            self.db_handler.cipher.decrypt_file(file_path, decrypted_path)
+        return decrypted_path
+
     def copy_message(self, message):
         """Copy message text to clipboard."""
         self.root.clipboard_clear()
@@ -526,31 +1096,31 @@ class UIManager:
     def delete_message(self, message_id, msg_frame):
         """Delete a message from the database and UI."""
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this message?"):
+            # The row is removed by on_database_change
             if self.db_handler.delete_message(message_id):
-                msg_frame.destroy()
-                if message_id in self.message_widgets:
-                    del self.message_widgets[message_id]
                 messagebox.showinfo("Success", "Message deleted successfully!")
             else:
                 messagebox.showerror("Error", "Failed to delete message.")
 
     def change_message_project(self, message_id):
-        """Change the project of a message."""
-        projects = self.db_handler.get_projects()
+        """
+        Change the project of a message.
 
+        message_id may also be a list of IDs; they are then moved together in one
+        transaction that Edit > Undo can revert.
+        """
         dialog = tk.Toplevel(self.root)
         dialog.title("Select Project")
-        dialog.geometry("300x200")
+        dialog.geometry("320x380")
         dialog.transient(self.root)
         dialog.grab_set()
 
         ttk.Label(dialog, text="Select a project:").pack(pady=10)
 
-        project_var = tk.StringVar(dialog)
-        project_var.set(self.current_project)
-
-        project_menu = ttk.OptionMenu(dialog, project_var, *projects)
-        project_menu.pack(pady=5)
+        # Subprojects are loaded as their parents are opened
+        picker = ProjectTree(dialog, self.db_handler, columns=False, include_main=True, height=8)
+        picker.pack(fill=tk.BOTH, expand=True, padx=10)
+        picker.reveal(self.current_project)
 
         ttk.Label(dialog, text="Or create a new project:").pack(pady=5)
         new_project_entry = ttk.Entry(dialog, width=20)
@@ -558,15 +1128,18 @@ class UIManager:
 
         def on_submit():
             new_project = new_project_entry.get().strip()
-            selected_project = project_var.get()
+            selected_project = picker.selected() or self.current_project
 
             if new_project:
                 selected_project = new_project
 
-            if self.db_handler.update_message_project(message_id, selected_project):
+            if isinstance(message_id, list):
+                moved = self.db_handler.bulk_move_messages(message_id, selected_project)
+                dialog.destroy()
+                self.clear_selection()
+                messagebox.showinfo("Success", f"{moved} message(s) moved. Use Edit > Undo to move them back.")
+            elif self.db_handler.update_message_project(message_id, selected_project):
                 dialog.destroy()
-                self.load_chat_history()
-                self.load_projects()
                 messagebox.showinfo("Success", "Message moved successfully!")
             else:
                 messagebox.showerror("Error", "Failed to move message.")
@@ -575,9 +1148,9 @@ class UIManager:
 
     def load_global_chat_history(self):
         """Load chat history for the global chat (main project)."""
-        # Clear existing messages
-        for widget in self.global_messages_frame.winfo_children():
-            widget.destroy()
+        # Release the rows shown so far (text rows are kept for reuse)
+        self.chat_rows[VIEW_GLOBAL_CHAT].clear()
+        self.lazy_previews.pop(self.global_messages_canvas, None)
 
         # Get messages from database for the main project
         messages = self.db_handler.get_messages("main")
@@ -592,12 +1165,16 @@ class UIManager:
                 msg['id']
             )
 
+        # Messages still on their way to the database
+        for provisional_id, pending in self.pending_messages.items():
+            if pending["row"]["project"] == "main":
+                self.show_pending_message(provisional_id)
+
     def load_chat_history(self, project=None):
         """Load chat history for the current project."""
-        # Clear existing messages
-        for widget in self.messages_frame.winfo_children():
-            widget.destroy()
-        self.message_widgets.clear()
+        # Release the rows shown so far; the global chat keeps its own
+        self.chat_rows[VIEW_PROJECT_CHAT].clear()
+        self.lazy_previews.pop(self.messages_canvas, None)
 
         # Get messages from database
         messages = self.db_handler.get_messages(project or self.current_project)
@@ -613,11 +1190,18 @@ class UIManager:
                 msg['project']
             )
 
+        # Messages still on their way to the database
+        for provisional_id, pending in self.pending_messages.items():
+            if pending["row"]["project"] == (project or self.current_project):
+                self.show_pending_message(provisional_id)
+
     def create_new_project(self):
-        """Create a new project."""
+        """Create a new project, inside the project selected in the tree if the user wants."""
+        parent = self.project_tree.selected()
+
         dialog = tk.Toplevel(self.root)
         dialog.title("New Project")
-        dialog.geometry("300x150")
+        dialog.geometry("300x180")
         dialog.transient(self.root)
         dialog.grab_set()
 
@@ -625,23 +1209,64 @@ class UIManager:
         project_entry = ttk.Entry(dialog, width=20)
         project_entry.pack(pady=5)
 
+        inside_var = tk.BooleanVar(dialog, value=parent is not None)
+        if parent is not None:
+            ttk.Checkbutton(dialog, text=f"Inside {parent}", variable=inside_var).pack(pady=5)
+
         def on_submit():
             project_name = project_entry.get().strip()
             if project_name:
-                if self.db_handler.create_project(project_name):
+                if self.db_handler.create_project(project_name, parent if inside_var.get() else None):
                     dialog.destroy()
-                    self.load_projects()
                     messagebox.showinfo("Success", "Project created successfully!")
                 else:
                     messagebox.showerror("Error", "Failed to create project.")
 
         ttk.Button(dialog, text="Create", command=on_submit).pack(pady=10)
 
-    def search_messages(self):
-        """Open search dialog."""
+    def move_selected_project(self):
+        """Move the project selected in the tree, with its subprojects, into another project."""
+        project = self.project_tree.selected()
+        if project is None:
+            messagebox.showinfo("No selection", "Select a project in the tree first.")
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title(f"Move {project}")
+        dialog.geometry("320x380")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        ttk.Label(dialog, text="Move into:").pack(pady=10)
+        picker = ProjectTree(dialog, self.db_handler, columns=False, height=8)
+        picker.pack(fill=tk.BOTH, expand=True, padx=10)
+
+        top_level_var = tk.BooleanVar(dialog, value=False)
+        ttk.Checkbutton(dialog, text="Top level", variable=top_level_var).pack(pady=5)
+
+        def on_submit():
+            new_parent = None if top_level_var.get() else picker.selected()
+            if new_parent is None and not top_level_var.get():
+                messagebox.showinfo("No selection", "Select the new parent project, or tick Top level.", parent=dialog)
+                return
+            try:
+                moved = self.db_handler.move_project(project, new_parent)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=dialog)
+                return
+            if moved:
+                dialog.destroy()
+                # The tree follows through on_database_change
+            else:
+                messagebox.showerror("Error", "Failed to move project.", parent=dialog)
+
+        ttk.Button(dialog, text="Move", command=on_submit).pack(pady=10)
+
+    def search_messages(self, project=None):
+        """Open search dialog, optionally filtered to one project."""
         dialog = tk.Toplevel(self.root)
         dialog.title("Search Messages")
-        dialog.geometry("400x500")
+        dialog.geometry("450x600")
         dialog.transient(self.root)
         dialog.grab_set()
 
@@ -653,20 +1278,111 @@ class UIManager:
         search_entry = ttk.Entry(search_frame, textvariable=search_var)
         search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
 
+        # Rank by meaning (embedding similarity) instead of matching the text
+        similar_var = tk.BooleanVar(dialog, value=False)
+        # Search every profile instead of the open one
+        all_profiles_var = tk.BooleanVar(dialog, value=False)
+
+        # Filters run through query_messages; the choices are the values present in the database
+        filters_frame = ttk.LabelFrame(dialog, text="Filters")
+        filters_frame.pack(fill=tk.X, padx=5, pady=5)
+        known = self.db_handler.query_messages(limit=0).facets
+        filter_vars = {}
+        for row, column in enumerate(FACET_COLUMNS):
+            ttk.Label(filters_frame, text=column.replace("_", " ").capitalize() + ":").grid(
+                row=row, column=0, sticky=tk.W, padx=5, pady=2)
+            var = tk.StringVar(dialog, value=project if column == "project" and project else "")
+            values = [""] + sorted(str(value) for value, _ in known[column] if value is not None)
+            ttk.Combobox(filters_frame, textvariable=var, values=values).grid(
+                row=row, column=1, columnspan=3, sticky=tk.EW, padx=5, pady=2)
+            filter_vars[column] = var
+
+        from_var = tk.StringVar(dialog)
+        to_var = tk.StringVar(dialog)
+        ttk.Label(filters_frame, text="From:").grid(row=len(FACET_COLUMNS), column=0, sticky=tk.W, padx=5, pady=2)
+        ttk.Entry(filters_frame, textvariable=from_var, width=12).grid(row=len(FACET_COLUMNS), column=1, padx=5)
+        ttk.Label(filters_frame, text="To:").grid(row=len(FACET_COLUMNS), column=2, sticky=tk.W, padx=5)
+        ttk.Entry(filters_frame, textvariable=to_var, width=12).grid(row=len(FACET_COLUMNS), column=3, padx=5)
+        filters_frame.grid_columnconfigure(1, weight=1)
+
+        def build_query():
+            """Return the MessageQuery of the filter fields, or None if no filter is set."""
+            message_query = MessageQuery()
+            has_filters = False
+            for column, var in filter_vars.items():
+                if var.get().strip():
+                    message_query = message_query.where(column, var.get().strip())
+                    has_filters = True
+            # Dates are YYYY-MM-DD, both days included
+            start, end = from_var.get().strip(), to_var.get().strip()
+            if start or end:
+                start = datetime.strptime(start, "%Y-%m-%d") if start else None
+                end = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1) if end else None
+                message_query = message_query.between(start, end)
+                has_filters = True
+            return message_query if has_filters else None
+
         def perform_search():
             query = search_var.get().strip()
-            if query:
+            try:
+                message_query = build_query()
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be written as YYYY-MM-DD", parent=dialog)
+                return
+            if not query and message_query is None:
+                return
+
+            scores = {}
+            profile_of = {}
+            facets = None
+            locked = []
+            if all_profiles_var.get() and query:
+                matches = self.profiles.search(query)
+                results = [msg for _, msg in matches]
+                profile_of = {id(msg): profile for profile, msg in matches}
+                locked = self.profiles.locked_profiles()
+            elif similar_var.get() and query:
+                matches = self.get_semantic_index().search(query, k=20)
+                scores = dict(matches)
+                found = {msg['id']: msg for msg in self.db_handler.get_messages_by_ids(list(scores))}
+                results = [found[message_id] for message_id, _ in matches if message_id in found]
+            elif message_query is not None:
+                result = self.db_handler.query_messages(message_query.text(query), limit=200)
+                results = result.messages
+                facets = result
+            else:
+                # Plain text search also covers archived messages and attachment text
                 results = self.db_handler.search_messages(query)
-                results_text.delete(1.0, tk.END)
-                for msg in results:
-                    results_text.insert(tk.END, f"Project: {msg['project']}\n")
-                    results_text.insert(tk.END, f"Sender: {msg['sender']}\n")
-                    results_text.insert(tk.END, f"Message: {msg['message']}\n")
-                    results_text.insert(tk.END, "-" * 50 + "\n")
+
+            results_text.delete(1.0, tk.END)
+            if locked:
+                results_text.insert(tk.END, f"Not searched (encrypted, not unlocked): {', '.join(locked)}\n")
+            if facets is not None:
+                results_text.insert(tk.END, f"{facets.total} matching message(s)")
+                if facets.total > len(results):
+                    results_text.insert(tk.END, f", newest {len(results)} shown")
+                results_text.insert(tk.END, "\n")
+                for column, values in facets.facets.items():
+                    counts = ", ".join(f"{value}: {count}" for value, count in values[:5])
+                    results_text.insert(tk.END, f"{column.replace('_', ' ').capitalize()}: {counts}\n")
+                results_text.insert(tk.END, "=" * 50 + "\n")
+            for msg in results:
+                if id(msg) in profile_of:
+                    results_text.insert(tk.END, f"Profile: {profile_of[id(msg)]}\n")
+                if msg['id'] in scores:
+                    results_text.insert(tk.END, f"Similarity: {scores[msg['id']]:.2f}\n")
+                results_text.insert(tk.END, f"Project: {msg['project']}\n")
+                results_text.insert(tk.END, f"Sender: {msg['sender']}\n")
+                results_text.insert(tk.END, f"Message: {self.db_handler.reveal(msg['message'])}\n")
+                results_text.insert(tk.END, "-" * 50 + "\n")
 
         search_button = ttk.Button(search_frame, text="Search", command=perform_search)
         search_button.pack(side=tk.LEFT)
 
+        ttk.Checkbutton(dialog, text="Similar notes", variable=similar_var).pack(anchor=tk.W, padx=5)
+        if self.profiles is not None and len(self.profiles.profiles) > 1:
+            ttk.Checkbutton(dialog, text="All profiles", variable=all_profiles_var).pack(anchor=tk.W, padx=5)
+
         # Results area
         results_frame = ttk.Frame(dialog)
         results_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -681,24 +1397,35 @@ class UIManager:
         # Bind Enter key to search
         search_entry.bind("<Return>", lambda e: perform_search())
 
+    def get_semantic_index(self):
+        """Return the similarity index, building it on first use."""
+        if self.semantic_index is None:
+            # Imported here so numpy is only needed once similarity search is used
+            from gemini_utils import GeminiHandler
+            from semantic_index import SemanticIndex, build_embedder
+            from usage import UsageLedger
+            if self.usage_ledger is None:
+                self.usage_ledger = UsageLedger(self.db_handler.db_name)
+            # Gemini embeddings when an API key is configured, the offline embedder otherwise
+            embedder = build_embedder(GeminiHandler(ledger=self.usage_ledger))
+            self.semantic_index = SemanticIndex(self.db_handler, embedder)
+            self.semantic_index.sync()
+            self.semantic_index.subscribe()
+        return self.semantic_index
+
     def on_closing(self):
         """Handle application closing."""
         self.auto_update_active = False
+        self.refresh_scheduler.stop()
+        self.release_database()
+        if self.profiles is not None:
+            self.profiles.close()
+
         self.root.destroy()
 
     def retrieve_all_projects(self):
         """Retrieve all projects and their first 10 messages."""
-        projects = self.db_handler.get_projects()
-        result = []
-
-        for project in projects:
-            result.append(f"Project: {project}")
-            messages = self.db_handler.get_messages(project, limit=10)
-            for msg in messages:
-                result.append(f"- {msg['sender']}: {msg['message']}")
-            result.append("\n")
-
-        return "\n".join(result)
+        return self.db_handler.get_projects_context(limit=10)
 
     def retrieve_unprocessed_messages(self):
         """Retrieve all unprocessed messages."""
@@ -708,7 +1435,7 @@ class UIManager:
         for i, msg in enumerate(messages, 1):
             result.append(f"{i}. Project: {msg['project']}")
             result.append(f"   Sender: {msg['sender']}")
-            result.append(f"   Message: {msg['message']}")
+            result.append(f"   Message: {self.db_handler.reveal(msg['message'])}")
             result.append("")
 
         return "\n".join(result) 
@@ -0,0 +1,279 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Token counts of one response, from its usage_metadata
+Usage = namedtuple("Usage", ["prompt_tokens", "cached_tokens", "response_tokens", "thoughts_tokens", "total_tokens"])
+EMPTY_USAGE = Usage(0, 0, 0, 0, 0)
+
+# One row of UsageLedger.rollup; the grouping columns not asked for are None
+UsageRollup = namedtuple("UsageRollup", [
+    "day", "model", "operation", "requests", "errors", "prompt_chars", "context_chars",
+    "prompt_tokens", "cached_tokens", "response_tokens", "total_tokens", "avg_latency_ms", "max_latency_ms",
+])
+
+ROLLUP_COLUMNS = ("day", "model", "operation")
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of sending a request once the daily token budget is used up."""
+
+
+def usage_from_response(response):
+    """
+    Read the token counts of a google-genai response (or of a REST usageMetadata dict).
+
+    Missing counts are 0, e.g. for a request that failed or an API that reports no usage.
+    """
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is None and isinstance(response, dict):
+        metadata = response.get("usageMetadata") or response.get("usage_metadata")
+    if metadata is None:
+        return EMPTY_USAGE
+
+    def count(snake, camel):
+        value = metadata.get(snake, metadata.get(camel)) if isinstance(metadata, dict) else getattr(metadata, snake, None)
+        return value or 0
+
+    prompt = count("prompt_token_count", "promptTokenCount")
+    response_tokens = count("candidates_token_count", "candidatesTokenCount")
+    thoughts = count("thoughts_token_count", "thoughtsTokenCount")
+    return Usage(
+        prompt,
+        count("cached_content_token_count", "cachedContentTokenCount"),
+        response_tokens,
+        thoughts,
+        count("total_token_count", "totalTokenCount") or prompt + response_tokens + thoughts,
+    )
+
+
+class RequestRecord:
+    """Filled in by the caller of UsageLedger.track with what the request returned."""
+
+    def __init__(self):
+        self.usage = EMPTY_USAGE
+        self.attempt = 1
+        self.outcome = "ok"
+        self.error = None
+
+    def set_response(self, response):
+        self.usage = usage_from_response(response)
+
+    def mark_invalid(self, reason):
+        """Record the request as answered with a response that could not be used."""
+        self.outcome = "invalid"
+        self.error = reason[:500]
+
+
+class UsageLedger:
+    """
+    Accounting of every Gemini request: size, token counts, latency and outcome.
+
+    Each request is one row of the gemini_requests table, written on a
+    connection of its own so requests made on worker threads can be recorded
+    too. rollup() sums the rows by day, model and operation, and
+    check_budget() stops new requests once daily_token_budget tokens were
+    used today.
+    """
+
+    def __init__(self, db_name, daily_token_budget=None, clock=None):
+        """
+        Args:
+            db_name (str): SQLite database holding the gemini_requests table, usually the chat database
+            daily_token_budget (int, optional): Tokens allowed per local day. Defaults to None (no limit).
+            clock (callable, optional): Returns the current local time as a datetime. Defaults to datetime.now.
+        """
+        self.db_name = db_name
+        self.daily_token_budget = daily_token_budget
+        self.clock = clock or datetime.now
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_name, timeout=30, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS gemini_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TEXT NOT NULL,
+                day TEXT NOT NULL,
+                model TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                prompt_chars INTEGER DEFAULT 0,
+                context_chars INTEGER DEFAULT 0,
+                prompt_tokens INTEGER DEFAULT 0,
+                cached_tokens INTEGER DEFAULT 0,
+                response_tokens INTEGER DEFAULT 0,
+                thoughts_tokens INTEGER DEFAULT 0,
+                total_tokens INTEGER DEFAULT 0,
+                latency_ms REAL,
+                attempt INTEGER DEFAULT 1,
+                outcome TEXT NOT NULL,
+                error TEXT
+            )
+        """)
+        # Rollups and the budget read one day at a time
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_gemini_requests_day ON gemini_requests (day, model, operation, total_tokens)"
+        )
+        self.conn.commit()
+        # Tokens used today, so check_budget does not query on every request
+        self.budget_day = None
+        self.budget_used = 0
+
+    def record(self, model, operation, usage=EMPTY_USAGE, latency_ms=None, outcome="ok", error=None,
+               prompt_chars=0, context_chars=0, attempt=1, started_at=None):
+        """
+        Store one request.
+
+        Args:
+            model (str): Model the request went to
+            operation (str): What it was for, e.g. 'classify' or 'embed'
+            usage (Usage, optional): Token counts of the response
+            latency_ms (float, optional): Time until the response was complete
+            outcome (str, optional): 'ok', 'error', 'invalid' (unusable response) or 'blocked' (refused
+                by the budget). Defaults to 'ok'.
+            error (str, optional): The error of a failed request
+            prompt_chars (int, optional): Characters sent
+            context_chars (int, optional): Part of prompt_chars repeated in every request (the projects context)
+            attempt (int, optional): 1 for the first try, 2 for the first retry and so on
+            started_at (datetime, optional): When the request was sent. Defaults to now.
+        """
+        started_at = started_at or self.clock()
+        with self.lock:
+            self.conn.execute(
+                """INSERT INTO gemini_requests
+                   (started_at, day, model, operation, prompt_chars, context_chars, prompt_tokens, cached_tokens,
+                    response_tokens, thoughts_tokens, total_tokens, latency_ms, attempt, outcome, error)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (started_at.strftime("%Y-%m-%d %H:%M:%S"), started_at.strftime("%Y-%m-%d"), model, operation,
+                 prompt_chars, context_chars, *usage, latency_ms, attempt, outcome, error)
+            )
+            self.conn.commit()
+            if self.budget_day == started_at.strftime("%Y-%m-%d"):
+                self.budget_used += usage.total_tokens
+
+    @contextmanager
+    def track(self, model, operation, prompt_chars=0, context_chars=0):
+        """
+        Time a request and record it when the block ends, as failed if it raised.
+
+        Usage:
+            with ledger.track(model, "classify", len(prompt)) as request:
+                response = client.models.generate_content(...)
+                request.set_response(response)
+        """
+        record = RequestRecord()
+        started_at = self.clock()
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            self.record(model, operation, record.usage, (time.perf_counter() - start) * 1000, "error",
+                        f"{type(e).__name__}: {e}"[:500], prompt_chars, context_chars, record.attempt, started_at)
+            raise
+        self.record(model, operation, record.usage, (time.perf_counter() - start) * 1000, record.outcome,
+                    record.error, prompt_chars, context_chars, record.attempt, started_at)
+
+    def tokens_used(self, day=None):
+        """Return the tokens used on a day ('YYYY-MM-DD', defaults to today)."""
+        day = day or self.clock().strftime("%Y-%m-%d")
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COALESCE(SUM(total_tokens), 0) FROM gemini_requests WHERE day = ?", (day,)
+            ).fetchone()
+        return row[0]
+
+    def remaining_today(self):
+        """Return the tokens left in today's budget, or None without a budget."""
+        if self.daily_token_budget is None:
+            return None
+        today = self.clock().strftime("%Y-%m-%d")
+        if self.budget_day != today:
+            # Read once a day; record() keeps the total current afterwards
+            self.budget_used = self.tokens_used(today)
+            self.budget_day = today
+        return max(0, self.daily_token_budget - self.budget_used)
+
+    def check_budget(self, model=None, operation=None):
+        """
+        Raise BudgetExceeded if today's token budget is used up.
+
+        The refusal is recorded with outcome 'blocked' when model and operation are given.
+        """
+        remaining = self.remaining_today()
+        if remaining is None or remaining > 0:
+            return
+        if model is not None and operation is not None:
+            self.record(model, operation, outcome="blocked", error="daily token budget used up")
+        raise BudgetExceeded(
+            f"Daily token budget of {self.daily_token_budget} reached; requests resume tomorrow"
+        )
+
+    def rollup(self, by=ROLLUP_COLUMNS, since=None, until=None):
+        """
+        Sum the requests by day, model and/or operation.
+
+        Args:
+            by (tuple, optional): Grouping columns, any of ROLLUP_COLUMNS. Defaults to all three.
+            since (str, optional): First day included, 'YYYY-MM-DD'
+            until (str, optional): Last day included, 'YYYY-MM-DD'
+
+        Returns:
+            list: UsageRollup tuples, ordered by the grouping columns
+        """
+        for column in by:
+            if column not in ROLLUP_COLUMNS:
+                raise ValueError(f"Cannot group requests by {column!r}")
+        keys = [column if column in by else "NULL" for column in ROLLUP_COLUMNS]
+        conditions = []
+        params = []
+        if since:
+            conditions.append("day >= ?")
+            params.append(since)
+        if until:
+            conditions.append("day <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        group = f"GROUP BY {', '.join(by)} ORDER BY {', '.join(by)}" if by else ""
+
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT {', '.join(keys)}, COUNT(*), SUM(outcome != 'ok'), SUM(prompt_chars), SUM(context_chars),
+                        SUM(prompt_tokens), SUM(cached_tokens), SUM(response_tokens), SUM(total_tokens),
+                        ROUND(AVG(latency_ms), 1), ROUND(MAX(latency_ms), 1)
+                    FROM gemini_requests {where} {group}""",
+                params
+            ).fetchall()
+        return [UsageRollup._make(row) for row in rows if row[3]]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show the token use of the Gemini requests recorded in a database")
+    parser.add_argument("--db", default="chat.db", help="Path to the SQLite database")
+    parser.add_argument("--by", default="day,model,operation", help="Comma separated grouping columns")
+    parser.add_argument("--since", default=None, help="First day, YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    ledger = UsageLedger(args.db)
+    by = tuple(column for column in args.by.split(",") if column)
+    print(" | ".join(by + ("requests", "errors", "prompt_tokens", "response_tokens", "total_tokens", "avg_ms",
+                           "context_share")))
+    for row in ledger.rollup(by, args.since):
+        share = f"{row.context_chars / row.prompt_chars:.0%}" if row.prompt_chars else "-"
+        keys = tuple(str(getattr(row, column)) for column in by)
+        print(" | ".join(keys + (str(row.requests), str(row.errors), str(row.prompt_tokens), str(row.response_tokens),
+                                 str(row.total_tokens), str(row.avg_latency_ms), share)))
+    ledger.close()
+
+
+if __name__ == "__main__":
+    main()
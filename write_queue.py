@@ -0,0 +1,189 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from database_utils import DatabaseHandler
+
+# Marks the end of the work queue for the writer thread
+_STOP = object()
+
+
+class WriteResult:
+    """Outcome of a queued insert, picked up by the UI thread through drain_results."""
+
+    __slots__ = ("provisional_id", "message_id", "error", "attempts")
+
+    def __init__(self, provisional_id, message_id=None, error=None, attempts=1):
+        self.provisional_id = provisional_id
+        self.message_id = message_id
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class WriteBehindQueue:
+    """
+    Insert messages on a background thread so the Tk thread never waits on disk.
+
+    Pending inserts are coalesced into group commits: the writer takes everything
+    queued at the moment it wakes up (up to max_batch rows) and stores it with a
+    single DatabaseHandler.insert_messages call. Results are not delivered through
+    callbacks, because Tk must only be touched from its own thread; the UI polls
+    drain_results instead.
+    """
+
+    def __init__(self, db_name, max_batch=200, coalesce_delay=0.02, max_retries=3, retry_delay=0.5,
+                 deduplicate=False, cipher=None):
+        """
+        Args:
+            db_name (str): The database file, opened on a connection owned by the writer thread
+            max_batch (int, optional): Maximum rows per group commit. Defaults to 200.
+            coalesce_delay (float, optional): Seconds to wait for more rows before committing. Defaults to 0.02.
+            max_retries (int, optional): Attempts per group before reporting a failure. Defaults to 3.
+            retry_delay (float, optional): Seconds before the first retry, doubled each time. Defaults to 0.5.
+            deduplicate (bool, optional): Collapse or link duplicate messages on insert. Defaults to False.
+            cipher (MessageCipher, optional): Encrypt the messages on insert, for an encrypted database
+                (see DatabaseHandler.enable_encryption). Defaults to None.
+        """
+        self.db_name = db_name
+        self.max_batch = max_batch
+        self.coalesce_delay = coalesce_delay
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.deduplicate = deduplicate
+        self.cipher = cipher
+
+        self.pending = queue.Queue()
+        self.results = queue.Queue()
+        # Rows that could not be stored, kept so close() can hand them back
+        self.failed = {}
+        self.lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def submit(self, provisional_id, row):
+        """
+        Queue a message for insertion.
+
+        Args:
+            provisional_id (int): ID the UI shows until the real one is known
+            row (dict): Column values, with at least 'sender' and 'message'
+        """
+        with self.lock:
+            self.failed.pop(provisional_id, None)
+        self.pending.put((provisional_id, dict(row)))
+
+    def drain_results(self):
+        """Return every result reported since the last call, without blocking."""
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def flush(self):
+        """Block until every queued row has been committed or has failed."""
+        self.pending.join()
+
+    def close(self):
+        """
+        Commit everything still queued and stop the writer thread.
+
+        Returns:
+            dict: provisional_id -> row for the messages that could not be stored
+        """
+        self.pending.put(_STOP)
+        self.thread.join()
+        with self.lock:
+            return dict(self.failed)
+
+    def _run(self):
+        db_handler = DatabaseHandler(self.db_name)
+        try:
+            if self.deduplicate:
+                db_handler.enable_deduplication()
+            if self.cipher is not None:
+                db_handler.use_cipher(self.cipher)
+            while True:
+                item = self.pending.get()
+                if item is _STOP:
+                    self.pending.task_done()
+                    return
+
+                batch = [item]
+                stop = False
+                # Give the user a moment to type the next message so it joins this commit
+                deadline = time.monotonic() + self.coalesce_delay
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self.pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stop = True
+                        break
+                    batch.append(item)
+
+                self._write_batch(db_handler, batch)
+                for _ in batch:
+                    self.pending.task_done()
+
+                if stop:
+                    self.pending.task_done()
+                    return
+        finally:
+            db_handler.close()
+
+    def _write_batch(self, db_handler, batch):
+        delay = self.retry_delay
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                message_ids = db_handler.insert_messages([row for _, row in batch])
+            except Exception as e:
+                error = e
+                if attempt < self.max_retries:
+                    time.sleep(delay)
+                    delay *= 2
+                continue
+
+            for (provisional_id, _), message_id in zip(batch, message_ids):
+                self.results.put(WriteResult(provisional_id, message_id, attempts=attempt))
+            return
+
+        if len(batch) > 1 and not isinstance(error, sqlite3.OperationalError):
+            # Store the rows one by one so a single bad row does not fail the whole group
+            for item in batch:
+                self._write_batch(db_handler, [item])
+            return
+
+        with self.lock:
+            for provisional_id, row in batch:
+                self.failed[provisional_id] = row
+        for provisional_id, _ in batch:
+            self.results.put(WriteResult(provisional_id, error=error, attempts=self.max_retries))
+
+
+def save_unsaved_messages(path, rows):
+    """Append rows that could not be written to a JSONL recovery file."""
+    with open(path, "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False))
+            f.write("\n")
+
+
+def load_unsaved_messages(path):
+    """Read and remove a recovery file written by save_unsaved_messages."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    os.remove(path)
+    return rows